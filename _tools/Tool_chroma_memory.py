@@ -0,0 +1,69 @@
+"""
+Quản lý trí nhớ hội thoại trong Chroma (CHROMA_PERSIST_DIR / CHROMA_HOST theo api/config).
+
+Chạy:
+    python _tools/Tool_chroma_memory.py stats
+    python _tools/Tool_chroma_memory.py export backup/memory.jsonl [--session <session_id>]
+    python _tools/Tool_chroma_memory.py import backup/memory.jsonl
+    python _tools/Tool_chroma_memory.py evict --ttl-days 90 --max-records 200000
+    python _tools/Tool_chroma_memory.py purge-orphans
+    python _tools/Tool_chroma_memory.py rebuild
+
+evict/purge-orphans chạy được khi server đang chạy (server cũng tự chạy định kỳ, xem MEMORY_*);
+rebuild (thu hồi chỗ của bản ghi đã xoá) chỉ chạy khi server đã dừng.
+"""
+import argparse
+import os
+import time
+
+for _name in ("AZURE_OPENAI_ENDPOINT", "AZURE_OPENAI_API_KEY", "AZURE_OPENAI_API_VERSION", "AZURE_OPENAI_DEPLOYMENT"):
+    os.environ.setdefault(_name, "offline-tool")
+
+from api.config.config import MEMORY_MAX_RECORDS, MEMORY_TTL_DAYS
+from api.services import chat_service, memory_maintenance
+from api.utils.conversation_logger import init_db
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("stats", help="số lượt, số session đang lưu")
+    export = commands.add_parser("export", help="ghi trí nhớ ra file JSON lines")
+    export.add_argument("path")
+    export.add_argument("--session", help="chỉ xuất 1 session")
+    load = commands.add_parser("import", help="nạp file JSON lines (ID đã có thì ghi đè)")
+    load.add_argument("path")
+    evict = commands.add_parser("evict", help="xoá lượt cũ theo TTL / số lượng tối đa")
+    evict.add_argument("--ttl-days", type=float, default=MEMORY_TTL_DAYS)
+    evict.add_argument("--max-records", type=int, default=MEMORY_MAX_RECORDS)
+    orphans = commands.add_parser("purge-orphans", help="xoá vector của session không còn trong SQLite")
+    orphans.add_argument("--grace-s", type=float, default=memory_maintenance.ORPHAN_GRACE_S)
+    commands.add_parser("rebuild", help="chép bản ghi còn sống sang collection mới (server phải dừng)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    count = memory_maintenance.warm_start()
+    print(f"📂 '{chat_service.collection.name}': {count} lượt (mở trong {time.perf_counter() - start:.2f}s)")
+
+    if args.command == "stats":
+        sessions = {m.get("session_id") for page in memory_maintenance.iter_pages(chat_service.collection,
+                                                                                    ["metadatas"])
+                    for m in page["metadatas"] if m}
+        print(f"   {len(sessions)} session")
+    elif args.command == "export":
+        print(f"✅ Đã xuất {memory_maintenance.export_memory(args.path, args.session)} lượt → {args.path}")
+    elif args.command == "import":
+        print(f"✅ Đã nạp {memory_maintenance.import_memory(args.path)} lượt từ {args.path}")
+    elif args.command == "evict":
+        result = memory_maintenance.evict(args.ttl_days, args.max_records)
+        print(f"✅ Đã xoá {result['ttl']} lượt quá hạn, {result['size']} lượt vượt giới hạn")
+    elif args.command == "purge-orphans":
+        init_db()
+        print(f"✅ Đã xoá {memory_maintenance.purge_orphans(args.grace_s)} lượt của session đã xoá")
+    elif args.command == "rebuild":
+        print(f"✅ Rebuild xong: {memory_maintenance.rebuild()} lượt")
+    print(f"📂 Còn {chat_service.collection.count()} lượt")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Xuất model embedding (LOCAL_EMBEDDING_MODEL) sang ONNX rồi lượng tử hoá động int8 cho EMBEDDER_BACKEND=onnx-int8.
+
+Chạy:
+    python _tools/Tool_export_onnx_embedder.py
+    python _tools/Tool_export_onnx_embedder.py --out artifacts/onnx/my-model --reembed
+
+Vector int8 nằm cùng không gian với bản fp32 nên collection cũ dùng tiếp được; kiểm tra độ khớp bằng
+benchmarks/bench_embedder_backends.py. Muốn đồng nhất hẳn (mọi vector đều do bản int8 tạo) thì thêm --reembed.
+"""
+import argparse
+import os
+
+for _name in ("AZURE_OPENAI_ENDPOINT", "AZURE_OPENAI_API_KEY", "AZURE_OPENAI_API_VERSION", "AZURE_OPENAI_DEPLOYMENT"):
+    os.environ.setdefault(_name, "offline-export")
+
+from api.config.config import LOCAL_EMBEDDING_MODEL, ONNX_EMBEDDER_PATH
+from api.services.onnx_embedder import ONNX_MODEL_FILE
+
+FP32_MODEL_FILE = "model.onnx"
+
+
+def export(model_name: str, out_dir: str, opset: int = 14):
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+
+    sample = tokenizer(["Ai phụ trách việc này?"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    fp32_path = os.path.join(out_dir, FP32_MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+        )
+
+    int8_path = os.path.join(out_dir, ONNX_MODEL_FILE)
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    tokenizer.save_pretrained(out_dir)
+
+    print(f"✅ fp32 : {fp32_path} ({os.path.getsize(fp32_path) / 1e6:.1f} MB)")
+    print(f"✅ int8 : {int8_path} ({os.path.getsize(int8_path) / 1e6:.1f} MB)")
+
+
+def reembed_collection(out_dir: str, batch_size: int = 256):
+    """
+    Encode lại toàn bộ câu hỏi trong collection Chroma bằng model int8 (metadata giữ nguyên).
+    Bản ghi cũ không có metadata "question" → lấy câu hỏi từ document; không tách được thì giữ vector cũ.
+    """
+    from api.services.chat_service import extract_qa_from_doc
+    from api.services.chroma_client import get_chroma_collection
+    from api.services.onnx_embedder import OnnxEmbedder
+
+    collection = get_chroma_collection()
+    embedder = OnnxEmbedder(out_dir)
+    total, offset, updated, skipped = collection.count(), 0, 0, 0
+    while offset < total:
+        page = collection.get(include=["metadatas", "documents"], limit=batch_size, offset=offset)
+        if not page["ids"]:
+            break
+        ids, questions = [], []
+        for doc_id, meta, doc in zip(page["ids"], page["metadatas"], page["documents"]):
+            question = (meta or {}).get("question") or extract_qa_from_doc(doc or "")[0]
+            if question:
+                ids.append(doc_id)
+                questions.append(question)
+            else:
+                skipped += 1
+        if ids:
+            collection.update(ids=ids, embeddings=embedder.encode(questions).tolist())
+            updated += len(ids)
+        offset += len(page["ids"])
+        print(f"   re-embed {offset}/{total}")
+    print(f"✅ Đã encode lại {updated} bản ghi" + (f", bỏ qua {skipped} bản ghi không có câu hỏi" if skipped else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=LOCAL_EMBEDDING_MODEL)
+    parser.add_argument("--out", default=ONNX_EMBEDDER_PATH)
+    parser.add_argument("--opset", type=int, default=14)
+    parser.add_argument("--reembed", action="store_true", help="encode lại collection Chroma bằng model int8")
+    args = parser.parse_args()
+
+    export(args.model, args.out, args.opset)
+    if args.reembed:
+        reembed_collection(args.out)
+
+
+if __name__ == "__main__":
+    main()
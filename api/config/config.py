@@ -17,10 +17,168 @@ AZURE_OPENAI_API_VERSION = get_env_variable("AZURE_OPENAI_API_VERSION")
 AZURE_OPENAI_DEPLOYMENT = get_env_variable("AZURE_OPENAI_DEPLOYMENT")
 
 PROMPT_PATH = "prompt/prompt-guidelines.md"
+MEETING_SUMMARY_TEMPLATE_PATH = "prompt/templates/meeting_summary_template.md"
 LOG_DIR = "api/artifacts/conversation_log"
 
+# Trí nhớ hội thoại (Chroma): thư mục lưu trên đĩa (để trống = chỉ trong RAM), tên collection,
+# hoặc Chroma server dùng chung (CHROMA_HOST) khi chạy nhiều worker
 CHROMA_PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR", "./db/chroma")
+CHROMA_COLLECTION = os.getenv("CHROMA_COLLECTION", "chat_collection")
+CHROMA_HOST = os.getenv("CHROMA_HOST", "")
+CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8000"))
 DATABASE_URL = os.getenv("DATABASE_URL", "./db/app_data.db")
 SECRET_KEY = os.getenv("SECRET_KEY", "secretdev")
 ARTIFACTS_DIR = os.path.join(os.path.dirname(__file__), "../artifacts")
-AUDIO_DIR = os.path.abspath(os.path.join(ARTIFACTS_DIR, "audio"))
\ No newline at end of file
+# Thư mục audio TTS duy nhất: chat_tts ghi vào đây, main.py phục vụ tại /audio
+AUDIO_DIR = os.path.abspath(os.getenv("AUDIO_DIR", os.path.join(ARTIFACTS_DIR, "audio")))
+
+# Số lượt hội thoại gom lại trước khi ghi vào Chroma (<= 1: ghi ngay từng lượt)
+CHROMA_WRITE_BUFFER_SIZE = int(os.getenv("CHROMA_WRITE_BUFFER_SIZE", "0"))
+
+# Cache embedding: số vector giữ trong RAM và file SQLite trên đĩa (để trống = tắt tầng đĩa)
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(ARTIFACTS_DIR, "embedding_cache.db"))
+# Số vector tối đa trên đĩa (~1.5 KB/vector 384 chiều), vượt thì xoá vector ghi cũ nhất (0 = không giới hạn)
+EMBEDDING_CACHE_DISK_MAX_ITEMS = int(os.getenv("EMBEDDING_CACHE_DISK_MAX_ITEMS", "200000"))
+
+# Micro-batching cho model cục bộ: số item tối đa mỗi lô và thời gian chờ gom lô (ms)
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "32"))
+EMBED_BATCH_MAX_WAIT_MS = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "5"))
+RERANK_BATCH_MAX_SIZE = int(os.getenv("RERANK_BATCH_MAX_SIZE", "32"))
+RERANK_BATCH_MAX_WAIT_MS = float(os.getenv("RERANK_BATCH_MAX_WAIT_MS", "5"))
+
+# Pipeline bất đồng bộ: số thread cho code blocking và giới hạn đồng thời theo từng stage
+EXECUTOR_MAX_WORKERS = int(os.getenv("EXECUTOR_MAX_WORKERS", str(min(32, (os.cpu_count() or 1) + 4))))
+STAGE_CONCURRENCY = {
+    "llm": int(os.getenv("CONCURRENCY_LLM", "16")),        # gọi Azure OpenAI (mặc định của AZURE_MAX_CONCURRENCY)
+    "memory": int(os.getenv("CONCURRENCY_MEMORY", "8")),   # embedding + truy vấn/ghi Chroma
+    "tts": int(os.getenv("CONCURRENCY_TTS", "2")),         # suy luận VITS
+    "db": int(os.getenv("CONCURRENCY_DB", "8")),           # đọc/ghi SQLite
+    "default": int(os.getenv("CONCURRENCY_DEFAULT", "8")),
+}
+
+# TTS dạng stream: độ dài tối đa mỗi đoạn (ký tự) và số đoạn synthesize trước
+TTS_CHUNK_MAX_CHARS = int(os.getenv("TTS_CHUNK_MAX_CHARS", "200"))
+TTS_STREAM_PREFETCH = int(os.getenv("TTS_STREAM_PREFETCH", "2"))
+# Độ dài văn bản tối đa mỗi request /api/tts/stream (ký tự) — synthesize tốn CPU
+TTS_MAX_CHARS = int(os.getenv("TTS_MAX_CHARS", "5000"))
+
+# Cache audio TTS: dung lượng tối đa trên đĩa (byte), vượt quá thì xoá file ít dùng nhất
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+# Định dạng audio TTS mặc định: "opus" (Ogg/Opus), "mp3" hoặc "wav" — client chọn theo request bằng "audio_format"
+TTS_AUDIO_FORMAT = os.getenv("TTS_AUDIO_FORMAT", "opus").strip().lower()
+# Dọn audio chạy nền mỗi AUDIO_GC_INTERVAL_S giây (0 = tắt): xoá file không còn được conversation_history
+# tham chiếu sau AUDIO_UNREFERENCED_GRACE_S giây, xoá mọi file không dùng tới quá AUDIO_MAX_AGE_DAYS ngày
+# (0 = không giới hạn); vượt TTS_CACHE_MAX_BYTES thì xoá file không được tham chiếu trước
+AUDIO_GC_INTERVAL_S = float(os.getenv("AUDIO_GC_INTERVAL_S", "3600"))
+AUDIO_UNREFERENCED_GRACE_S = float(os.getenv("AUDIO_UNREFERENCED_GRACE_S", "3600"))
+AUDIO_MAX_AGE_DAYS = float(os.getenv("AUDIO_MAX_AGE_DAYS", "0"))
+# Cache-Control cho /audio (tên file theo nội dung → không bao giờ đổi, cache lâu được)
+AUDIO_HTTP_MAX_AGE_S = int(os.getenv("AUDIO_HTTP_MAX_AGE_S", str(365 * 24 * 3600)))
+
+# Model registry: tắt model không dùng (vd: "tts,reranker") và model load sẵn khi khởi động
+DISABLED_MODELS = {m.strip() for m in os.getenv("DISABLED_MODELS", "").split(",") if m.strip()}
+WARMUP_MODELS = [m.strip() for m in os.getenv("WARMUP_MODELS", "embedder").split(",") if m.strip()]
+
+# File SQLite lưu lịch sử hội thoại (benchmark/test trỏ sang file tạm để không đụng dữ liệu thật)
+CONVERSATION_DB_PATH = os.getenv("CONVERSATION_DB_PATH", "conversation.db")
+
+# Số connection SQLite giữ trong pool (dùng lại giữa các request)
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", os.getenv("CONCURRENCY_DB", "8")))
+# Thời gian tối đa chờ 1 connection rảnh khi pool đã đầy (giây), quá thì báo lỗi thay vì treo stage "db"
+SQLITE_POOL_TIMEOUT_S = float(os.getenv("SQLITE_POOL_TIMEOUT_S", "30"))
+
+# Trạng thái hội thoại dùng chung giữa các worker: backend ("sqlite" | "memory"),
+# file SQLite dùng chung và số session giữ trong LRU của mỗi worker
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "sqlite").strip().lower()
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", CONVERSATION_DB_PATH)
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "1000"))
+
+# Cửa sổ ngữ cảnh: ngân sách token cho lịch sử gửi lên model; vượt ngân sách thì gộp các lượt cũ
+# vào bản tóm tắt cuốn chiếu (xuống còn CONTEXT_FOLD_TARGET_TOKENS), mỗi lần gộp tối đa CONTEXT_FOLD_CHUNK_TOKENS
+CONTEXT_HISTORY_TOKENS = int(os.getenv("CONTEXT_HISTORY_TOKENS", "3000"))
+CONTEXT_FOLD_TARGET_TOKENS = int(os.getenv("CONTEXT_FOLD_TARGET_TOKENS", str(CONTEXT_HISTORY_TOKENS // 2)))
+CONTEXT_FOLD_CHUNK_TOKENS = int(os.getenv("CONTEXT_FOLD_CHUNK_TOKENS", "4000"))
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "400"))
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "o200k_base")
+
+# Tóm tắt biên bản họp dài (map-reduce): token tối đa mỗi đoạn, số đoạn tóm tắt song song,
+# số bản tóm tắt gộp trong 1 lần reduce và độ dài biên bản tối đa (ký tự)
+TRANSCRIPT_CHUNK_TOKENS = int(os.getenv("TRANSCRIPT_CHUNK_TOKENS", "3000"))
+TRANSCRIPT_CONCURRENCY = int(os.getenv("TRANSCRIPT_CONCURRENCY", "8"))
+TRANSCRIPT_REDUCE_FANOUT = int(os.getenv("TRANSCRIPT_REDUCE_FANOUT", "8"))
+TRANSCRIPT_MAX_CHARS = int(os.getenv("TRANSCRIPT_MAX_CHARS", "2000000"))
+# Mỗi lần gọi model khi tóm tắt biên bản: token trả về tối đa (JSON MeetingSummarySchema gộp từ nhiều phần
+# dài hơn câu trả lời chat) và timeout (giây)
+TRANSCRIPT_MAX_OUTPUT_TOKENS = int(os.getenv("TRANSCRIPT_MAX_OUTPUT_TOKENS", "3000"))
+TRANSCRIPT_TIMEOUT_S = float(os.getenv("TRANSCRIPT_TIMEOUT_S", "120"))
+
+# Batch chat: số message tối đa mỗi request và số session xử lý song song
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+BATCH_SESSION_CONCURRENCY = int(os.getenv("BATCH_SESSION_CONCURRENCY", "8"))
+
+# Hedged mode: gọi Azure OpenAI song song với tìm trí nhớ, huỷ nếu trí nhớ trùng (có thể bật theo request: "hedge")
+HEDGED_LLM = os.getenv("HEDGED_LLM", "false").strip().lower() in ("1", "true", "yes")
+
+# Truy xuất 2 bước cho search_memory: lấy RERANK_CANDIDATES ứng viên (ANN), chấm lại RERANK_TOP_N ứng viên
+# tốt nhất bằng CrossEncoder; ước lượng/thực tế vượt RERANK_BUDGET_MS thì bỏ qua rerank (dùng cosine).
+# Mặc định tắt: RERANKER_MODEL là model ms-marco tiếng Anh, chưa đo trên cặp câu hỏi tiếng Việt —
+# chỉ bật sau khi chạy benchmarks/eval_rerank.py trên dữ liệu thật và đặt ngưỡng bên dưới theo kết quả.
+RERANK_ENABLED = os.getenv("RERANK_ENABLED", "false").strip().lower() in ("1", "true", "yes")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "20"))
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "8"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "150"))
+# Ngưỡng riêng cho điểm CrossEncoder (sigmoid của logit ms-marco, thang khác cosine 0.7 / 0.9):
+# ≥ HIT → dùng lại câu trả lời cũ, ≥ ANSWER → chỉ lấy phần câu trả lời. Giá trị mặc định CHƯA được hiệu chỉnh:
+# đặt theo dòng "suggested" của `python -m benchmarks.eval_rerank` trước khi bật RERANK_ENABLED.
+RERANK_HIT_THRESHOLD = float(os.getenv("RERANK_HIT_THRESHOLD", "0.9"))
+RERANK_ANSWER_THRESHOLD = float(os.getenv("RERANK_ANSWER_THRESHOLD", "0.97"))
+
+# Backend của model embedding cục bộ: "torch" (SentenceTransformer, mặc định) hoặc "onnx-int8"
+# (ONNX Runtime, lượng tử hoá int8 — tạo bằng _tools/Tool_export_onnx_embedder.py)
+EMBEDDER_BACKEND = os.getenv("EMBEDDER_BACKEND", "torch").strip().lower()
+ONNX_EMBEDDER_PATH = os.getenv("ONNX_EMBEDDER_PATH", os.path.join(ARTIFACTS_DIR, "onnx", "multi-qa-MiniLM-L6-cos-v1-int8"))
+ONNX_NUM_THREADS = int(os.getenv("ONNX_NUM_THREADS", "0"))  # 0 = để ONNX Runtime tự chọn
+
+# Header Server-Timing (thời gian từng stage của request) — tắt nếu không muốn lộ chi tiết nội bộ ra client
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+
+# Ghi lịch sử (SQLite + Chroma) sau khi đã trả lời (write-behind): lượt chat được ghi vào journal
+# append-only trước, rồi worker nền ghi theo lô; journal được replay khi khởi động lại
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+WRITE_BEHIND_JOURNAL_DIR = os.getenv("WRITE_BEHIND_JOURNAL_DIR", os.path.join(ARTIFACTS_DIR, "journal"))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "64"))
+WRITE_BEHIND_MAX_WAIT_MS = float(os.getenv("WRITE_BEHIND_MAX_WAIT_MS", "50"))
+WRITE_BEHIND_FSYNC = os.getenv("WRITE_BEHIND_FSYNC", "true").strip().lower() in ("1", "true", "yes")
+# Đọc ngay sau khi ghi (search_memory, GET /api/chat/{id}) chờ tối đa chừng này để lượt mới được ghi xong
+WRITE_BEHIND_READ_TIMEOUT_S = float(os.getenv("WRITE_BEHIND_READ_TIMEOUT_S", "5"))
+
+# Client Azure OpenAI dùng chung: pool kết nối keep-alive, số lời gọi đồng thời tối đa (mặc định theo stage "llm"),
+# quota của deployment (request/token mỗi phút, 0 = chưa biết → lấy theo header x-ratelimit-limit-* khi có)
+# và số lần thử lại khi gặp 429/lỗi mạng/5xx
+AZURE_MAX_CONNECTIONS = int(os.getenv("AZURE_MAX_CONNECTIONS", "64"))
+AZURE_KEEPALIVE_CONNECTIONS = int(os.getenv("AZURE_KEEPALIVE_CONNECTIONS", "32"))
+AZURE_KEEPALIVE_EXPIRY_S = float(os.getenv("AZURE_KEEPALIVE_EXPIRY_S", "60"))
+AZURE_MAX_CONCURRENCY = int(os.getenv("AZURE_MAX_CONCURRENCY", str(STAGE_CONCURRENCY["llm"])))
+AZURE_RPM_LIMIT = float(os.getenv("AZURE_RPM_LIMIT", "0"))
+AZURE_TPM_LIMIT = float(os.getenv("AZURE_TPM_LIMIT", "0"))
+AZURE_MAX_RETRIES = int(os.getenv("AZURE_MAX_RETRIES", "4"))
+AZURE_EMBEDDING_DEPLOYMENT = os.getenv("AZURE_EMBEDDING_DEPLOYMENT", "text-embedding-3-small")
+
+# Bảo trì trí nhớ Chroma (chạy nền mỗi MEMORY_MAINTENANCE_INTERVAL_S giây, 0 = tắt): xoá lượt cũ hơn
+# MEMORY_TTL_DAYS ngày, giữ tối đa MEMORY_MAX_RECORDS lượt (xoá lượt cũ nhất trước), dọn vector của
+# session đã bị xoá khỏi SQLite (0 = không giới hạn)
+MEMORY_MAINTENANCE_INTERVAL_S = float(os.getenv("MEMORY_MAINTENANCE_INTERVAL_S", "3600"))
+MEMORY_TTL_DAYS = float(os.getenv("MEMORY_TTL_DAYS", "0"))
+MEMORY_MAX_RECORDS = int(os.getenv("MEMORY_MAX_RECORDS", "0"))
+
+# Cache câu trả lời theo câu hỏi đã chuẩn hoá (tầng đầu, trước embedding + Chroma): số mục / dung lượng tối đa
+# trong RAM, thời gian sống (giây, 0 = không hết hạn) và phạm vi mặc định — "session" (chỉ trong session),
+# "global" (dùng chung mọi session), tên namespace tuỳ ý (vd: mã nhóm) hoặc "off"; client chọn theo request
+# bằng trường "cache_scope"
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+ANSWER_CACHE_MAX_ITEMS = int(os.getenv("ANSWER_CACHE_MAX_ITEMS", "10000"))
+ANSWER_CACHE_MAX_BYTES = int(os.getenv("ANSWER_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+ANSWER_CACHE_TTL_S = float(os.getenv("ANSWER_CACHE_TTL_S", "86400"))
+ANSWER_CACHE_DEFAULT_SCOPE = os.getenv("ANSWER_CACHE_DEFAULT_SCOPE", "session").strip()
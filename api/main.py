@@ -1,15 +1,26 @@
-from fastapi import FastAPI
+import time
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
-from api.routes import ai_chat, ai_batch
-from api.utils.conversation_logger import init_db
+from api.routes import ai_chat, ai_batch, ai_tts, ai_transcript
+from api.utils.conversation_logger import init_db, close_db
+from api.services.chat_service import flush_chroma_buffer
+from api.services.session_store import session_store
+from api.services.write_behind import write_behind
+from api.services.memory_maintenance import memory_maintenance
+from api.services.chat_tts import audio_gc
+from api.utils.concurrency import run_in_stage, shutdown_executor
+from api.services.model_registry import registry
+from api.config.config import AUDIO_DIR, AUDIO_HTTP_MAX_AGE_S, SERVER_TIMING_ENABLED, WARMUP_MODELS
+from api.utils import metrics
 from contextlib import asynccontextmanager
 import os
 
 # =========================
-# Tạo folder audio nếu chưa có
+# Tạo folder audio nếu chưa có (cùng thư mục chat_tts ghi file, cấu hình bằng AUDIO_DIR)
 # =========================
-AUDIO_DIR = "artifacts/audio"
 os.makedirs(AUDIO_DIR, exist_ok=True)
 
 # =========================
@@ -19,7 +30,18 @@ os.makedirs(AUDIO_DIR, exist_ok=True)
 async def lifespan(app: FastAPI):
     print("🚀 Server starting, checking database...")
     init_db()  # init DB khi startup
+    await run_in_stage("memory", memory_maintenance.start)  # mở trí nhớ Chroma trên đĩa + bảo trì định kỳ
+    await run_in_stage("db", write_behind.start)  # replay journal còn sót rồi chạy worker ghi nền
+    await run_in_stage("default", registry.warmup, WARMUP_MODELS)  # load sẵn model cần thiết
+    audio_gc.start()  # dọn audio không còn được lịch sử tham chiếu
     yield
+    audio_gc.stop()
+    write_behind.stop()  # ghi nốt các lượt đang chờ
+    memory_maintenance.stop()
+    flush_chroma_buffer()  # ghi nốt các lượt còn trong bộ đệm
+    shutdown_executor()
+    session_store.close()
+    close_db()
 
 # =========================
 # Tạo app
@@ -39,18 +61,56 @@ app.add_middleware(
     allow_origins=["*"],   # cho phép frontend gọi
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing"],  # cursor phân trang + thời gian từng stage cho frontend
+)
+
+http_seconds = metrics.histogram(
+    "meeting_http_request_duration_seconds", "Thời gian xử lý request HTTP", ("method", "route", "status")
 )
 
+
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    """Đo thời gian request + gom thời gian từng stage vào header Server-Timing."""
+    token = metrics.start_request_timing()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        timings = metrics.finish_request_timing(token)
+    elapsed = time.perf_counter() - start
+    route = request.scope.get("route")
+    http_seconds.observe(elapsed, method=request.method, route=getattr(route, "path", "unmatched"),
+                         status=response.status_code)
+    # Response dạng stream: header đã được tạo trước khi các stage chạy xong → chỉ có phần đã đo được
+    if SERVER_TIMING_ENABLED:
+        response.headers["Server-Timing"] = metrics.server_timing_header(timings, elapsed)
+    return response
+
 # =========================
 # Mount static folder audio
 # =========================
-app.mount("/audio", StaticFiles(directory=AUDIO_DIR), name="audio")
+class AudioFiles(StaticFiles):
+    """
+    File audio đặt tên theo nội dung (sha256) → không bao giờ đổi: cho phép cache lâu ở trình duyệt/CDN.
+    Range request (tua, phát dần) và ETag/Last-Modified do FileResponse/StaticFiles xử lý sẵn.
+    """
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = f"public, max-age={AUDIO_HTTP_MAX_AGE_S}, immutable"
+        return response
+
+
+app.mount("/audio", AudioFiles(directory=AUDIO_DIR), name="audio")
 
 # =========================
 # Routes
 # =========================
 app.include_router(ai_chat.router)
-# app.include_router(ai_batch.router)
+app.include_router(ai_tts.router)
+app.include_router(ai_transcript.router)
+app.include_router(ai_batch.router)
 
 # =========================
 # Root endpoint
@@ -58,3 +118,11 @@ app.include_router(ai_chat.router)
 @app.get("/")
 def root():
     return {"message": "Meeting Notes Summarizer API is running 🚀"}
+
+
+# =========================
+# Prometheus metrics
+# =========================
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
@@ -1,45 +1,177 @@
-# from fastapi import APIRouter
-# from pydantic import BaseModel
-# from api.services.chat_service import generate_summary
-# from api.utils.session_manager import create_session_id
-# from api.utils.conversation_logger import save_message_to_db
-# from api.utils.prompt_loader import load_system_prompt
-
-# router = APIRouter()
-
-# # Lưu toàn bộ message cho mỗi session
-# sessions_messages = {}
-
-# # ✅ Khai báo Request body model để Swagger hiển thị
-# class BatchRequest(BaseModel):
-#     messages: list[str]
-#     session_id: str | None = None
-
-
-# @router.post("/api/chat/batch")
-# async def chat_batch_endpoint(request: BatchRequest):
-#     """
-#     Xử lý nhiều message trong 1 request.
-#     Dạng input ví dụ:
-#     {
-#         "messages": ["Xin chào", "Tóm tắt giúp tôi nội dung meeting", "Viết lại ngắn gọn"],
-#         "session_id": null
-#     }
-#     """
-#     session_id = request.session_id or create_session_id()
-
-#     # Nếu session chưa tồn tại → tạo mới
-#     if session_id not in sessions_messages:
-#         system_prompt = load_system_prompt()
-#         sessions_messages[session_id] = [{"role": "system", "content": system_prompt}]
-
-#     replies = []
-#     for msg in request.messages:
-#         sessions_messages[session_id].append({"role": "user", "content": msg})
-#         save_message_to_log(session_id, "user", msg)
-#         reply = generate_summary(sessions_messages[session_id])
-#         sessions_messages[session_id].append({"role": "assistant", "content": reply})
-#         save_message_to_log(session_id, "assistant", reply)
-#         replies.append(reply)
-
-#     return {"session_id": session_id, "replies": replies, "message_count": len(replies)}
+import asyncio
+import json
+import logging
+import time
+from typing import List, Optional
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from api.config.config import BATCH_MAX_ITEMS, BATCH_SESSION_CONCURRENCY
+from api.services.chat_service import (
+    agenerate_summary,
+    get_embeddings,
+    record_memory_lookup,
+    search_memory,
+)
+from api.services.answer_cache import answer_cache, validate_scope
+from api.services.context_window import build_messages, plan_fold, schedule_fold
+from api.services.session_store import session_store
+from api.services.write_behind import write_behind
+from api.utils.concurrency import run_in_stage
+from api.utils.prompt_loader import load_system_prompt
+from api.utils.session_manager import create_session_id
+
+# =========================
+# FastAPI router
+# =========================
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+
+# ✅ Khai báo Request body model để Swagger hiển thị
+class BatchItem(BaseModel):
+    message: str
+    session_id: Optional[str] = None
+    id: Optional[str] = None  # mã do client đặt, trả lại nguyên trong kết quả
+    cache_scope: Optional[str] = None  # phạm vi cache câu trả lời (mặc định theo request / cấu hình)
+
+
+class BatchRequest(BaseModel):
+    messages: List[str] = []          # dạng cũ: mọi message thuộc cùng 1 session
+    session_id: Optional[str] = None
+    items: List[BatchItem] = []       # dạng mới: mỗi message có thể thuộc session khác nhau
+    cache_scope: Optional[str] = None  # phạm vi cache câu trả lời cho mọi message (xem answer_cache)
+
+
+def _group_by_session(request: BatchRequest) -> dict:
+    """Gom message theo session, giữ thứ tự trong từng session. Message không có session → session mặc định."""
+    default_session = request.session_id or create_session_id()
+    items = [BatchItem(message=m) for m in request.messages] + list(request.items)
+    groups = {}
+    for index, item in enumerate(items):
+        item.cache_scope = validate_scope(item.cache_scope or request.cache_scope)
+        session_id = item.session_id or default_session
+        groups.setdefault(session_id, []).append((index, item))
+    return groups
+
+
+async def _process_session(session_id: str, items: list, emit):
+    """
+    Chạy lần lượt các message của 1 session. Mỗi lượt được lưu qua write-behind journal (như /api/chat)
+    trước khi báo "ok" → cùng độ bền và read-your-writes; worker nền vẫn gom lô khi ghi SQLite + Chroma.
+    Ngữ cảnh (session store) cập nhật sau từng message để message sau thấy được lượt trước.
+    """
+    state = None
+    system_prompt = load_system_prompt()
+    await write_behind.await_session(session_id)  # các lượt chat trước đó của session phải có trong Chroma
+    try:
+        for index, item in items:
+            result = {"index": index, "id": item.id, "session_id": session_id}
+            try:
+                state = await run_in_stage("db", session_store.get, session_id)
+                messages, context = build_messages(system_prompt, state, item.message)
+
+                reply = answer_cache.get(item.message, session_id, item.cache_scope)
+                if reply is not None:
+                    source = "cache"
+                else:
+                    # search_memory đã so với ngưỡng của bộ chấm (cosine / rerank): có context = trùng
+                    memory_context = await run_in_stage("memory", search_memory, session_id, item.message)
+                    record_memory_lookup(bool(memory_context))
+                    if memory_context:
+                        reply, source = memory_context.split("Assistant:")[-1].strip(), "memory"
+                    else:
+                        reply = await agenerate_summary(messages, item.message, memory_context, raise_errors=True,
+                                                        priority="batch")
+                        source = "model"
+                    context_free = not context["history_messages"] and not context["summary_tokens"]
+                    answer_cache.put(item.message, reply, session_id, item.cache_scope,
+                                     shareable=source == "model" and context_free)
+
+                state = await run_in_stage("db", session_store.append_turn, session_id, [
+                    {"role": "user", "content": item.message},
+                    {"role": "assistant", "content": reply, "audio_path": None},
+                ])
+                await run_in_stage("db", write_behind.persist_turn, session_id, item.message, reply, "",
+                                   turn=state["turns"] - 1)
+                emit({**result, "status": "ok", "source": source, "reply": reply,
+                      "prompt_tokens": context["prompt_tokens"] if source == "model" else 0})
+            except Exception as e:
+                logger.exception(f"Batch: lỗi ở message {index} (session {session_id}): {e}")
+                emit({**result, "status": "error", "error": str(e) or type(e).__name__})
+    finally:
+        if state is not None and plan_fold(state["messages"]):
+            schedule_fold(session_id)
+
+
+@router.post("/api/chat/batch")
+async def chat_batch_endpoint(request: BatchRequest):
+    """
+    Xử lý nhiều message trong 1 request, trả kết quả dạng NDJSON (mỗi dòng 1 JSON) ngay khi từng message xong.
+    Các session khác nhau chạy song song (tối đa BATCH_SESSION_CONCURRENCY), message trong 1 session chạy theo thứ tự.
+    Dạng input ví dụ:
+    {
+        "items": [
+            {"message": "Tóm tắt giúp tôi nội dung meeting", "session_id": "a"},
+            {"message": "Viết lại ngắn gọn", "session_id": "a"},
+            {"message": "Xin chào", "session_id": "b", "id": "x-1"}
+        ]
+    }
+    (vẫn nhận dạng cũ {"messages": [...], "session_id": null})
+    Mỗi dòng: {"index", "id", "session_id", "status": "ok" | "error", "reply" | "error",
+               "source": "cache" | "memory" | "model", ...};
+    message chỉ "ok" khi lượt đã được lưu (journal), lỗi lưu → "error" của chính message đó;
+    dòng cuối: {"type": "summary", "total", "ok", "failed", "sessions", "seconds"}.
+    """
+    try:
+        groups = _group_by_session(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    total = sum(len(items) for items in groups.values())
+    if total == 0:
+        raise HTTPException(status_code=400, detail="Không có message nào")
+    if total > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Tối đa {BATCH_MAX_ITEMS} message mỗi request")
+
+    results = asyncio.Queue()
+    semaphore = asyncio.Semaphore(max(BATCH_SESSION_CONCURRENCY, 1))
+
+    async def run_session(session_id, items):
+        async with semaphore:
+            await _process_session(session_id, items, results.put_nowait)
+
+    async def run_all():
+        # Encode trước toàn bộ câu hỏi trong 1 lô → search_memory/lưu Chroma sau đó lấy từ cache embedding
+        messages = [item.message for items in groups.values() for _, item in items]
+        try:
+            await run_in_stage("memory", get_embeddings, messages)
+        except Exception as e:
+            logger.warning(f"Batch: không encode trước được embedding: {e}")
+        try:
+            await asyncio.gather(*(run_session(sid, items) for sid, items in groups.items()))
+        finally:
+            results.put_nowait(None)  # báo hết kết quả
+
+    async def ndjson_stream():
+        start = time.perf_counter()
+        task = asyncio.create_task(run_all())
+        ok = failed = 0
+        try:
+            while (result := await results.get()) is not None:
+                ok += result.get("status") == "ok"
+                failed += result.get("status") == "error"
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+            yield json.dumps({
+                "type": "summary",
+                "total": total,
+                "ok": ok,
+                "failed": failed,
+                "sessions": list(groups),
+                "seconds": round(time.perf_counter() - start, 3),
+            }, ensure_ascii=False) + "\n"
+        finally:
+            task.cancel()
+
+    return StreamingResponse(ndjson_stream(), media_type="application/x-ndjson")
@@ -1,88 +1,271 @@
-from fastapi import APIRouter, Request
+import json
+import logging
+
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from api.utils.session_manager import create_session_id
-from api.utils.conversation_logger import save_message_to_db, get_all_sessions, get_session_messages, delete_chroma_messages, delete_session_messages
+from api.utils.conversation_logger import save_message_to_db, get_sessions_page, get_session_messages_page, delete_chroma_messages, delete_session_messages
 from api.utils.prompt_loader import load_system_prompt
 from api.services.chat_service import (
-    generate_summary,
-    save_to_chroma,
-    search_memory
+    agenerate_summary,
+    astream_summary,
+    search_memory,
+    discard_session,
+    get_service_stats,
+    record_memory_lookup,
 )
-from api.services.chat_tts import generate_tts_audio
+from api.services.chat_tts import generate_tts_audio, audio_cache, audio_gc, resolve_audio_format
+from api.services.model_registry import ModelDisabledError
+from api.services.session_store import session_store
+from api.services.context_window import build_messages, plan_fold, schedule_fold, context_stats
+from api.services.hedging import hedged_reply, hedge_stats, record_sequential
+from api.services.write_behind import write_behind
+from api.services.memory_maintenance import memory_maintenance
+from api.services.answer_cache import answer_cache, validate_scope
+from api.config.config import HEDGED_LLM
+from api.utils.tokens import count_tokens
+from api.utils.concurrency import run_in_stage, stage_stats
 # =========================
 # FastAPI router
 # =========================
 router = APIRouter()
-sessions_messages = {}
+logger = logging.getLogger(__name__)
 
-@router.post("/api/chat")
-async def chat_endpoint(request: Request):
-    data = await request.json()
+async def _start_turn(data: dict):
+    """
+    Chuẩn bị 1 lượt chat: tạo session nếu cần, lấy ngữ cảnh từ session store.
+    Trả về (session_id, user_input, messages gửi lên model, thông tin token của ngữ cảnh).
+    Lịch sử được cắt theo ngân sách token, phần cũ hơn nằm trong bản tóm tắt.
+    """
     user_input = data.get("message")
-    tts = data.get("tts", False)
     session_id = data.get("session_id")
 
     # Tạo session mới nếu chưa có
     if not session_id or session_id == "undefined":
         session_id = create_session_id()
 
-    # Thêm system prompt nếu session mới
-    if session_id not in sessions_messages:
-        system_prompt = load_system_prompt()
-        sessions_messages[session_id] = [{"role": "system", "content": system_prompt}]
+    state = await run_in_stage("db", session_store.get, session_id)
+    messages, context = build_messages(load_system_prompt(), state, user_input)
+    return session_id, user_input, messages, context
+
 
-    # Lưu tin nhắn user
-    sessions_messages[session_id].append({"role": "user", "content": user_input})
-    save_message_to_db(session_id, "user", user_input, "")
+def _report_context(session_id: str, context: dict, memory_context: str, used_model: bool) -> dict:
+    """Số token thực gửi lên model ở lượt này (0 nếu trả lời lại từ bộ nhớ)."""
+    context = {**context, "prompt_tokens": context["prompt_tokens"] + count_tokens(memory_context) if used_model else 0}
+    logger.info(f"Ngữ cảnh session {session_id}: {context}")
+    return context
 
-    # Tìm trong ChromaDB
-    memory_context, best_score = search_memory(session_id, user_input, return_score=True)
 
-    if best_score >= 0.7:
+def _cache_scope(data: dict) -> str:
+    """Phạm vi cache câu trả lời do client chọn ("cache_scope"), 400 nếu sai định dạng."""
+    try:
+        return validate_scope(data.get("cache_scope"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _remember_answer(session_id: str, user_input: str, reply: str, scope: str, context: dict, used_model: bool):
+    """Ghi câu trả lời vào cache; chỉ chia sẻ câu trả lời của model cho lượt không có ngữ cảnh trước đó."""
+    context_free = not context["history_messages"] and not context["summary_tokens"]
+    answer_cache.put(user_input, reply, session_id, scope, shareable=used_model and context_free)
+
+
+async def _lookup_memory(session_id: str, user_input: str):
+    """Tìm trong ChromaDB. Trả về (memory_context, câu trả lời cũ nếu trùng hoặc None)."""
+    await write_behind.await_session(session_id)  # lượt vừa trả lời phải có trong Chroma trước khi tìm
+    memory_context, best_score, scorer = await run_in_stage("memory", search_memory, session_id, user_input,
+                                                            return_scorer=True)
+    hit = bool(memory_context)  # search_memory đã so với ngưỡng của bộ chấm (cosine / rerank)
+    logger.debug(f"Best score ({scorer}): {best_score:.3f} → {'dùng lại trí nhớ' if hit else 'gọi model'}")
+    record_memory_lookup(hit)
+    if hit:
         # Trùng → dùng lại câu trả lời cũ
-        print("Use DB:")
-        print(f"Best score: {best_score:.3f}")
-        reply = memory_context.split("Assistant:")[-1].strip()
-    else:
-        # Không trùng → gọi model
-        print("User AI:")
-        print(f"Best score: {best_score:.3f}")
-        reply = generate_summary(
-            messages=sessions_messages[session_id],
-            user_input=user_input,
-            memory_context=memory_context
+        return memory_context, memory_context.split("Assistant:")[-1].strip()
+    return memory_context, None
+
+
+def _audio_format(data: dict) -> str:
+    """Định dạng audio TTS do client chọn ("audio_format"), 400 nếu không hỗ trợ."""
+    try:
+        return resolve_audio_format(data.get("audio_format"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def _finish_turn(session_id: str, user_input: str, reply: str, tts: bool, audio_format: str = None):
+    """
+    Sinh TTS (nếu cần) và lưu cả lượt (user + assistant). Trả về audio_path (URL /audio/<file>).
+    SQLite + ChromaDB được ghi nền qua write-behind journal (lượt đã bền vững khi hàm này trả về).
+    """
+    audio_path = None
+    if tts:
+        try:
+            audio_path = await run_in_stage("tts", generate_tts_audio, session_id, reply, audio_format)
+        except ModelDisabledError as e:
+            logger.warning(f"Bỏ qua TTS: {e}")
+
+    # Lưu ngữ cảnh vào session store trước (worker khác đọc được ngay), sau đó mới ghi lịch sử
+    state = await run_in_stage("db", session_store.append_turn, session_id, [
+        {"role": "user", "content": user_input},
+        {"role": "assistant", "content": reply, "audio_path": audio_path},
+    ])
+    await run_in_stage("db", write_behind.persist_turn, session_id, user_input, reply, audio_path or "",
+                       turn=state["turns"] - 1)
+
+    # Lịch sử vượt ngân sách → gộp lượt cũ vào bản tóm tắt ở nền
+    if plan_fold(state["messages"]):
+        schedule_fold(session_id)
+    return audio_path
+
+
+@router.post("/api/chat")
+async def chat_endpoint(request: Request):
+    data = await request.json()
+    tts = data.get("tts", False)
+    audio_format = _audio_format(data)
+    scope = _cache_scope(data)
+    session_id, user_input, messages, context = await _start_turn(data)
+
+    # Tầng 1: câu hỏi lặp lại nguyên văn → trả lời ngay, không embedding / Chroma / model
+    cached = answer_cache.get(user_input, session_id, scope)
+    if cached is not None:
+        memory_context, reply, used_model = "", cached, False
+    elif data.get("hedge", HEDGED_LLM):
+        # Hedged: gọi model song song với tìm trí nhớ, huỷ nếu trí nhớ trùng
+        memory_context, reply, used_model = await hedged_reply(
+            lambda: _lookup_memory(session_id, user_input),
+            lambda: agenerate_summary(messages=messages, user_input=user_input),
         )
-    audio_path = generate_tts_audio(session_id, reply) if tts else None    
+    else:
+        memory_context, reply = await _lookup_memory(session_id, user_input)
+        used_model = reply is None
+        record_sequential(memory_hit=not used_model)
+        if used_model:
+            # Không trùng → gọi model
+            reply = await agenerate_summary(
+                messages=messages,
+                user_input=user_input,
+                memory_context=memory_context
+            )
+    if cached is None:
+        _remember_answer(session_id, user_input, reply, scope, context, used_model)
+    audio_path = await _finish_turn(session_id, user_input, reply, tts, audio_format)
+    context = _report_context(session_id, context, memory_context, used_model)
+
+    return {"session_id": session_id, "reply": reply, "audio_path": audio_path, "context": context}
+
+
+# =========================
+# Chat dạng stream (Server-Sent Events)
+# =========================
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post("/api/chat/stream")
+async def chat_stream_endpoint(request: Request):
+    """
+    Giống /api/chat nhưng trả token ngay khi model sinh ra (text/event-stream).
+    Các event: meta → token (nhiều lần) → done | error.
+    Phản hồi chỉ được lưu vào SQLite/Chroma sau khi stream kết thúc.
+    """
+    data = await request.json()
+    tts = data.get("tts", False)
+    audio_format = _audio_format(data)
+    scope = _cache_scope(data)
+    session_id, user_input, messages, context = await _start_turn(data)
+
+    async def event_stream():
+        yield _sse("meta", {"session_id": session_id})
+        cached = answer_cache.get(user_input, session_id, scope)
+        if cached is not None:
+            memory_context, reply = "", cached
+        else:
+            memory_context, reply = await _lookup_memory(session_id, user_input)
+        used_model = reply is None
 
-    # Lưu phản hồi
-    sessions_messages[session_id].append({
-        "role": "assistant",
-        "content": reply,
-        "audio_path": audio_path
-    })
-    save_message_to_db(session_id, "assistant", reply, audio_path or "")
+        if not used_model:
+            yield _sse("token", {"token": reply})
+        else:
+            parts = []
+            try:
+                async for token in astream_summary(
+                    messages=messages,
+                    user_input=user_input,
+                    memory_context=memory_context
+                ):
+                    parts.append(token)
+                    yield _sse("token", {"token": token})
+            except Exception as e:
+                logger.exception(f"Lỗi khi stream từ Azure OpenAI: {e}")
+                await run_in_stage("db", save_message_to_db, session_id, "user", user_input, "")
+                yield _sse("error", {"message": "Đã xảy ra lỗi khi xử lý yêu cầu từ mô hình."})
+                return
+            reply = "".join(parts).strip()
+        if cached is None:
+            _remember_answer(session_id, user_input, reply, scope, context, used_model)
 
-    # Lưu vào ChromaDB
-    save_to_chroma(session_id, user_input, reply)
+        audio_path = await _finish_turn(session_id, user_input, reply, tts, audio_format)
+        yield _sse("done", {
+            "session_id": session_id,
+            "reply": reply,
+            "audio_path": audio_path,
+            "context": _report_context(session_id, context, memory_context, used_model),
+        })
 
-    return {"session_id": session_id, "reply": reply, "audio_path": audio_path}
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # =========================
 # Lấy danh sách session
 # =========================
 @router.get("/api/sessions")
-def list_sessions():
-    sessions_dict = get_all_sessions()  # {session_id: created_at}
-    sessions = [{"id": k, "name": v} for k, v in sessions_dict.items()]
-    return sessions
+def list_sessions(response: Response, limit: int = 50, cursor: str = None):
+    """
+    Danh sách session, mới hoạt động nhất trước (keyset pagination).
+    Trang tiếp theo: gọi lại với ?cursor=<X-Next-Cursor>.
+    """
+    try:
+        sessions, next_cursor = get_sessions_page(limit=min(max(limit, 1), 200), cursor=cursor)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="cursor không hợp lệ")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return [
+        {
+            "id": s["session_id"],
+            "name": s["title"] or s["first_at"],
+            "message_count": s["message_count"],
+            "first_at": s["first_at"],
+            "last_at": s["last_at"],
+        }
+        for s in sessions
+    ]
 
 
 # =========================
 # Lấy messages của 1 session
 # =========================
 @router.get("/api/chat/{session_id}")
-async def get_chat(session_id: str):
-    messages = get_session_messages(session_id)
+async def get_chat(session_id: str, response: Response, limit: int = None, cursor: str = None):
+    """
+    Không có limit → toàn bộ lịch sử.
+    Có limit → `limit` message mới nhất (hoặc ngay trước cursor), header X-Next-Cursor trỏ tới trang cũ hơn.
+    """
+    await write_behind.await_session(session_id)  # đọc được cả lượt vừa trả lời
+    try:
+        messages, next_cursor = await run_in_stage(
+            "db", get_session_messages_page, session_id,
+            min(max(limit, 1), 500) if limit is not None else None, cursor
+        )
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="cursor không hợp lệ")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return messages
 
 
@@ -91,8 +274,37 @@ async def get_chat(session_id: str):
 # =========================
 @router.delete("/api/chat/{session_id}")
 async def delete_chat(session_id: str):
-    delete_chroma_messages(session_id)
-    delete_session_messages(session_id)
-    if session_id in sessions_messages:
-        del sessions_messages[session_id]
+    # Lượt đang chờ ghi mà xoá trước thì lô đó ghi lại session vào SQLite/Chroma → chưa ghi xong thì từ chối
+    if not await write_behind.await_session(session_id):
+        raise HTTPException(status_code=503, detail="Session đang được ghi, thử lại sau",
+                            headers={"Retry-After": "1"})
+    discard_session(session_id)
+    answer_cache.invalidate_session(session_id)
+    await run_in_stage("memory", delete_chroma_messages, session_id)
+    await run_in_stage("db", delete_session_messages, session_id)
+    await run_in_stage("db", session_store.delete, session_id)
     return {"status": "ok"}
+
+
+# =========================
+# Thống kê nội bộ (cache, hàng đợi...)
+# =========================
+@router.get("/api/stats")
+def service_stats():
+    return {**get_service_stats(), "audio_cache": {**audio_cache.stats(), "gc": audio_gc.stats()},
+            "sessions": session_store.stats(), "context": context_stats(),
+            "hedging": hedge_stats(), "write_behind": write_behind.stats(),
+            "memory": memory_maintenance.stats(), "answer_cache": answer_cache.stats(),
+            "stages": stage_stats()}
+
+
+# =========================
+# Xoá cache câu trả lời (vd: sau khi đổi prompt / tài liệu nguồn)
+# =========================
+@router.delete("/api/answer-cache")
+def invalidate_answer_cache(scope: str = None, question: str = None):
+    """Không tham số → xoá toàn bộ; ?scope=<phạm vi chia sẻ> và/hoặc ?question=<câu hỏi> → chỉ xoá phần khớp."""
+    try:
+        return {"invalidated": answer_cache.invalidate(scope, question)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
@@ -0,0 +1,96 @@
+import asyncio
+import json
+import logging
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from api.config.config import TRANSCRIPT_MAX_CHARS
+from api.services.transcript_service import render_meeting_summary, summarize_transcript
+
+# =========================
+# FastAPI router
+# =========================
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+
+class TranscriptRequest(BaseModel):
+    transcript: str
+    meeting_title: Optional[str] = None
+
+
+def _validate(request: TranscriptRequest):
+    if not request.transcript.strip():
+        raise HTTPException(status_code=400, detail="Biên bản trống")
+    if len(request.transcript) > TRANSCRIPT_MAX_CHARS:
+        raise HTTPException(status_code=413, detail=f"Biên bản dài quá {TRANSCRIPT_MAX_CHARS} ký tự")
+
+
+def _result_payload(result: dict) -> dict:
+    summary = result["summary"]
+    return {
+        "summary": summary.model_dump(),
+        "markdown": render_meeting_summary(summary),
+        "chunks": result["chunks"],
+        "levels": result["levels"],
+        "seconds": result["seconds"],
+    }
+
+
+# =========================
+# Tóm tắt biên bản họp (map-reduce)
+# =========================
+@router.post("/api/transcript/summarize")
+async def summarize_transcript_endpoint(request: TranscriptRequest):
+    """
+    Nhận toàn bộ biên bản họp, trả về MeetingSummarySchema (+ bản Markdown theo template).
+    Biên bản dài được chia đoạn và tóm tắt song song, xem /api/transcript/summarize/stream để theo dõi tiến độ.
+    """
+    _validate(request)
+    try:
+        result = await summarize_transcript(request.transcript, request.meeting_title)
+    except Exception as e:
+        logger.exception(f"Lỗi khi tóm tắt biên bản: {e}")
+        raise HTTPException(status_code=502, detail="Đã xảy ra lỗi khi tóm tắt biên bản.")
+    return _result_payload(result)
+
+
+@router.post("/api/transcript/summarize/stream")
+async def summarize_transcript_stream_endpoint(request: TranscriptRequest):
+    """
+    Giống /api/transcript/summarize nhưng báo tiến độ (text/event-stream).
+    Các event: progress (nhiều lần) → result | error.
+    """
+    _validate(request)
+    events = asyncio.Queue()
+
+    async def run():
+        try:
+            result = await summarize_transcript(request.transcript, request.meeting_title, on_progress=events.put_nowait)
+            events.put_nowait(("result", _result_payload(result)))
+        except Exception as e:
+            logger.exception(f"Lỗi khi tóm tắt biên bản: {e}")
+            events.put_nowait(("error", {"message": "Đã xảy ra lỗi khi tóm tắt biên bản."}))
+
+    async def event_stream():
+        task = asyncio.create_task(run())
+        try:
+            while True:
+                event = await events.get()
+                if isinstance(event, tuple):
+                    name, data = event
+                    yield f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+                    return
+                yield f"event: progress\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            # Client ngắt kết nối → dừng các lời gọi model còn lại
+            task.cancel()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
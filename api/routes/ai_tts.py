@@ -0,0 +1,61 @@
+import base64
+import json
+import logging
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+from api.services.chat_tts import audio_media_type, resolve_audio_format, stream_tts_chunks
+from api.services.model_registry import registry
+from api.config.config import TTS_MAX_CHARS
+
+# =========================
+# FastAPI router
+# =========================
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+
+# =========================
+# TTS dạng stream theo từng câu (Server-Sent Events)
+# =========================
+@router.post("/api/tts/stream")
+async def tts_stream_endpoint(request: Request):
+    """
+    Nhận {"text": "...", "audio_format": "opus" | "mp3" | "wav"} và trả về từng đoạn audio ngay khi synthesize xong
+    (mặc định TTS_AUDIO_FORMAT, mỗi đoạn là 1 file hoàn chỉnh).
+    Các event: chunk {index, total, media_type, audio (base64)} → done {chunks} | error.
+    """
+    if not registry.is_enabled("tts"):
+        raise HTTPException(status_code=503, detail="TTS đã bị tắt trên server này")
+
+    data = await request.json()
+    text = data.get("text") or ""
+    if len(text) > TTS_MAX_CHARS:
+        raise HTTPException(status_code=413, detail=f"Văn bản dài quá {TTS_MAX_CHARS} ký tự")
+    try:
+        audio_format = resolve_audio_format(data.get("audio_format"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    media_type = audio_media_type(audio_format)
+
+    async def event_stream():
+        count = 0
+        try:
+            async for index, total, audio_bytes in stream_tts_chunks(text, audio_format=audio_format):
+                payload = {"index": index, "total": total, "media_type": media_type,
+                           "audio": base64.b64encode(audio_bytes).decode("ascii")}
+                yield f"event: chunk\ndata: {json.dumps(payload)}\n\n"
+                count += 1
+        except Exception as e:
+            logger.exception(f"Lỗi khi synthesize TTS: {e}")
+            message = json.dumps({"message": "Đã xảy ra lỗi khi tạo audio."}, ensure_ascii=False)
+            yield f"event: error\ndata: {message}\n\n"
+            return
+        yield f"event: done\ndata: {json.dumps({'chunks': count})}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,210 @@
+# ============================================================
+# 📁 api/services/answer_cache.py
+# ============================================================
+"""
+Cache câu trả lời theo câu hỏi đã chuẩn hoá — tầng đầu của /api/chat, đứng trước embedding + Chroma.
+
+Khoá = sha256(model + namespace + câu hỏi chuẩn hoá bằng normalize_question) → câu hỏi lặp lại
+nguyên văn hoặc gần nguyên văn (khác hoa/thường, dấu câu, khoảng trắng) được trả lời ngay,
+không encode, không truy vấn Chroma, không gọi model.
+
+Phạm vi (opt-in theo request, trường "cache_scope"; mặc định ANSWER_CACHE_DEFAULT_SCOPE):
+  - "off"     : không đọc / ghi cache
+  - "session" : chỉ dùng lại trong cùng session
+  - "global" hoặc tên namespace (vd: mã nhóm): dùng chung giữa các session cùng phạm vi.
+    Chỉ câu trả lời của lượt không có ngữ cảnh (session chưa có lịch sử / tóm tắt) mới được chia sẻ,
+    vì câu trả lời giữa cuộc trò chuyện phụ thuộc vào các lượt trước.
+
+Mỗi tiến trình giữ cache riêng trong RAM (LRU theo số mục + dung lượng, kèm TTL).
+Xoá session → xoá mọi mục có nguồn từ session đó (kể cả mục đã chia sẻ).
+"""
+
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from api.config.config import (
+    ANSWER_CACHE_DEFAULT_SCOPE,
+    ANSWER_CACHE_ENABLED,
+    ANSWER_CACHE_MAX_BYTES,
+    ANSWER_CACHE_MAX_ITEMS,
+    ANSWER_CACHE_TTL_S,
+)
+from api.services.chat_service import CHAT_COMPLETION_PARAMS, FALLBACK_REPLIES
+from api.utils import metrics
+from api.utils.text_normalize import normalize_question
+
+logger = logging.getLogger(__name__)
+
+SCOPE_OFF, SCOPE_SESSION, SCOPE_GLOBAL = "off", "session", "global"
+_SCOPE_NAME = re.compile(r"^[\w.:-]{1,64}$")
+ENTRY_OVERHEAD_BYTES = 240  # ước lượng phần dict/OrderedDict/khoá của mỗi mục
+
+lookups = metrics.counter(
+    "meeting_answer_cache_lookups_total", "Số lần tra cache câu trả lời", ("tier", "result")
+)
+
+
+def validate_scope(scope: str = None) -> str:
+    """Trả về phạm vi hợp lệ (None → mặc định), ValueError nếu sai định dạng."""
+    scope = (scope or ANSWER_CACHE_DEFAULT_SCOPE).strip()
+    if not _SCOPE_NAME.match(scope):
+        raise ValueError(f"cache_scope không hợp lệ: {scope!r}")
+    return scope
+
+
+def _key(namespace: str, question: str) -> str:
+    raw = f"{CHAT_COMPLETION_PARAMS['model']}\x00{namespace}\x00{normalize_question(question)}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    def __init__(self, max_items: int = ANSWER_CACHE_MAX_ITEMS, max_bytes: int = ANSWER_CACHE_MAX_BYTES,
+                 ttl_s: float = ANSWER_CACHE_TTL_S, enabled: bool = ANSWER_CACHE_ENABLED):
+        self.max_items, self.max_bytes, self.ttl_s, self.enabled = max_items, max_bytes, ttl_s, enabled
+        self._entries = OrderedDict()  # key → (answer, namespace, session nguồn, thời điểm ghi, số byte)
+        self._by_session = {}          # session nguồn → {key}
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.stats_counter = {"hits": 0, "misses": 0, "writes": 0, "expired": 0, "evictions": 0,
+                              "invalidations": 0}
+
+    @staticmethod
+    def _namespaces(scope: str, session_id: str) -> list:
+        """Các namespace cần tra theo thứ tự: session trước, rồi phạm vi chia sẻ (nếu có)."""
+        if scope == SCOPE_OFF:
+            return []
+        namespaces = [("session", f"session:{session_id}")]
+        if scope != SCOPE_SESSION:
+            namespaces.append(("shared", f"scope:{scope}"))
+        return namespaces
+
+    # ---------- Nội bộ (gọi khi đang giữ _lock) ----------
+    def _remove(self, key: str):
+        answer, namespace, session_id, created, size = self._entries.pop(key)
+        self._bytes -= size
+        keys = self._by_session.get(session_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_session[session_id]
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_items or self._bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+            self.stats_counter["evictions"] += 1
+
+    # ---------- API ----------
+    def get(self, question: str, session_id: str, scope: str = None):
+        """Câu trả lời đã cache cho câu hỏi (trong session hoặc phạm vi chia sẻ), None nếu chưa có."""
+        scope = validate_scope(scope)
+        if not self.enabled or scope == SCOPE_OFF or not normalize_question(question):
+            return None
+        now = time.time()
+        with self._lock:
+            for tier, namespace in self._namespaces(scope, session_id):
+                key = _key(namespace, question)
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if self.ttl_s > 0 and now - entry[3] > self.ttl_s:
+                    self._remove(key)
+                    self.stats_counter["expired"] += 1
+                    continue
+                self._entries.move_to_end(key)
+                self.stats_counter["hits"] += 1
+                lookups.inc(tier=tier, result="hit")
+                return entry[0]
+            self.stats_counter["misses"] += 1
+        lookups.inc(tier="all", result="miss")
+        return None
+
+    def put(self, question: str, answer: str, session_id: str, scope: str = None, shareable: bool = False):
+        """
+        Ghi câu trả lời vào namespace của session; shareable=True (lượt không có ngữ cảnh) thì ghi thêm
+        vào phạm vi chia sẻ. Câu trả lời lỗi / rỗng không được cache.
+        """
+        scope = validate_scope(scope)
+        if (not self.enabled or scope == SCOPE_OFF or not normalize_question(question) or not answer
+                or answer in FALLBACK_REPLIES):
+            return
+        now = time.time()
+        size = len(question.encode("utf-8")) + len(answer.encode("utf-8")) + ENTRY_OVERHEAD_BYTES
+        with self._lock:
+            for tier, namespace in self._namespaces(scope, session_id):
+                if tier == "shared" and not shareable:
+                    continue
+                key = _key(namespace, question)
+                if key in self._entries:
+                    self._remove(key)
+                self._entries[key] = (answer, namespace, session_id, now, size)
+                self._by_session.setdefault(session_id, set()).add(key)
+                self._bytes += size
+                self.stats_counter["writes"] += 1
+            self._evict()
+
+    def invalidate_session(self, session_id: str) -> int:
+        """Xoá mọi mục có nguồn từ session (dùng khi xoá session)."""
+        with self._lock:
+            keys = list(self._by_session.get(session_id, ()))
+            for key in keys:
+                self._remove(key)
+            self.stats_counter["invalidations"] += len(keys)
+        return len(keys)
+
+    def invalidate(self, scope: str = None, question: str = None) -> int:
+        """
+        Xoá theo phạm vi chia sẻ và/hoặc câu hỏi (không truyền gì = xoá toàn bộ).
+        Chỉ có question → xoá câu hỏi đó ở mọi phạm vi.
+        """
+        normalized = normalize_question(question) if question is not None else None
+        if normalized == "":
+            return 0
+        namespace = f"scope:{validate_scope(scope)}" if scope else None
+        with self._lock:
+            if normalized is not None and namespace is not None:
+                keys = [_key(namespace, question)]
+            else:
+                keys = [key for key, entry in self._entries.items()
+                        if (namespace is None or entry[1] == namespace)
+                        and (normalized is None or key == _key(entry[1], question))]
+            keys = [key for key in keys if key in self._entries]
+            for key in keys:
+                self._remove(key)
+            self.stats_counter["invalidations"] += len(keys)
+        return len(keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups_total = self.stats_counter["hits"] + self.stats_counter["misses"]
+            return {
+                "enabled": self.enabled,
+                "default_scope": ANSWER_CACHE_DEFAULT_SCOPE,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_items": self.max_items,
+                "max_bytes": self.max_bytes,
+                "ttl_s": self.ttl_s or None,
+                "hit_ratio": round(self.stats_counter["hits"] / lookups_total, 4) if lookups_total else None,
+                **self.stats_counter,
+            }
+
+
+answer_cache = AnswerCache()
+
+
+def _collect_answer_cache():
+    stats = answer_cache.stats()
+    ratio = [({}, stats["hit_ratio"])] if stats["hit_ratio"] is not None else []
+    return [
+        ("meeting_answer_cache_entries", "gauge", "Số câu trả lời đang cache", [({}, stats["entries"])]),
+        ("meeting_answer_cache_bytes", "gauge", "Dung lượng ước lượng của cache câu trả lời",
+         [({}, stats["bytes"])]),
+        ("meeting_answer_cache_hit_ratio", "gauge", "Tỉ lệ tra cache câu trả lời trúng", ratio),
+    ]
+
+
+metrics.register_collector(_collect_answer_cache)
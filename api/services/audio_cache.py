@@ -0,0 +1,263 @@
+# ============================================================
+# 📁 api/services/audio_cache.py
+# ============================================================
+"""
+Cache file audio TTS theo nội dung (content-addressed).
+
+Khoá = sha256(văn bản đã chuẩn hoá + model TTS + sampling rate + định dạng) → cùng một câu
+trả lời chỉ synthesize 1 lần cho mỗi định dạng, mọi lượt chat dùng chung 1 file.
+Giới hạn dung lượng trên đĩa: chưa gắn AudioGarbageCollector thì xoá file ít dùng nhất (LRU theo mtime) khi vượt quota.
+AudioGarbageCollector dọn định kỳ file không còn được lịch sử hội thoại tham chiếu, và được gọi dậy
+ngay khi ghi file làm vượt quota (không bao giờ xoá file đang được tham chiếu chỉ vì quota).
+Cùng 1 khoá đang được tạo → các lời gọi khác chờ kết quả thay vì chạy lại model (single-flight).
+"""
+
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future
+
+from api.utils.text_normalize import normalize_text
+
+logger = logging.getLogger(__name__)
+
+_CACHE_FILE = re.compile(r"^[0-9a-f]{64}\.\w+$")
+QUOTA_TRIGGER_MIN_INTERVAL_S = 60  # vẫn vượt quota vì toàn file mới/được tham chiếu → không quét lại sau mỗi lần ghi
+
+
+def audio_cache_key(text: str, model_id: str, sampling_rate: int, audio_format: str = "wav") -> str:
+    raw = f"{model_id}\x00{sampling_rate}\x00{normalize_text(text)}"
+    if audio_format != "wav":  # giữ nguyên khoá của file WAV đã cache từ trước
+        raw += f"\x00{audio_format}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    def __init__(self, directory: str, max_bytes: int, extension: str = "wav"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.extension = extension
+        self._lock = threading.Lock()
+        self._inflight = {}  # path → Future của lời gọi đang tạo file
+        self.on_over_quota = None  # AudioGarbageCollector gắn vào; None → evict() theo LRU
+        self.stats_counter = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "gc_runs": 0,
+                              "gc_removed": 0}
+        os.makedirs(directory, exist_ok=True)
+        self._total_bytes = sum(size for _, size, _ in self._scan())
+
+    def path_for(self, key: str, extension: str = None) -> str:
+        return os.path.join(self.directory, f"{key}.{extension or self.extension}")
+
+    def _scan(self):
+        """Liệt kê (path, size, mtime) các file thuộc cache (bỏ qua file cũ dạng session_uuid.wav)."""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and _CACHE_FILE.match(entry.name):
+                    st = entry.stat()
+                    entries.append((entry.path, st.st_size, st.st_mtime))
+        return entries
+
+    # ---------- API ----------
+    def get(self, key: str, extension: str = None):
+        """Trả về đường dẫn file nếu đã có (và đánh dấu vừa dùng), ngược lại None."""
+        path = self.path_for(key, extension)
+        try:
+            os.utime(path)  # cập nhật mtime → dùng làm thứ tự LRU
+        except FileNotFoundError:
+            with self._lock:
+                self.stats_counter["misses"] += 1
+            return None
+        with self._lock:
+            self.stats_counter["hits"] += 1
+        return path
+
+    def put(self, key: str, data: bytes, extension: str = None) -> str:
+        """Ghi file (atomic: ghi file tạm rồi rename) và dọn cache nếu vượt quota."""
+        path = self.path_for(key, extension)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        with self._lock:
+            try:
+                replaced = os.path.getsize(path)  # ghi đè file cùng khoá → không cộng dung lượng 2 lần
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp_path, path)
+            self._total_bytes += len(data) - replaced
+            over_quota = self._total_bytes > self.max_bytes
+        if over_quota:
+            if self.on_over_quota is not None:
+                self.on_over_quota()
+            else:
+                self.evict(keep=path)
+        return path
+
+    def get_or_create(self, key: str, produce, extension: str = None) -> str:
+        """Lấy file từ cache hoặc gọi produce() -> bytes để tạo mới (mỗi khoá chỉ 1 lời gọi produce cùng lúc)."""
+        path = self.get(key, extension)
+        if path:
+            return path
+        path = self.path_for(key, extension)
+        with self._lock:
+            future = self._inflight.get(path)
+            leader = future is None
+            if leader:
+                future = self._inflight[path] = Future()
+            else:
+                self.stats_counter["coalesced"] += 1
+        if not leader:
+            return future.result()
+        try:
+            # Lời gọi trước có thể vừa tạo xong giữa get() và lúc nhận phần tạo file
+            if not os.path.exists(path):
+                self.put(key, produce(), extension)
+            future.set_result(path)
+            return path
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[path]
+
+    def evict(self, keep: str = None):
+        """Xoá file cũ nhất cho tới khi tổng dung lượng dưới 90% quota (không xoá `keep`)."""
+        with self._lock:
+            entries = sorted(self._scan(), key=lambda e: e[2])
+            total = sum(size for _, size, _ in entries)
+            target = int(self.max_bytes * 0.9)
+            for path, size, _ in entries:
+                if total <= target:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self.stats_counter["evictions"] += 1
+            self._total_bytes = total
+        logger.info(f"Đã dọn audio cache, còn {total / 1e6:.1f} MB")
+
+    def collect_garbage(self, referenced: set, grace_s: float, max_age_s: float = 0) -> dict:
+        """
+        Dọn file theo thứ tự:
+          1. không dùng tới quá max_age_s giây (kể cả file đang được tham chiếu; 0 = bỏ qua)
+          2. không được tham chiếu (tên file không có trong `referenced`) và không dùng tới trong grace_s giây
+        Còn lại chỉ là file đang được tham chiếu hoặc mới hơn grace_s (lượt vừa sinh audio có thể chưa kịp ghi
+        audio_path vào lịch sử) → không xoá thêm; nếu vẫn vượt quota thì chỉ cảnh báo và báo số byte vượt
+        (over_quota_bytes) để tăng TTS_CACHE_MAX_BYTES hoặc giảm AUDIO_MAX_AGE_DAYS.
+        """
+        now = time.time()
+        removed = {"expired": 0, "unreferenced": 0, "bytes": 0, "over_quota_bytes": 0}
+
+        def remove(path, size, reason):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                return
+            removed[reason] += 1
+            removed["bytes"] += size
+
+        with self._lock:
+            kept = []
+            for path, size, mtime in self._scan():
+                idle = now - mtime
+                is_referenced = os.path.basename(path) in referenced
+                if max_age_s > 0 and idle > max_age_s:
+                    remove(path, size, "expired")
+                elif not is_referenced and idle > grace_s:
+                    remove(path, size, "unreferenced")
+                else:
+                    kept.append(size)
+
+            total = sum(kept)
+            removed["over_quota_bytes"] = max(total - self.max_bytes, 0)
+            self._total_bytes = total
+            self.stats_counter["gc_runs"] += 1
+            self.stats_counter["gc_removed"] += removed["expired"] + removed["unreferenced"]
+        if removed["bytes"]:
+            logger.info(f"Dọn audio: {removed}, còn {total / 1e6:.1f} MB")
+        if removed["over_quota_bytes"]:
+            logger.warning(f"Audio cache vẫn vượt quota {removed['over_quota_bytes'] / 1e6:.1f} MB "
+                           f"({total / 1e6:.1f}/{self.max_bytes / 1e6:.1f} MB) — toàn file đang được tham chiếu "
+                           f"hoặc vừa tạo, không xoá")
+        return removed
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self.stats_counter)
+            data["bytes"] = self._total_bytes
+            data["max_bytes"] = self.max_bytes
+        lookups = data["hits"] + data["misses"]
+        data["hit_ratio"] = data["hits"] / lookups if lookups else 0.0
+        return data
+
+
+class AudioGarbageCollector:
+    """Chạy AudioCache.collect_garbage định kỳ trong thread nền; `referenced()` trả về tập tên file đang dùng."""
+
+    def __init__(self, cache: AudioCache, referenced, interval_s: float, grace_s: float, max_age_s: float = 0):
+        self.cache, self.referenced = cache, referenced
+        self.interval_s, self.grace_s, self.max_age_s = interval_s, grace_s, max_age_s
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._run_lock = threading.Lock()
+        self._thread = None
+        self.last_run, self.last_result, self.errors, self.quota_triggers = None, None, 0, 0
+        cache.on_over_quota = self.trigger
+
+    def start(self):
+        if self.interval_s > 0 and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="audio-gc", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join(timeout=30)
+            self._thread = None
+
+    def trigger(self):
+        """Cache vượt quota khi ghi: đánh thức thread dọn (không chặn request), chưa chạy thread thì dọn ngay."""
+        if self.last_run is not None and time.time() - self.last_run < QUOTA_TRIGGER_MIN_INTERVAL_S:
+            return
+        self.quota_triggers += 1
+        if self._thread is not None:
+            self._wake.set()
+            return
+        try:
+            self.run_once()
+        except Exception as e:
+            self.errors += 1
+            logger.exception(f"Lỗi khi dọn audio: {e}")
+
+    def run_once(self) -> dict:
+        with self._run_lock:
+            self.last_result = self.cache.collect_garbage(self.referenced(), self.grace_s, self.max_age_s)
+            self.last_run = time.time()
+        return self.last_result
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval_s)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            try:
+                self.run_once()
+            except Exception as e:
+                self.errors += 1
+                logger.exception(f"Lỗi khi dọn audio: {e}")
+
+    def stats(self) -> dict:
+        return {"interval_s": self.interval_s, "grace_s": self.grace_s, "max_age_s": self.max_age_s or None,
+                "last_run": self.last_run, "last_result": self.last_result, "errors": self.errors,
+                "quota_triggers": self.quota_triggers}
@@ -0,0 +1,465 @@
+# ============================================================
+# 📁 api/services/azure_client.py
+# ============================================================
+"""
+Client Azure OpenAI dùng chung cho toàn ứng dụng (thay cho 4 client riêng lẻ trước đây).
+
+- 1 pool kết nối keep-alive (httpx) cho bản sync và 1 cho bản async.
+- Token bucket theo RPM/TPM của deployment, tự chỉnh theo header x-ratelimit-* mà Azure trả về;
+  429 → cả pool tạm dừng theo retry-after thay vì mỗi request tự backoff ngẫu nhiên.
+- Lập lịch theo độ ưu tiên: chat tương tác > batch > tác vụ nền (gộp lịch sử...), tối đa
+  AZURE_MAX_CONCURRENCY lời gọi đồng thời.
+- Retry tập trung (SDK không tự retry nữa): 429 → xếp hàng lại với cùng độ ưu tiên,
+  lỗi mạng/5xx → backoff lũy thừa có jitter, tối đa AZURE_MAX_RETRIES lần.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import httpx
+from openai import APIConnectionError, AsyncAzureOpenAI, AzureOpenAI, InternalServerError, RateLimitError
+
+from api.config.config import (
+    AZURE_EMBEDDING_DEPLOYMENT,
+    AZURE_KEEPALIVE_CONNECTIONS,
+    AZURE_KEEPALIVE_EXPIRY_S,
+    AZURE_MAX_CONCURRENCY,
+    AZURE_MAX_CONNECTIONS,
+    AZURE_MAX_RETRIES,
+    AZURE_OPENAI_API_KEY,
+    AZURE_OPENAI_API_VERSION,
+    AZURE_OPENAI_ENDPOINT,
+    AZURE_RPM_LIMIT,
+    AZURE_TPM_LIMIT,
+)
+from api.utils import metrics
+from api.utils.tokens import count_message_tokens
+
+logger = logging.getLogger(__name__)
+
+# Số nhỏ hơn = ưu tiên hơn
+PRIORITIES = {"interactive": 0, "batch": 1, "background": 2}
+RETRYABLE_ERRORS = (APIConnectionError, InternalServerError)  # gồm cả APITimeoutError
+DEFAULT_RETRY_AFTER_S = 1.0
+BACKOFF_MAX_S = 20.0
+
+
+# ============================================================
+# 🪣 Token bucket (RPM / TPM)
+# ============================================================
+class TokenBucket:
+    """per_minute <= 0 → không giới hạn (chưa biết quota)."""
+
+    def __init__(self, per_minute: float):
+        self.set_limit(per_minute)
+
+    def set_limit(self, per_minute: float):
+        self.per_minute = float(per_minute)
+        self.rate = self.per_minute / 60
+        # Azure tính quota theo cửa sổ ngắn (~10 giây) → cho phép dồn tối đa 1/6 quota mỗi phút
+        self.capacity = self.per_minute / 6
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def limited(self) -> bool:
+        return self.per_minute > 0
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        if not self.limited:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)  # request lớn hơn cả bucket vẫn phải chạy được
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def consume(self, amount: float, now: float):
+        if self.limited:
+            self._refill(now)
+            self.level -= amount
+
+    def refund(self, amount: float):
+        """Trả lại phần ước lượng dư (amount âm = thu thêm khi dùng nhiều hơn ước lượng)."""
+        if self.limited:
+            self.level = min(self.capacity, self.level + amount)
+
+    def sync_remaining(self, remaining: float):
+        """Azure báo còn ít hơn ta tưởng (worker khác cũng đang dùng chung quota) → hạ mức hiện có."""
+        if self.limited:
+            self.level = min(self.level, remaining)
+
+
+# ============================================================
+# 🚦 Bộ lập lịch theo độ ưu tiên
+# ============================================================
+class _Waiter:
+    __slots__ = ("priority", "tokens", "enqueued", "granted", "cancelled", "used_tokens", "notify")
+
+    def __init__(self, priority: str, tokens: int, notify):
+        self.priority, self.tokens, self.notify = priority, tokens, notify
+        self.enqueued = time.monotonic()
+        self.granted = self.cancelled = False
+        self.used_tokens = None  # số token thực tế (theo usage) để hoàn lại phần ước lượng dư
+
+
+class AzureScheduler:
+    """
+    Cấp slot gọi Azure theo (độ ưu tiên, thứ tự đến). Request đầu hàng chờ quota (bucket/retry-after)
+    thì các request sau cũng chờ → request ưu tiên thấp không chen được quota của request ưu tiên cao.
+    Dùng được cho cả code sync (thread) lẫn async (event loop).
+    """
+
+    def __init__(self, max_concurrency: int, rpm: float = 0, tpm: float = 0):
+        self.max_concurrency = max(max_concurrency, 1)
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._lock = threading.Lock()
+        self._heap = []
+        self._order = itertools.count()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._timer, self._timer_at = None, None
+        self.stats_counter = {"granted": 0, "throttled": 0, "rate_limited": 0, "retries": 0, "failed": 0}
+        self._per_priority = {p: {"granted": 0, "wait_seconds_total": 0.0, "max_wait_seconds": 0.0}
+                              for p in PRIORITIES}
+
+    # ---------- Cấp / trả slot ----------
+    def _enqueue(self, priority: str, tokens: int, notify) -> _Waiter:
+        if priority not in PRIORITIES:
+            raise ValueError(f"Độ ưu tiên không hợp lệ: {priority} (chọn: {', '.join(PRIORITIES)})")
+        waiter = _Waiter(priority, tokens, notify)
+        with self._lock:
+            heapq.heappush(self._heap, (PRIORITIES[priority], next(self._order), waiter))
+        self._dispatch()
+        return waiter
+
+    def _dispatch(self):
+        granted = []
+        with self._lock:
+            while self._heap and self._in_flight < self.max_concurrency:
+                waiter = self._heap[0][2]
+                if waiter.cancelled:
+                    heapq.heappop(self._heap)
+                    continue
+                now = time.monotonic()
+                wait = max(self._paused_until - now, self.requests.wait_time(1, now),
+                           self.tokens.wait_time(waiter.tokens, now))
+                if wait > 0:
+                    self._wake_after(wait)
+                    break
+                heapq.heappop(self._heap)
+                self.requests.consume(1, now)
+                self.tokens.consume(waiter.tokens, now)
+                self._in_flight += 1
+                waiter.granted = True
+                waited = now - waiter.enqueued
+                stats = self._per_priority[waiter.priority]
+                stats["granted"] += 1
+                stats["wait_seconds_total"] += waited
+                stats["max_wait_seconds"] = max(stats["max_wait_seconds"], waited)
+                self.stats_counter["granted"] += 1
+                granted.append((waiter, waited))
+        for waiter, waited in granted:
+            queue_wait.observe(waited, priority=waiter.priority)
+            waiter.notify()
+
+    def _wake_after(self, seconds: float):
+        """Hẹn _dispatch chạy lại khi có quota (giữ 1 timer, lấy mốc sớm nhất). Gọi khi đang giữ _lock."""
+        at = time.monotonic() + seconds
+        if self._timer is not None and self._timer.is_alive() and self._timer_at <= at:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer, self._timer_at = threading.Timer(seconds, self._dispatch), at
+        self._timer.daemon = True
+        self._timer.start()
+
+    def release(self, waiter: _Waiter):
+        with self._lock:
+            self._in_flight -= 1
+            if waiter.used_tokens is not None:
+                self.tokens.refund(waiter.tokens - waiter.used_tokens)
+        self._dispatch()
+
+    def acquire(self, priority: str = "interactive", tokens: int = 0) -> _Waiter:
+        event = threading.Event()
+        waiter = self._enqueue(priority, tokens, event.set)
+        event.wait()
+        return waiter
+
+    async def aacquire(self, priority: str = "interactive", tokens: int = 0) -> _Waiter:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = self._enqueue(priority, tokens, notify)
+        try:
+            await future
+        except BaseException:
+            # Request bị huỷ khi đang chờ: bỏ khỏi hàng đợi, hoặc trả slot nếu vừa được cấp
+            with self._lock:
+                waiter.cancelled = True
+                granted = waiter.granted
+            if granted:
+                self.release(waiter)
+            raise
+        return waiter
+
+    @contextmanager
+    def slot(self, priority: str = "interactive", tokens: int = 0):
+        waiter = self.acquire(priority, tokens)
+        try:
+            yield waiter
+        finally:
+            self.release(waiter)
+
+    @asynccontextmanager
+    async def aslot(self, priority: str = "interactive", tokens: int = 0):
+        waiter = await self.aacquire(priority, tokens)
+        try:
+            yield waiter
+        finally:
+            self.release(waiter)
+
+    # ---------- Tín hiệu từ Azure ----------
+    def count(self, key: str):
+        with self._lock:
+            self.stats_counter[key] += 1
+
+    def throttle(self, seconds: float):
+        """Tạm dừng cấp slot cho mọi request (429 / hết quota)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self.stats_counter["throttled"] += 1
+        self._dispatch()
+
+    def observe_headers(self, headers):
+        """Cập nhật quota theo header x-ratelimit-* của response."""
+        def number(name):
+            try:
+                return float(headers.get(name))
+            except (TypeError, ValueError):
+                return None
+
+        pause = False
+        with self._lock:
+            for bucket, kind in ((self.requests, "requests"), (self.tokens, "tokens")):
+                limit = number(f"x-ratelimit-limit-{kind}")
+                if limit and limit != bucket.per_minute:
+                    logger.info(f"Azure quota {kind}/phút: {bucket.per_minute:g} → {limit:g}")
+                    bucket.set_limit(limit)
+                remaining = number(f"x-ratelimit-remaining-{kind}")
+                if remaining is not None:
+                    bucket.sync_remaining(remaining)
+                    pause = pause or remaining <= 0
+        if pause:
+            self.throttle(DEFAULT_RETRY_AFTER_S)
+
+    # ---------- Thống kê ----------
+    def stats(self) -> dict:
+        with self._lock:
+            queued = {p: 0 for p in PRIORITIES}
+            for _, _, waiter in self._heap:
+                if not waiter.cancelled:
+                    queued[waiter.priority] += 1
+            per_priority = {
+                p: {**s, "queued": queued[p],
+                    "avg_wait_ms": round(s["wait_seconds_total"] / s["granted"] * 1000, 1) if s["granted"] else None}
+                for p, s in self._per_priority.items()
+            }
+            return {
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self._in_flight,
+                "paused_for_s": round(max(self._paused_until - time.monotonic(), 0.0), 3),
+                "rpm_limit": self.requests.per_minute or None,
+                "tpm_limit": self.tokens.per_minute or None,
+                "requests_available": round(self.requests.level, 1) if self.requests.limited else None,
+                "tokens_available": round(self.tokens.level) if self.tokens.limited else None,
+                **self.stats_counter,
+                "priorities": per_priority,
+            }
+
+
+# ============================================================
+# 🔌 Client + pool kết nối dùng chung
+# ============================================================
+_limits = httpx.Limits(
+    max_connections=AZURE_MAX_CONNECTIONS,
+    max_keepalive_connections=AZURE_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=AZURE_KEEPALIVE_EXPIRY_S,
+)
+
+sync_client = AzureOpenAI(
+    api_key=AZURE_OPENAI_API_KEY,
+    api_version=AZURE_OPENAI_API_VERSION,
+    azure_endpoint=AZURE_OPENAI_ENDPOINT,
+    max_retries=0,  # retry do lớp này đảm nhận
+    http_client=httpx.Client(limits=_limits),
+)
+
+async_client = AsyncAzureOpenAI(
+    api_key=AZURE_OPENAI_API_KEY,
+    api_version=AZURE_OPENAI_API_VERSION,
+    azure_endpoint=AZURE_OPENAI_ENDPOINT,
+    max_retries=0,
+    http_client=httpx.AsyncClient(limits=_limits),
+)
+
+scheduler = AzureScheduler(AZURE_MAX_CONCURRENCY, rpm=AZURE_RPM_LIMIT, tpm=AZURE_TPM_LIMIT)
+
+queue_wait = metrics.histogram(
+    "meeting_azure_queue_wait_seconds", "Thời gian chờ slot gọi Azure theo độ ưu tiên", ("priority",)
+)
+azure_retries = metrics.counter(
+    "meeting_azure_openai_retries_total", "Số lần thử lại lời gọi Azure OpenAI", ("operation", "error")
+)
+
+
+# ============================================================
+# 🔁 Retry tập trung
+# ============================================================
+def _retry_after(error: RateLimitError) -> float:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        try:
+            return max(float(headers.get(name)) * scale, 0.0)
+        except (TypeError, ValueError):
+            continue
+    return DEFAULT_RETRY_AFTER_S
+
+
+def _backoff(attempt: int) -> float:
+    return random.uniform(0, min(BACKOFF_MAX_S, 0.5 * 2 ** attempt))  # full jitter
+
+
+def _on_error(operation: str, error: Exception, attempt: int):
+    """Xử lý lỗi của 1 lần gọi: ném lại nếu không retry được, trả về số giây cần chờ (0 = xếp hàng lại ngay)."""
+    if isinstance(error, RateLimitError):
+        scheduler.throttle(_retry_after(error))
+        scheduler.count("rate_limited")
+        delay = 0.0
+    elif isinstance(error, RETRYABLE_ERRORS):
+        delay = _backoff(attempt)
+    else:
+        raise error
+    if attempt >= AZURE_MAX_RETRIES:
+        scheduler.count("failed")
+        raise error
+    scheduler.count("retries")
+    azure_retries.inc(operation=operation, error=type(error).__name__)
+    logger.warning(f"Azure {operation}: {type(error).__name__}, thử lại lần {attempt + 1} sau {delay:.1f}s")
+    return delay
+
+
+def _estimate_tokens(messages: list, params: dict) -> int:
+    return count_message_tokens(messages) + int(params.get("max_tokens") or 0)
+
+
+def _used_tokens(response):
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None) if usage is not None else None
+
+
+# ============================================================
+# 💬 API
+# ============================================================
+def chat(messages: list, priority: str = "interactive", **params):
+    """chat.completions.create (sync) qua bộ lập lịch + retry tập trung."""
+    tokens = _estimate_tokens(messages, params)
+    for attempt in itertools.count():
+        with scheduler.slot(priority, tokens) as waiter:
+            try:
+                raw = sync_client.chat.completions.with_raw_response.create(messages=messages, **params)
+            except Exception as e:
+                delay = _on_error("chat", e, attempt)
+            else:
+                scheduler.observe_headers(raw.headers)
+                response = raw.parse()
+                waiter.used_tokens = _used_tokens(response)
+                return response
+        time.sleep(delay)
+
+
+async def achat(messages: list, priority: str = "interactive", **params):
+    """Bản async của chat()."""
+    tokens = _estimate_tokens(messages, params)
+    for attempt in itertools.count():
+        async with scheduler.aslot(priority, tokens) as waiter:
+            try:
+                raw = await async_client.chat.completions.with_raw_response.create(messages=messages, **params)
+            except Exception as e:
+                delay = _on_error("chat", e, attempt)
+            else:
+                scheduler.observe_headers(raw.headers)
+                response = raw.parse()
+                waiter.used_tokens = _used_tokens(response)
+                return response
+        await asyncio.sleep(delay)
+
+
+async def astream_chat(messages: list, priority: str = "interactive", **params):
+    """
+    Stream completion: yield từng chunk, giữ slot suốt thời gian stream.
+    Chỉ retry bước mở stream (trước chunk đầu tiên), không retry giữa chừng.
+    """
+    tokens = _estimate_tokens(messages, params)
+    for attempt in itertools.count():
+        async with scheduler.aslot(priority, tokens):
+            try:
+                raw = await async_client.chat.completions.with_raw_response.create(
+                    messages=messages, stream=True, **params)
+            except Exception as e:
+                delay = _on_error("stream", e, attempt)
+            else:
+                scheduler.observe_headers(raw.headers)
+                async for chunk in raw.parse():
+                    yield chunk
+                return
+        await asyncio.sleep(delay)
+
+
+def embed(texts: list, model: str = AZURE_EMBEDDING_DEPLOYMENT, priority: str = "interactive") -> list:
+    """Embedding qua Azure (deployment AZURE_EMBEDDING_DEPLOYMENT). Trả về list vector theo thứ tự."""
+    tokens = sum(len(t) for t in texts) // 4
+    for attempt in itertools.count():
+        with scheduler.slot(priority, tokens) as waiter:
+            try:
+                raw = sync_client.embeddings.with_raw_response.create(model=model, input=texts)
+            except Exception as e:
+                delay = _on_error("embeddings", e, attempt)
+            else:
+                scheduler.observe_headers(raw.headers)
+                response = raw.parse()
+                waiter.used_tokens = _used_tokens(response)
+                return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+        time.sleep(delay)
+
+
+def azure_stats() -> dict:
+    return scheduler.stats()
+
+
+def _collect_azure_gauges():
+    stats = scheduler.stats()
+    return [
+        ("meeting_azure_in_flight", "gauge", "Số lời gọi Azure đang chạy", [({}, stats["in_flight"])]),
+        ("meeting_azure_queued", "gauge", "Số lời gọi Azure đang chờ slot",
+         [({"priority": p}, s["queued"]) for p, s in stats["priorities"].items()]),
+        ("meeting_azure_paused_seconds", "gauge", "Thời gian còn lại của lần tạm dừng do 429/hết quota",
+         [({}, stats["paused_for_s"])]),
+        ("meeting_azure_rate_limited_total", "counter", "Số response 429 từ Azure", [({}, stats["rate_limited"])]),
+    ]
+
+
+metrics.register_collector(_collect_azure_gauges)
@@ -4,23 +4,42 @@
 
 import logging
 import re
+import threading
+import time
 from collections import defaultdict
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 import chromadb
 import numpy as np
-from numpy.linalg import norm
-from scipy.spatial.distance import cosine
-from tenacity import retry, wait_random_exponential, stop_after_attempt, retry_if_exception_type
-from openai import AzureOpenAI, OpenAI, APIError, RateLimitError, APITimeoutError
-from sentence_transformers import SentenceTransformer, CrossEncoder
 
 from api.services.chroma_client import get_chroma_collection
 from api.config.config import (
-    AZURE_OPENAI_API_KEY,
-    AZURE_OPENAI_API_VERSION,
-    AZURE_OPENAI_ENDPOINT,
+    AZURE_EMBEDDING_DEPLOYMENT,
+    CHROMA_WRITE_BUFFER_SIZE,
+    EMBEDDING_CACHE_SIZE,
+    EMBEDDING_CACHE_PATH,
+    EMBEDDING_CACHE_DISK_MAX_ITEMS,
+    EMBED_BATCH_MAX_SIZE,
+    EMBED_BATCH_MAX_WAIT_MS,
+    RERANK_BATCH_MAX_SIZE,
+    RERANK_BATCH_MAX_WAIT_MS,
+    CONTEXT_SUMMARY_MAX_TOKENS,
+    RERANK_ENABLED,
+    RERANK_CANDIDATES,
+    RERANK_TOP_N,
+    RERANK_BUDGET_MS,
+    RERANK_HIT_THRESHOLD,
+    RERANK_ANSWER_THRESHOLD,
+    EMBEDDER_BACKEND,
+    ONNX_EMBEDDER_PATH,
 )
+from api.services import azure_client
+from api.services.embedding_cache import EmbeddingCache
+from api.services.micro_batcher import MicroBatcher
+from api.services.model_registry import registry
 from api.services.moderation_service import moderate_input
+from api.utils import metrics
+from api.utils.tokens import count_message_tokens
 
 
 # ============================================================
@@ -35,44 +54,165 @@ logger = logging.getLogger(__name__)
 collection = get_chroma_collection()  # Kết nối đến ChromaDB
 
 # Mô hình embedding cục bộ (nhẹ, miễn phí)
-local_embedder = SentenceTransformer("sentence-transformers/multi-qa-MiniLM-L6-cos-v1")
+LOCAL_EMBEDDING_MODEL = "sentence-transformers/multi-qa-MiniLM-L6-cos-v1"
+OPENAI_EMBEDDING_MODEL = AZURE_EMBEDDING_DEPLOYMENT
+RERANKER_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
 
-# Mô hình reranker dùng cho fallback
-reranker = CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2")
 
-# Client OpenAI (sử dụng khi cần embedding từ API)
-openai_client = OpenAI(api_key=AZURE_OPENAI_API_KEY)
 
-# Client Azure OpenAI (dùng để sinh phản hồi hội thoại)
-client = AzureOpenAI(
-    api_key=AZURE_OPENAI_API_KEY,
-    api_version=AZURE_OPENAI_API_VERSION,
-    azure_endpoint=AZURE_OPENAI_ENDPOINT,
+# Backend encode cho model cục bộ (EMBEDDER_BACKEND); vector cùng không gian nên dùng chung collection,
+# nhưng cache embedding tách riêng theo backend để không lẫn vector fp32 và int8
+EMBEDDER_BACKENDS = ("torch", "onnx-int8")
+LOCAL_EMBEDDING_CACHE_MODEL = (
+    LOCAL_EMBEDDING_MODEL if EMBEDDER_BACKEND == "torch" else f"{LOCAL_EMBEDDING_MODEL}#{EMBEDDER_BACKEND}"
 )
 
 
+def load_embedder(backend: str = EMBEDDER_BACKEND):
+    """Tạo model embedding theo backend (dùng cho registry, benchmark và kiểm tra độ khớp)."""
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(LOCAL_EMBEDDING_MODEL)
+    if backend == "onnx-int8":
+        from api.services.onnx_embedder import OnnxEmbedder
+        return OnnxEmbedder(ONNX_EMBEDDER_PATH)
+    raise ValueError(f"EMBEDDER_BACKEND không hợp lệ: {backend} (chọn: {', '.join(EMBEDDER_BACKENDS)})")
+
+
+def _load_embedder():
+    return load_embedder(EMBEDDER_BACKEND)
+
+
+def _load_reranker():
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(RERANKER_MODEL)
+
+
+# Model chỉ được load khi dùng lần đầu (hoặc warmup trong lifespan)
+registry.register("embedder", _load_embedder)
+registry.register("reranker", _load_reranker)
+
+# Cache embedding (LRU trong RAM + SQLite trên đĩa), khoá theo model + văn bản
+embedding_cache = EmbeddingCache(max_items=EMBEDDING_CACHE_SIZE, db_path=EMBEDDING_CACHE_PATH or None,
+                                 disk_max_items=EMBEDDING_CACHE_DISK_MAX_ITEMS)
+
+# Gom các lời gọi encode/predict đồng thời thành 1 lô cho model cục bộ
+embed_batcher = MicroBatcher(
+    lambda texts: registry.get("embedder").encode(texts, convert_to_numpy=True).tolist(),
+    max_batch_size=EMBED_BATCH_MAX_SIZE,
+    max_wait_ms=EMBED_BATCH_MAX_WAIT_MS,
+    name="embedder",
+)
+rerank_batcher = MicroBatcher(
+    lambda pairs: registry.get("reranker").predict(pairs).tolist(),
+    max_batch_size=RERANK_BATCH_MAX_SIZE,
+    max_wait_ms=RERANK_BATCH_MAX_WAIT_MS,
+    name="reranker",
+)
+
+# Gọi Azure OpenAI (chat + embedding) qua client dùng chung: api/services/azure_client.py
+
+
 # ============================================================
 # 🔧 Hàm tiện ích: Sinh embedding an toàn
 # ============================================================
+def _encode_local(texts: list) -> list:
+    """Encode theo lô bằng model cục bộ, có qua cache."""
+    cached = embedding_cache.get_many(LOCAL_EMBEDDING_CACHE_MODEL, texts)
+    missing = [i for i, vec in enumerate(cached) if vec is None]
+    if missing:
+        with metrics.timed("embedding"):
+            encoded = embed_batcher.run([texts[i] for i in missing])
+        embedding_cache.put_many(LOCAL_EMBEDDING_CACHE_MODEL, [texts[i] for i in missing], encoded)
+        for i, vec in zip(missing, encoded):
+            cached[i] = vec
+    return cached
+
+
 def get_embedding(text: str, use_openai: bool = False):
     """
     Sinh vector embedding từ văn bản.
 
-    - Nếu use_openai=True → sử dụng OpenAI API (text-embedding-3-small)
+    - Nếu use_openai=True → sử dụng Azure OpenAI (deployment AZURE_EMBEDDING_DEPLOYMENT)
     - Ngược lại → sử dụng mô hình cục bộ (multi-qa-MiniLM-L6-cos-v1)
+    Kết quả được cache riêng cho từng model.
     """
     if use_openai:
+        cached = embedding_cache.get(OPENAI_EMBEDDING_MODEL, text)
+        if cached is not None:
+            return cached
         try:
-            response = openai_client.embeddings.create(
-                model="text-embedding-3-small",
-                input=text
-            )
-            return response.data[0].embedding
+            with metrics.timed("embedding"):
+                embedding = azure_client.embed([text], model=OPENAI_EMBEDDING_MODEL)[0]
+            embedding_cache.put(OPENAI_EMBEDDING_MODEL, text, embedding)
+            return embedding
         except Exception as e:
             logger.warning(f"Lỗi khi gọi OpenAI embedding API, fallback sang local: {e}")
-            return local_embedder.encode(text, convert_to_numpy=True).tolist()
+            return _encode_local([text])[0]
     else:
-        return local_embedder.encode(text, convert_to_numpy=True).tolist()
+        return _encode_local([text])[0]
+
+
+def get_embeddings(texts: list) -> list:
+    """Sinh embedding cho nhiều văn bản bằng model cục bộ (1 lần encode cho phần chưa cache)."""
+    return _encode_local(list(texts)) if texts else []
+
+
+def rerank_scores(query: str, candidates: list) -> list:
+    """Chấm điểm (query, candidate) bằng CrossEncoder, gom lô với các request đồng thời."""
+    if not candidates:
+        return []
+    return [float(x) for x in rerank_batcher.run([(query, c) for c in candidates])]
+
+
+# Thống kê rerank + độ trễ trung bình (EWMA) mỗi cặp để ước lượng trước khi chạy
+_rerank_lock = threading.Lock()
+_rerank_stats = {"reranked": 0, "skipped_load": 0, "skipped_timeout": 0, "ewma_ms_per_pair": None}
+_EWMA_ALPHA = 0.2
+
+
+def _sigmoid(x) -> np.ndarray:
+    # ms-marco CrossEncoder trả về logit → đưa về xác suất [0, 1] để so với ngưỡng của search_memory
+    return 1.0 / (1.0 + np.exp(-np.asarray(x, dtype=np.float32)))
+
+
+def rerank_within_budget(query: str, candidates: list, budget_ms: float = RERANK_BUDGET_MS):
+    """
+    Chấm lại (query, candidate) bằng CrossEncoder trong giới hạn thời gian.
+    Trả về mảng xác suất, hoặc None nếu bỏ qua: reranker bị tắt, ước lượng vượt ngân sách
+    (hàng đợi dài / độ trễ gần đây cao) hoặc chạy quá ngân sách.
+    """
+    if not candidates or not registry.is_enabled("reranker"):
+        return None
+
+    with _rerank_lock:
+        ewma = _rerank_stats["ewma_ms_per_pair"]
+    if ewma is not None:
+        backlog = rerank_batcher.stats()["queue_depth"] / max(RERANK_BATCH_MAX_SIZE, 1)
+        if ewma * len(candidates) * (1 + backlog) > budget_ms:
+            with _rerank_lock:
+                _rerank_stats["skipped_load"] += 1
+            return None
+
+    start = time.perf_counter()
+    deadline = start + budget_ms / 1000
+    futures = [rerank_batcher.submit((query, c)) for c in candidates]
+    try:
+        raw = [f.result(timeout=max(deadline - time.perf_counter(), 0)) for f in futures]
+    except FutureTimeoutError:
+        # Quá ngân sách (vd: model đang load lần đầu) → dùng kết quả cosine
+        for f in futures:
+            f.cancel()
+        with _rerank_lock:
+            _rerank_stats["skipped_timeout"] += 1
+        return None
+
+    per_pair = (time.perf_counter() - start) * 1000 / len(candidates)
+    with _rerank_lock:
+        _rerank_stats["reranked"] += 1
+        ewma = _rerank_stats["ewma_ms_per_pair"]
+        _rerank_stats["ewma_ms_per_pair"] = per_pair if ewma is None else ewma + _EWMA_ALPHA * (per_pair - ewma)
+    return _sigmoid(raw)
 
 
 def safe_get_embedding(query: str):
@@ -90,22 +230,151 @@ def safe_get_embedding(query: str):
 # ============================================================
 # 💾 Lưu hội thoại vào ChromaDB
 # ============================================================
-def save_to_chroma(session_id: str, user_message: str, assistant_reply: str):
+# Bộ đếm lượt theo từng session: ID = f"{session_id}_{turn}".
+# Chỉ đọc Chroma một lần cho mỗi session (lấy số lượt lớn nhất đã lưu),
+# sau đó tăng dần trong bộ nhớ → chi phí không phụ thuộc kích thước collection.
+_turn_counters = {}
+_turn_lock = threading.Lock()
+
+# Bộ đệm ghi (chế độ buffered): gom nhiều lượt rồi ghi bằng 1 lần collection.add
+_write_buffer = []
+_buffer_lock = threading.Lock()
+
+
+def _load_last_turn(session_id: str) -> int:
+    """Lấy số lượt lớn nhất đã lưu của session trong Chroma (-1 nếu chưa có)."""
+    ids = collection.get(where={"session_id": session_id}, include=[])["ids"]
+    last_turn = -1
+    for doc_id in ids:
+        suffix = doc_id.rsplit("_", 1)[-1]
+        if suffix.isdigit():
+            last_turn = max(last_turn, int(suffix))
+    return last_turn
+
+
+def _next_turn(session_id: str, at_least: int = None) -> int:
+    """
+    Cấp số lượt tiếp theo (tăng đơn điệu, không tái sử dụng sau khi xóa).
+    `at_least`: số lượt do session store cấp (duy nhất giữa các worker) → tránh trùng ID khi chạy nhiều worker.
+    """
+    with _turn_lock:
+        if session_id not in _turn_counters:
+            _turn_counters[session_id] = _load_last_turn(session_id) + 1
+        turn = max(_turn_counters[session_id], at_least if at_least is not None else -1)
+        _turn_counters[session_id] = turn + 1
+    return turn
+
+
+def _add_records(records: list):
+    """
+    Sinh embedding theo lô và ghi tất cả records bằng một lần collection.add.
+    Vector lưu trong Chroma là embedding của câu hỏi User (không phải cả đoạn hội thoại),
+    để search_memory chấm điểm trực tiếp trên vector trả về mà không phải encode lại.
+    """
+    if not records:
+        return
+    with metrics.timed("save_to_chroma"):
+        questions = [r["metadata"]["question"] for r in records]
+        embeddings = get_embeddings(questions)
+
+        collection.add(
+            documents=[r["document"] for r in records],
+            embeddings=embeddings,
+            metadatas=[r["metadata"] for r in records],
+            ids=[r["id"] for r in records],
+        )
+
+
+def _make_record(session_id: str, user_message: str, assistant_reply: str, turn: int = None) -> dict:
+    turn = _next_turn(session_id, turn)
+    return {
+        "id": f"{session_id}_{turn}",
+        "document": f"[{session_id}] User: {user_message}\nAssistant: {assistant_reply}",
+        "metadata": {
+            "session_id": session_id,
+            "turn": turn,
+            "question": user_message.strip(),
+            "answer": assistant_reply.strip(),
+            "created_at": time.time(),  # dùng cho eviction theo TTL/số lượng (memory_maintenance)
+        },
+    }
+
+
+def save_to_chroma(session_id: str, user_message: str, assistant_reply: str, buffered: bool = None,
+                   turn: int = None) -> str:
     """
     Lưu một lượt hội thoại (user + assistant) vào ChromaDB.
+
+    - buffered=True → đưa vào bộ đệm, tự flush khi đủ CHROMA_WRITE_BUFFER_SIZE lượt.
+    - buffered=None → bật theo cấu hình (CHROMA_WRITE_BUFFER_SIZE > 1).
+    - turn: số lượt gợi ý (từ session store), ID thực tế không nhỏ hơn giá trị này.
+    Trả về ID của bản ghi.
+    """
+    if buffered is None:
+        buffered = CHROMA_WRITE_BUFFER_SIZE > 1
+
+    record = _make_record(session_id, user_message, assistant_reply, turn)
+
+    if not buffered:
+        _add_records([record])
+        logger.info(f"Đã lưu hội thoại vào Chroma (ID: {record['id']})")
+        return record["id"]
+
+    with _buffer_lock:
+        _write_buffer.append(record)
+        should_flush = len(_write_buffer) >= max(CHROMA_WRITE_BUFFER_SIZE, 1)
+    if should_flush:
+        flush_chroma_buffer()
+    return record["id"]
+
+
+def save_turns_to_chroma(turns: list) -> list:
+    """
+    Ghi nhiều lượt (session_id, user_message, assistant_reply, turn|None) bằng 1 lần encode + 1 lần collection.add.
+    Trả về danh sách ID theo thứ tự.
     """
-    text = f"[{session_id}] User: {user_message}\nAssistant: {assistant_reply}"
-    embedding = get_embedding(text)
-    all_ids = collection.get()["ids"]
-    next_id = f"{session_id}_{len(all_ids)}"
+    records = [_make_record(*t) for t in turns]
+    _add_records(records)
+    logger.info(f"Đã lưu {len(records)} lượt hội thoại vào Chroma")
+    return [r["id"] for r in records]
+
+
+def existing_chroma_ids(ids: list) -> set:
+    """Các ID đã có trong Chroma (dùng khi replay để không ghi trùng)."""
+    if not ids:
+        return set()
+    return set(collection.get(ids=list(ids), include=[])["ids"])
+
+
+def flush_chroma_buffer() -> int:
+    """Ghi toàn bộ bộ đệm xuống Chroma. Trả về số lượt đã ghi."""
+    with _buffer_lock:
+        records = _write_buffer[:]
+        _write_buffer.clear()
+    if not records:
+        return 0
+    try:
+        _add_records(records)
+    except Exception:
+        # Trả lại bộ đệm để lần flush sau thử lại
+        with _buffer_lock:
+            _write_buffer[:0] = records
+        raise
+    logger.info(f"Đã flush {len(records)} lượt hội thoại vào Chroma")
+    return len(records)
+
+
+def _has_buffered(session_id: str) -> bool:
+    with _buffer_lock:
+        return any(r["metadata"]["session_id"] == session_id for r in _write_buffer)
 
-    collection.add(
-        documents=[text],
-        embeddings=[embedding],
-        metadatas=[{"session_id": session_id}],
-        ids=[next_id],
-    )
-    logger.info(f"Đã lưu hội thoại vào Chroma (ID: {next_id})")
+
+def discard_session(session_id: str):
+    """Bỏ các lượt đang chờ ghi và bộ đếm của session (dùng khi xóa session)."""
+    with _buffer_lock:
+        _write_buffer[:] = [r for r in _write_buffer if r["metadata"]["session_id"] != session_id]
+    with _turn_lock:
+        _turn_counters.pop(session_id, None)
 
 
 # ============================================================
@@ -124,121 +393,381 @@ def extract_qa_from_doc(doc: str):
     return question, answer
 
 
+def cosine_scores(query_vec, matrix) -> np.ndarray:
+    """Tính cosine giữa 1 vector truy vấn và từng hàng của ma trận (vector hoá)."""
+    q = np.asarray(query_vec, dtype=np.float32)
+    m = np.asarray(matrix, dtype=np.float32).reshape(-1, q.shape[0])
+    denom = np.linalg.norm(m, axis=1) * np.linalg.norm(q)
+    return np.divide(m @ q, denom, out=np.zeros(len(m), dtype=np.float32), where=denom > 0)
+
+
 def cosine_similarity(vec1, vec2):
     """Tính độ tương đồng cosine giữa hai vector."""
     if vec1 is None or vec2 is None:
         return 0.0
-    vec1, vec2 = np.array(vec1), np.array(vec2)
-    if np.linalg.norm(vec1) == 0 or np.linalg.norm(vec2) == 0:
-        return 0.0
-    return 1 - cosine(vec1, vec2)
+    return float(cosine_scores(vec1, [vec2])[0])
 
 
-def search_memory(session_id: str, query: str, top_k: int = 3, threshold: float = 0.7, return_score=False):
+def _candidate_questions(docs: list, metadatas: list, embeddings) -> tuple:
     """
-    Tìm kiếm trong trí nhớ hội thoại (ChromaDB).
-    - Chỉ so sánh phần câu hỏi của User.
-    - Nếu câu hỏi trùng khớp (score ≥ 0.9), lấy lại câu trả lời cũ của Assistant.
-    - Nếu không, so sánh bằng cosine và trả về kết quả tốt nhất.
+    Chuẩn hoá danh sách ứng viên thành (questions, answers, docs, vectors).
+    - Bản ghi mới: câu hỏi/câu trả lời nằm trong metadata, vector chính là embedding câu hỏi.
+    - Bản ghi cũ (vector của cả đoạn hội thoại): tách câu hỏi từ doc và encode lại theo 1 lô.
     """
+    questions, answers, kept_docs, vectors, legacy = [], [], [], [], []
+    for doc, meta, emb in zip(docs, metadatas, embeddings):
+        meta = meta or {}
+        if meta.get("question") is not None:
+            user_q, ai_ans = meta.get("question", ""), meta.get("answer", "")
+        else:
+            user_q, ai_ans = extract_qa_from_doc(doc)
+            emb = None
+        if not user_q or not ai_ans:
+            continue
+        if emb is None:
+            legacy.append(len(vectors))
+        questions.append(user_q)
+        answers.append(ai_ans)
+        kept_docs.append(doc)
+        vectors.append(emb)
+
+    if legacy:
+        legacy_embs = get_embeddings([questions[i] for i in legacy])
+        for i, emb in zip(legacy, legacy_embs):
+            vectors[i] = emb
+    return questions, answers, kept_docs, vectors
+
+
+# Tỉ lệ trả lời lại từ trí nhớ (ghi ở route, nơi quyết định dùng lại câu trả lời cũ hay gọi model)
+memory_lookups = metrics.counter(
+    "meeting_memory_lookups_total", "Số lần tìm trí nhớ theo kết quả (hit = dùng lại câu trả lời cũ)", ("result",)
+)
+
+
+def record_memory_lookup(hit: bool):
+    memory_lookups.inc(result="hit" if hit else "miss")
+
+
+def _collect_memory_hit_ratio():
+    hits, misses = memory_lookups.value(result="hit"), memory_lookups.value(result="miss")
+    samples = [({}, hits / (hits + misses))] if hits + misses else []
+    return [("meeting_memory_hit_ratio", "gauge", "Tỉ lệ lượt chat trả lời lại từ trí nhớ", samples)]
+
+
+metrics.register_collector(_collect_memory_hit_ratio)
+
+# Ngưỡng theo bộ chấm đã quyết định: (trùng → dùng lại, trùng cao → chỉ lấy câu trả lời).
+# Điểm cosine và xác suất CrossEncoder khác thang → không dùng chung ngưỡng.
+SCORE_THRESHOLDS = {
+    "cosine": (0.7, 0.9),
+    "rerank": (RERANK_HIT_THRESHOLD, RERANK_ANSWER_THRESHOLD),
+}
+memory_scorer = metrics.counter(
+    "meeting_memory_scorer_total", "Số lần tìm trí nhớ theo bộ chấm quyết định và kết quả", ("scorer", "result")
+)
+
+
+def search_memory(session_id: str, query: str, top_k: int = 3, threshold: float = None, return_score=False,
+                  rerank: bool = None, return_scorer=False):
+    """
+    Tìm kiếm trong trí nhớ hội thoại (ChromaDB), 2 bước:
+    1. Lấy RERANK_CANDIDATES ứng viên gần nhất (ANN) và chấm cosine trên câu hỏi của User
+       (vector câu hỏi đã lưu sẵn lúc ghi → chỉ tốn 1 lần encode câu truy vấn).
+    2. Chấm lại RERANK_TOP_N ứng viên tốt nhất bằng CrossEncoder trong 1 lô (nếu còn trong ngân sách
+       RERANK_BUDGET_MS); điểm trả về khi đó là xác suất trùng của CrossEncoder.
+    - Ngưỡng trùng / trùng cao theo bộ chấm đã quyết định (SCORE_THRESHOLDS): cosine 0.7 / 0.9,
+      CrossEncoder RERANK_HIT_THRESHOLD / RERANK_ANSWER_THRESHOLD. threshold truyền vào → ghi đè ngưỡng trùng.
+    - Trùng cao → lấy lại câu trả lời cũ của Assistant.
+    - rerank=None → theo cấu hình RERANK_ENABLED; rerank=False → chỉ dùng cosine (như top_k cũ).
+    - return_scorer=True → trả về (doc, score, "cosine" | "rerank").
+    """
+    def result(doc: str, score: float, scorer: str = "cosine"):
+        if return_scorer:
+            return doc, score, scorer
+        return (doc, score) if return_score else doc
+
+    if rerank is None:
+        rerank = RERANK_ENABLED
+    # Đảm bảo các lượt còn trong bộ đệm của session này đã được ghi
+    if _has_buffered(session_id):
+        flush_chroma_buffer()
+
     query_emb = safe_get_embedding(query)
     if not query_emb:
-        return ("", 0.0) if return_score else ""
+        return result("", 0.0)
 
     try:
-        results = collection.query(
-            query_embeddings=[query_emb],
-            n_results=top_k,
-            where={"session_id": session_id},
-            include=["documents"]
-        )
+        with metrics.timed("chroma_query"):
+            results = collection.query(
+                query_embeddings=[query_emb],
+                n_results=max(top_k, RERANK_CANDIDATES) if rerank else top_k,
+                where={"session_id": session_id},
+                include=["documents", "metadatas", "embeddings"]
+            )
     except ValueError:
-        return ("", 0.0) if return_score else ""
+        return result("", 0.0)
 
-    candidate_docs = results.get("documents", [[]])[0]
+    candidate_docs = (results.get("documents") or [[]])[0]
     if not candidate_docs:
-        return ("", 0.0) if return_score else ""
+        return result("", 0.0)
+    candidate_metas = (results.get("metadatas") or [[None] * len(candidate_docs)])[0]
+    candidate_embs = results.get("embeddings")
+    candidate_embs = candidate_embs[0] if candidate_embs is not None else [None] * len(candidate_docs)
+
+    questions, answers, docs, vectors = _candidate_questions(candidate_docs, candidate_metas, candidate_embs)
+    if not vectors:
+        return result("", 0.0)
+
+    # So sánh câu hỏi của User bằng 1 phép cosine vector hoá
+    with metrics.timed("rescore"):
+        scores = cosine_scores(query_emb, np.stack([np.asarray(v, dtype=np.float32) for v in vectors]))
+        best = int(np.argmax(scores))
+        best_score = max(float(scores[best]), 0.0)
+        scorer = "cosine"
+
+        if rerank:
+            shortlist = np.argsort(-scores)[:max(RERANK_TOP_N, 1)]
+            probs = rerank_within_budget(query, [questions[i] for i in shortlist])
+            if probs is not None:
+                best = int(shortlist[int(np.argmax(probs))])
+                best_score = float(np.max(probs))
+                scorer = "rerank"
+    hit_threshold, answer_threshold = SCORE_THRESHOLDS[scorer]
+    if threshold is not None:
+        hit_threshold = threshold
+    best_doc = answers[best] if best_score >= answer_threshold else docs[best]  # Nếu trùng cao, chỉ lấy câu trả lời
+
+    hit = best_score >= hit_threshold
+    memory_scorer.inc(scorer=scorer, result="hit" if hit else "miss")
+    return result(best_doc if hit else "", best_score, scorer)
 
-    best_doc = ""
-    best_score = 0.0
 
-    # So sánh từng doc dựa trên câu hỏi của User
-    for doc in candidate_docs:
-        user_q, ai_ans = extract_qa_from_doc(doc)
-        if not user_q or not ai_ans:
-            continue
-
-        user_q_emb = safe_get_embedding(user_q)
-        if not user_q_emb:
-            continue
-
-        sim = cosine_similarity(query_emb, user_q_emb)
+# ============================================================
+# 🔁 Hàm gọi Azure OpenAI (retry + giới hạn quota nằm ở azure_client)
+# ============================================================
+CHAT_COMPLETION_PARAMS = {
+    "model": "gpt-4o-mini",
+    "temperature": 0.3,
+    "max_tokens": 800,
+    "timeout": 30,
+}
 
-        if sim > best_score:
-            best_score = sim
-            best_doc = ai_ans if sim >= 0.9 else doc  # Nếu trùng cao, chỉ lấy câu trả lời
+# Câu trả lời thay thế khi model lỗi / không trả về nội dung (không được cache hay dùng lại)
+NO_REPLY_MESSAGE = "Không có phản hồi từ mô hình."
+MODEL_ERROR_MESSAGE = "Đã xảy ra lỗi khi xử lý yêu cầu từ mô hình."
+FALLBACK_REPLIES = {NO_REPLY_MESSAGE, MODEL_ERROR_MESSAGE}
 
-    if best_score >= threshold:
-        return (best_doc, float(best_score)) if return_score else best_doc
-    else:
-        return ("", float(best_score)) if return_score else ""
+# Độ ưu tiên khi xếp hàng gọi Azure theo loại lời gọi (chat tương tác luôn được phục vụ trước)
+USAGE_PRIORITY = {"chat": "interactive", "transcript": "batch", "summary": "background"}
 
 
-# ============================================================
-# 🔁 Hàm gọi Azure OpenAI (có retry tự động)
-# ============================================================
-@retry(
-    retry=retry_if_exception_type((RateLimitError, APIError, APITimeoutError)),
-    wait=wait_random_exponential(min=1, max=30),
-    stop=stop_after_attempt(3),
-)
-def _call_azure_openai(messages: list):
+def _call_azure_openai(messages: list, priority: str = "interactive"):
     """
     Gửi yêu cầu đến Azure OpenAI để sinh phản hồi hội thoại.
-    Có cơ chế retry khi bị lỗi tạm thời (RateLimit, Timeout, APIError).
+    Retry khi bị lỗi tạm thời (429, timeout, 5xx) do azure_client đảm nhận.
     """
     logger.info("Gửi request đến Azure OpenAI...")
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=messages,
-        temperature=0.3,
-        max_tokens=800,
-        timeout=30,
-    )
+    response = azure_client.chat(messages, priority=priority, **CHAT_COMPLETION_PARAMS)
     logger.info("Nhận phản hồi thành công từ Azure OpenAI.")
     return response
 
 
+async def _acall_azure_openai(messages: list, priority: str = "interactive", **params):
+    """Bản async của _call_azure_openai. `params` ghi đè CHAT_COMPLETION_PARAMS."""
+    logger.info("Gửi request (async) đến Azure OpenAI...")
+    response = await azure_client.achat(messages, priority=priority, **{**CHAT_COMPLETION_PARAMS, **params})
+    logger.info("Nhận phản hồi thành công từ Azure OpenAI.")
+    return response
+
+
+# ============================================================
+# 🧮 Thống kê token
+# ============================================================
+# "chat" = các lượt hội thoại, "summary" = chi phí gộp lịch sử cũ vào bản tóm tắt,
+# "transcript" = tóm tắt biên bản họp (map-reduce)
+# prompt_tokens_estimated: đếm trước khi gửi; prompt/completion_tokens: theo usage Azure trả về (nếu có)
+_usage_lock = threading.Lock()
+token_usage = {
+    kind: {"calls": 0, "prompt_tokens_estimated": 0, "prompt_tokens": 0, "completion_tokens": 0}
+    for kind in ("chat", "summary", "transcript")
+}
+
+
+def _record_usage(kind: str, prompt: list, response=None) -> int:
+    """Cộng dồn token của 1 lần gọi model. Trả về số token prompt ước lượng."""
+    estimated = count_message_tokens(prompt)
+    usage = getattr(response, "usage", None)
+    with _usage_lock:
+        counter = token_usage[kind]
+        counter["calls"] += 1
+        counter["prompt_tokens_estimated"] += estimated
+        if usage is not None:
+            counter["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+            counter["completion_tokens"] += getattr(usage, "completion_tokens", 0) or 0
+    return estimated
+
+
 # ============================================================
 # 💬 Hàm chính: Sinh phản hồi hội thoại (kết hợp memory)
 # ============================================================
+def _build_prompt(messages: list, user_input: str = None, memory_context: str = None) -> list:
+    """
+    Tạo danh sách message gửi lên model (không sửa `messages` gốc của session).
+    Nếu có 'memory_context' thì nối thêm vào message cuối để cung cấp ngữ cảnh.
+    """
+    user_message = user_input or messages[-1]["content"]
+
+    # Thêm phần trí nhớ trước đó nếu có
+    if memory_context:
+        user_message += f"\n\nThông tin liên quan từ các lần trao đổi trước:\n{memory_context}\n"
+
+    # Chỉ gửi role/content (bỏ các trường nội bộ như audio_path)
+    prompt = [{"role": m["role"], "content": m["content"]} for m in messages]
+    prompt[-1]["content"] = user_message
+    return prompt
+
+
+def _extract_reply(response) -> str:
+    if not response or not response.choices:
+        return NO_REPLY_MESSAGE
+    reply = response.choices[0].message.content.strip()
+    logger.info("Model trả về phản hồi hợp lệ.")
+    return reply
+
+
 def generate_summary(messages: list, user_input: str = None, memory_context: str = None) -> str:
     """
     Sinh phản hồi hội thoại từ Azure OpenAI.
     Nếu có 'memory_context' thì nối thêm vào prompt để cung cấp ngữ cảnh.
     """
     try:
-        user_message = user_input or messages[-1]["content"]
-
-        # Thêm phần trí nhớ trước đó nếu có
-        if memory_context:
-            user_message += f"\n\nThông tin liên quan từ các lần trao đổi trước:\n{memory_context}\n"
-
-        temp_messages = messages.copy()
-        temp_messages[-1]["content"] = user_message
+        temp_messages = _build_prompt(messages, user_input, memory_context)
 
         # (Tuỳ chọn) Kiểm duyệt nội dung người dùng
         # if not moderate_input(user_message):
         #     return "Nội dung bị từ chối — vui lòng không gửi dữ liệu nhạy cảm."
 
-        response = _call_azure_openai(temp_messages)
-        if not response or not response.choices:
-            return "Không có phản hồi từ mô hình."
+        with metrics.timed("azure_openai"):
+            response = _call_azure_openai(temp_messages)
+        _record_usage("chat", temp_messages, response)
+        return _extract_reply(response)
 
-        reply = response.choices[0].message.content.strip()
-        logger.info("Model trả về phản hồi hợp lệ.")
-        return reply
+    except Exception as e:
+        logger.exception(f"Lỗi khi gọi Azure OpenAI: {e}")
+        return MODEL_ERROR_MESSAGE
+
+
+async def agenerate_summary(messages: list, user_input: str = None, memory_context: str = None,
+                            raise_errors: bool = False, priority: str = "interactive") -> str:
+    """
+    Bản async của generate_summary, xếp hàng gọi Azure theo `priority` (xem azure_client.PRIORITIES).
+    raise_errors=True → ném lỗi thay vì trả về câu thông báo lỗi (dùng cho batch).
+    """
+    try:
+        temp_messages = _build_prompt(messages, user_input, memory_context)
+        with metrics.timed("azure_openai"):
+            response = await _acall_azure_openai(temp_messages, priority=priority)
+        _record_usage("chat", temp_messages, response)
+        return _extract_reply(response)
 
     except Exception as e:
         logger.exception(f"Lỗi khi gọi Azure OpenAI: {e}")
-        return "Đã xảy ra lỗi khi xử lý yêu cầu từ mô hình."
+        if raise_errors:
+            raise
+        return MODEL_ERROR_MESSAGE
+
+
+async def astream_summary(messages: list, user_input: str = None, memory_context: str = None):
+    """
+    Sinh phản hồi dạng stream: yield từng đoạn text ngay khi Azure trả về.
+    Giữ slot gọi Azure trong suốt thời gian stream.
+    """
+    temp_messages = _build_prompt(messages, user_input, memory_context)
+    _record_usage("chat", temp_messages)
+    logger.info("Mở stream đến Azure OpenAI...")
+    # Thời gian tới chunk đầu tiên (gồm xếp hàng + retry), phần sinh token nằm trong thời gian của request
+    start = time.perf_counter()
+    async for chunk in azure_client.astream_chat(temp_messages, **CHAT_COMPLETION_PARAMS):
+        if start is not None:
+            metrics.record_stage("azure_openai_stream_open", time.perf_counter() - start)
+            start = None
+        # Azure có thể gửi chunk không có choices (kết quả content filter)
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
+
+
+class CompletionTruncatedError(ValueError):
+    """Model dừng vì chạm max_tokens (finish_reason == "length"): gửi lại đúng prompt đó cũng bị cắt y hệt."""
+
+
+async def acomplete(prompt: list, usage_kind: str = "chat", priority: str = None, fail_on_truncation: bool = False,
+                    **params) -> str:
+    """
+    Gọi chat completion (có retry, xếp hàng theo độ ưu tiên của `usage_kind`) và trả về nội dung text.
+    Ném ValueError nếu model không trả về nội dung; fail_on_truncation=True → ném CompletionTruncatedError
+    khi câu trả lời bị cắt ở max_tokens. `params` ghi đè CHAT_COMPLETION_PARAMS.
+    """
+    with metrics.timed("azure_openai" if usage_kind == "chat" else f"azure_openai_{usage_kind}"):
+        response = await _acall_azure_openai(prompt, priority=priority or USAGE_PRIORITY[usage_kind], **params)
+    _record_usage(usage_kind, prompt, response)
+    if not response or not response.choices or not response.choices[0].message.content:
+        raise ValueError("Model không trả về nội dung")
+    if fail_on_truncation and getattr(response.choices[0], "finish_reason", None) == "length":
+        raise CompletionTruncatedError(f"Câu trả lời bị cắt ở max_tokens ({usage_kind})")
+    return response.choices[0].message.content.strip()
+
+
+# ============================================================
+# 📝 Tóm tắt cuốn chiếu lịch sử hội thoại
+# ============================================================
+SUMMARY_SYSTEM_PROMPT = (
+    "Bạn duy trì bản tóm tắt ngắn gọn của một cuộc trò chuyện. "
+    "Gộp các lượt hội thoại mới vào bản tóm tắt hiện có: giữ lại quyết định, số liệu, tên người, "
+    "thời hạn và việc cần làm; bỏ lời chào hỏi và nội dung lặp lại. "
+    "Chỉ trả về bản tóm tắt đã cập nhật, bằng ngôn ngữ của cuộc trò chuyện."
+)
+
+
+def _format_transcript(messages: list) -> str:
+    names = {"user": "User", "assistant": "Assistant"}
+    return "\n".join(f"{names.get(m['role'], m['role'])}: {m['content']}" for m in messages)
+
+
+async def asummarize_history(previous_summary: str, messages: list) -> str:
+    """
+    Gộp thêm các lượt cũ vào bản tóm tắt hiện có (cập nhật dần, không tóm tắt lại từ đầu):
+    chỉ gửi bản tóm tắt trước đó + các lượt vừa bị đẩy khỏi cửa sổ ngữ cảnh.
+    """
+    prompt = [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+        {"role": "user", "content": (
+            f"Bản tóm tắt hiện tại:\n{previous_summary or '(chưa có)'}\n\n"
+            f"Các lượt hội thoại cần gộp thêm:\n{_format_transcript(messages)}"
+        )},
+    ]
+    return await acomplete(prompt, usage_kind="summary", max_tokens=CONTEXT_SUMMARY_MAX_TOKENS, temperature=0)
+
+
+# ============================================================
+# 📊 Thống kê dịch vụ
+# ============================================================
+def _rerank_snapshot() -> dict:
+    with _rerank_lock:
+        return {"enabled": RERANK_ENABLED and registry.is_enabled("reranker"), "budget_ms": RERANK_BUDGET_MS,
+                **_rerank_stats}
+
+
+def get_service_stats() -> dict:
+    """Thống kê nội bộ của chat_service (dùng cho /api/stats)."""
+    return {
+        "models": registry.stats(),
+        "embedding_cache": embedding_cache.stats(),
+        "embed_batcher": embed_batcher.stats(),
+        "rerank_batcher": rerank_batcher.stats(),
+        "rerank": _rerank_snapshot(),
+        "token_usage": {kind: dict(counter) for kind, counter in token_usage.items()},
+        "azure": azure_client.azure_stats(),
+    }
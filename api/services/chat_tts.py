@@ -1,71 +1,235 @@
-# Step 1: Install required packages (run in terminal or notebook)
-# pip install transformers torch IPython
+# =========================
+# TTS libraries
+# =========================
+import asyncio
+import io
+import logging
+import os
+import re
 
-# Step 2: Import required libraries
-from transformers import VitsModel, AutoTokenizer
-import torch
+import numpy as np
 import soundfile as sf
-from IPython.display import Audio
 
-# Step 3: Clone and load the pre-trained TTS model from Hugging Face
-model = VitsModel.from_pretrained("facebook/mms-tts-vie")  # You may replace this with any compatible TTS model
-tokenizer = AutoTokenizer.from_pretrained("facebook/mms-tts-vie")
+from api.config.config import (
+    AUDIO_DIR,
+    AUDIO_GC_INTERVAL_S,
+    AUDIO_MAX_AGE_DAYS,
+    AUDIO_UNREFERENCED_GRACE_S,
+    TTS_AUDIO_FORMAT,
+    TTS_CACHE_MAX_BYTES,
+    TTS_CHUNK_MAX_CHARS,
+    TTS_STREAM_PREFETCH,
+)
+from api.services.audio_cache import AudioCache, AudioGarbageCollector, audio_cache_key
+from api.services.model_registry import registry
+from api.utils import metrics
+from api.utils.concurrency import run_in_stage
+from api.utils.conversation_logger import get_referenced_audio_files
+
+logger = logging.getLogger(__name__)
+
+TTS_MODEL_ID = "facebook/mms-tts-vie"  # có thể thay bằng model TTS tương thích khác
+# Sampling rate của TTS_MODEL_ID (config.sampling_rate) — dùng cho khoá cache mà không phải load model
+TTS_SAMPLING_RATE = 16000
+
+
+def _load_tts():
+    """Load model + tokenizer VITS (một lần, qua model registry)."""
+    from transformers import VitsModel, AutoTokenizer
+    model = VitsModel.from_pretrained(TTS_MODEL_ID)
+    if model.config.sampling_rate != TTS_SAMPLING_RATE:
+        logger.warning(f"TTS_SAMPLING_RATE={TTS_SAMPLING_RATE} khác sampling rate của {TTS_MODEL_ID} "
+                       f"({model.config.sampling_rate}) → cập nhật hằng số khi đổi model")
+    return model, AutoTokenizer.from_pretrained(TTS_MODEL_ID)
+
+
+# Model chỉ được load khi dùng lần đầu (hoặc warmup trong lifespan)
+registry.register("tts", _load_tts)
+
+TTS_OUTPUT_DIR = AUDIO_DIR
+AUDIO_URL_PREFIX = "/audio"  # main.py phục vụ AUDIO_DIR tại đây
+os.makedirs(TTS_OUTPUT_DIR, exist_ok=True)
+
+# Định dạng audio hỗ trợ: tên → (format soundfile, subtype, đuôi file, media type)
+AUDIO_FORMATS = {
+    "opus": ("OGG", "OPUS", "ogg", "audio/ogg"),
+    "mp3": ("MP3", "MPEG_LAYER_III", "mp3", "audio/mpeg"),
+    "wav": ("WAV", "PCM_16", "wav", "audio/wav"),
+}
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)  # Opus chỉ nhận các sampling rate này
+SENTENCE_PAUSE_S = 0.15  # khoảng lặng giữa các câu khi ghép audio cả câu trả lời
+
+# Cache audio theo nội dung: cùng văn bản + model + sampling rate + định dạng → dùng lại file cũ
+audio_cache = AudioCache(TTS_OUTPUT_DIR, max_bytes=TTS_CACHE_MAX_BYTES)
+
+# Dọn nền file audio không còn trong conversation_history / quá hạn / vượt quota
+audio_gc = AudioGarbageCollector(
+    audio_cache,
+    get_referenced_audio_files,
+    interval_s=AUDIO_GC_INTERVAL_S,
+    grace_s=AUDIO_UNREFERENCED_GRACE_S,
+    max_age_s=AUDIO_MAX_AGE_DAYS * 86400,
+)
+
+
+def resolve_audio_format(audio_format: str = None) -> str:
+    """Tên định dạng hợp lệ (None → TTS_AUDIO_FORMAT), ValueError nếu không hỗ trợ."""
+    audio_format = (audio_format or TTS_AUDIO_FORMAT).strip().lower()
+    if audio_format not in AUDIO_FORMATS:
+        raise ValueError(f"audio_format không hỗ trợ: {audio_format} (chọn: {', '.join(AUDIO_FORMATS)})")
+    return audio_format
+
+
+def audio_media_type(audio_format: str) -> str:
+    return AUDIO_FORMATS[audio_format][3]
+
 
-# Step 4: Function to generate audio from text
 def text_to_speech(text):
-    # Step 5: Tokenize the input text
-    inputs = tokenizer(text, return_tensors="pt")
-    
-    # Step 6: Perform inference to generate the waveform
+    """Sinh waveform từ văn bản. Trả về (waveform [1, n], sampling_rate)."""
+    import torch
+
+    tts_model, tts_tokenizer = registry.get("tts")
+    inputs = tts_tokenizer(text, return_tensors="pt")
     with torch.no_grad():
-        output = model(**inputs).waveform
-    
-    # Return the audio data and sampling rate
-    return output.numpy(), model.config.sampling_rate
+        output = tts_model(**inputs).waveform
+    return output.numpy(), tts_model.config.sampling_rate
 
 
 def save_audio_to_file(text, output_path):
-
-    # Generate audio
     waveform, sampling_rate = text_to_speech(text)
-    
-    # Save to file
     sf.write(output_path, waveform[0], sampling_rate)
-    
     return output_path
 
+
+def tts_cache_key(text: str, audio_format: str = "wav") -> str:
+    """Khoá cache không cần model → cache hit sau khi khởi động lại không load VITS."""
+    return audio_cache_key(text, TTS_MODEL_ID, TTS_SAMPLING_RATE, audio_format)
+
+
+def generate_tts_audio(session_id: str, text: str, audio_format: str = None) -> str:
+    """
+    Sinh file TTS (mặc định Ogg/Opus, xem TTS_AUDIO_FORMAT) và trả về URL dạng /audio/<file>.
+    Câu trả lời giống hệt nhau (vd: lấy lại từ memory) dùng chung 1 file, không chạy lại VITS.
+    Câu trả lời dài được synthesize theo từng câu rồi ghép lại (xem synthesize_text).
+    """
+    audio_format = resolve_audio_format(audio_format)
+
+    def produce():
+        logger.debug(f"Sinh TTS cho session {session_id} ({len(text)} ký tự)")
+        waveform, sampling_rate = synthesize_text(text)
+        return encode_audio(waveform, sampling_rate, audio_format)
+
+    with metrics.timed("tts"):
+        output_path = audio_cache.get_or_create(tts_cache_key(text, audio_format), produce,
+                                                AUDIO_FORMATS[audio_format][2])
+
+    return f"{AUDIO_URL_PREFIX}/{os.path.basename(output_path)}"
+
+
 # =========================
-# TTS libraries
+# TTS theo từng câu (stream)
 # =========================
-from transformers import VitsModel, AutoTokenizer
-import torch
-import soundfile as sf
-import os, uuid
+def split_sentences(text: str, max_chars: int = TTS_CHUNK_MAX_CHARS) -> list:
+    """
+    Tách văn bản thành các đoạn ngắn để synthesize lần lượt.
+    - Cắt theo dấu kết thúc câu và xuống dòng (gạch đầu dòng, đoạn văn).
+    - Câu quá dài được cắt tiếp theo dấu phẩy/chấm phẩy, cuối cùng theo khoảng trắng.
+    - Gộp các câu quá ngắn liền nhau để giảm số lần gọi model.
+    """
+    pieces = []
+    for sentence in re.split(r"(?<=[.!?…;:])\s+|\n+", text or ""):
+        sentence = sentence.strip(" \t-*•#")
+        if not sentence:
+            continue
+        while len(sentence) > max_chars:
+            cut = max(sentence.rfind(",", 0, max_chars), sentence.rfind(" ", 0, max_chars))
+            # Cắt ở dấu phẩy/khoảng trắng thì giữ dấu ở đoạn trước; không có thì cắt cứng đúng max_chars
+            cut = cut + 1 if cut > 0 else max_chars
+            pieces.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if sentence:
+            pieces.append(sentence)
+
+    chunks = []
+    for piece in pieces:
+        if chunks and len(chunks[-1]) + len(piece) + 1 <= max_chars // 2:
+            chunks[-1] = f"{chunks[-1]} {piece}"
+        else:
+            chunks.append(piece)
+    return chunks
 
-# Load TTS model (một lần khi khởi động server)
-tts_model = VitsModel.from_pretrained("facebook/mms-tts-vie")
-tts_tokenizer = AutoTokenizer.from_pretrained("facebook/mms-tts-vie")
-TTS_OUTPUT_DIR = "api/artifacts/audio"
-os.makedirs(TTS_OUTPUT_DIR, exist_ok=True)
 
-def generate_tts_audio(session_id: str, text: str) -> str:
+def synthesize_chunk(text: str):
+    """Synthesize 1 đoạn ngắn. Trả về (waveform float32 1 chiều, sampling_rate)."""
+    waveform, sampling_rate = text_to_speech(text)
+    return waveform[0], sampling_rate
+
+
+def synthesize_text(text: str, pause_s: float = SENTENCE_PAUSE_S):
     """
-    Sinh file TTS và trả về đường dẫn tuyệt đối để mở bằng file:///...
+    Synthesize cả đoạn văn theo từng câu (split_sentences) rồi ghép waveform, chèn khoảng lặng ngắn giữa các câu.
+    Mỗi lần chạy VITS chỉ trên 1 câu → bộ nhớ và độ trễ của model không tăng theo độ dài câu trả lời.
     """
-    print("Generating TTS audio...")
+    chunks = split_sentences(text) or [text]
+    parts, sampling_rate = [], None
+    for chunk in chunks:
+        waveform, sampling_rate = synthesize_chunk(chunk)
+        if parts and pause_s > 0:
+            parts.append(np.zeros(int(sampling_rate * pause_s), dtype=np.float32))
+        parts.append(np.asarray(waveform, dtype=np.float32))
+    return np.concatenate(parts), sampling_rate
 
-    # Tokenize và inference
-    inputs = tts_tokenizer(text, return_tensors="pt")
-    with torch.no_grad():
-        waveform = tts_model(**inputs).waveform
-    sampling_rate = tts_model.config.sampling_rate
 
-    # Tạo tên file an toàn
-    filename = f"{session_id}_{uuid.uuid4().hex}.wav"
-    output_path = os.path.join(TTS_OUTPUT_DIR, filename)
+def _resample(waveform, sampling_rate: int, target_rate: int):
+    """Đổi sampling rate bằng nội suy tuyến tính (đủ cho giọng nói, chỉ dùng khi codec không nhận rate gốc)."""
+    waveform = np.asarray(waveform, dtype=np.float32)
+    length = int(round(len(waveform) * target_rate / sampling_rate))
+    positions = np.linspace(0, len(waveform) - 1, num=length)
+    return np.interp(positions, np.arange(len(waveform)), waveform).astype(np.float32)
+
 
-    # Lưu file
-    sf.write(output_path, waveform[0].numpy(), sampling_rate)
+def encode_audio(waveform, sampling_rate: int, audio_format: str = "wav") -> bytes:
+    """Đóng gói waveform thành file audio (Ogg/Opus, MP3 hoặc WAV PCM 16-bit) trong bộ nhớ."""
+    sf_format, subtype, _, _ = AUDIO_FORMATS[audio_format]
+    if audio_format == "opus" and sampling_rate not in OPUS_SAMPLE_RATES:
+        target = min((r for r in OPUS_SAMPLE_RATES if r >= sampling_rate), default=OPUS_SAMPLE_RATES[-1])
+        waveform, sampling_rate = _resample(waveform, sampling_rate, target), target
+    buffer = io.BytesIO()
+    sf.write(buffer, waveform, sampling_rate, format=sf_format, subtype=subtype)
+    return buffer.getvalue()
 
-    # Trả về đường dẫn tuyệt đối cho file:///...
-    return os.path.abspath(output_path)
+
+def _synthesize_audio(text: str, audio_format: str = "wav") -> bytes:
+    """Synthesize 1 đoạn, dùng chung audio cache (các câu lặp lại không chạy lại VITS)."""
+    def produce():
+        waveform, sampling_rate = synthesize_chunk(text)
+        return encode_audio(waveform, sampling_rate, audio_format)
+
+    path = audio_cache.get_or_create(tts_cache_key(text, audio_format), produce, AUDIO_FORMATS[audio_format][2])
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def stream_tts_chunks(text: str, prefetch: int = TTS_STREAM_PREFETCH, audio_format: str = "wav"):
+    """
+    Async generator: yield (index, total, audio_bytes) theo đúng thứ tự câu (mỗi đoạn là 1 file hoàn chỉnh).
+    Tối đa `prefetch` đoạn được synthesize trước (trong stage "tts"),
+    nên bộ nhớ không phụ thuộc độ dài văn bản và đoạn đầu có ngay khi xong.
+    """
+    chunks = split_sentences(text)
+    total = len(chunks)
+    pending = {}
+    next_to_schedule = 0
+    try:
+        for index in range(total):
+            while next_to_schedule < total and len(pending) < max(prefetch, 1):
+                pending[next_to_schedule] = asyncio.create_task(
+                    run_in_stage("tts", _synthesize_audio, chunks[next_to_schedule], audio_format)
+                )
+                next_to_schedule += 1
+            audio_bytes = await pending.pop(index)
+            yield index, total, audio_bytes
+    finally:
+        # Client ngắt kết nối → huỷ các đoạn chưa cần
+        for task in pending.values():
+            task.cancel()
@@ -1,13 +1,28 @@
-from chromadb import Client
+# ============================================================
+# 📁 api/services/chroma_client.py
+# ============================================================
+import logging
+
+import chromadb
 from chromadb.config import Settings
 
-# ⚠️ Khởi tạo 1 lần duy nhất
-chroma_client = Client(Settings(
-    persist_directory="./chroma_db"
-))
+from api.config.config import CHROMA_COLLECTION, CHROMA_HOST, CHROMA_PERSIST_DIR, CHROMA_PORT
+
+logger = logging.getLogger(__name__)
+
+_settings = Settings(anonymized_telemetry=False)
+
+# ⚠️ Khởi tạo 1 lần duy nhất:
+#   - CHROMA_HOST      → Chroma server dùng chung (bắt buộc khi chạy nhiều worker/tiến trình)
+#   - CHROMA_PERSIST_DIR → lưu trên đĩa, giữ trí nhớ qua các lần khởi động lại (1 tiến trình)
+#   - CHROMA_PERSIST_DIR="" → chỉ trong RAM (test/benchmark)
+if CHROMA_HOST:
+    chroma_client = chromadb.HttpClient(host=CHROMA_HOST, port=CHROMA_PORT, settings=_settings)
+elif CHROMA_PERSIST_DIR:
+    chroma_client = chromadb.PersistentClient(path=CHROMA_PERSIST_DIR, settings=_settings)
+else:
+    chroma_client = chromadb.EphemeralClient(settings=_settings)
+
 
-def get_chroma_collection(name="chat_collection"):
-    try:
-        return chroma_client.get_collection(name=name)
-    except:
-        return chroma_client.create_collection(name=name)
+def get_chroma_collection(name=CHROMA_COLLECTION):
+    return chroma_client.get_or_create_collection(name=name)
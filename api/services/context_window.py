@@ -0,0 +1,195 @@
+# ============================================================
+# 📁 api/services/context_window.py
+# ============================================================
+"""
+Cửa sổ ngữ cảnh theo ngân sách token cho mỗi lượt chat.
+
+- Chỉ gửi các lượt gần nhất vừa với CONTEXT_HISTORY_TOKENS, kèm bản tóm tắt các phần trước.
+- Khi lịch sử chưa gộp vượt ngân sách, các lượt cũ nhất được gộp vào bản tóm tắt cuốn chiếu
+  (chạy nền sau khi trả lời) cho tới khi còn CONTEXT_FOLD_TARGET_TOKENS → không gộp ở mọi lượt.
+- Bản tóm tắt chỉ được cập nhật dần (tóm tắt cũ + lượt mới), không bao giờ tóm tắt lại từ đầu.
+- Lượt gần nhất luôn được gửi: lượt đó một mình đã vượt ngân sách (vd: dán cả biên bản) thì được cắt bớt
+  cho vừa, và được gộp nguyên văn vào bản tóm tắt ở lần gộp sau.
+"""
+
+import asyncio
+import logging
+import threading
+
+from api.config.config import (
+    CONTEXT_FOLD_CHUNK_TOKENS,
+    CONTEXT_FOLD_TARGET_TOKENS,
+    CONTEXT_HISTORY_TOKENS,
+)
+from api.services.chat_service import asummarize_history
+from api.services.session_store import session_store
+from api.utils.concurrency import run_in_stage
+from api.utils.tokens import (
+    MESSAGE_OVERHEAD_TOKENS,
+    count_message_tokens,
+    count_tokens,
+    message_tokens,
+    truncate_tokens,
+)
+
+logger = logging.getLogger(__name__)
+
+# Giới hạn số lần gộp trong 1 lần chạy nền (session dựng lại từ lịch sử dài sẽ gộp dần qua nhiều lượt)
+MAX_FOLDS_PER_RUN = 8
+
+_folding = set()         # session đang được gộp trong worker này
+_background = set()      # giữ tham chiếu tới task nền để không bị GC
+_stats_lock = threading.Lock()
+_stats = {"fold_runs": 0, "folds": 0, "folded_messages": 0, "failures": 0}
+
+
+def _last_turn_start(history: list) -> int:
+    return max((i for i, m in enumerate(history) if m["role"] == "user"), default=0)
+
+
+def _truncate_turn(turn: list, budget: int) -> list:
+    """Cắt nội dung các message của 1 lượt cho vừa ngân sách (message ngắn giữ nguyên, phần còn lại chia đều)."""
+    remaining = max(budget - MESSAGE_OVERHEAD_TOKENS * len(turn), len(turn))
+    limits = {}
+    order = sorted(range(len(turn)), key=lambda i: count_tokens(turn[i]["content"]))
+    for n, i in enumerate(order):
+        limits[i] = min(count_tokens(turn[i]["content"]), remaining // (len(turn) - n))
+        remaining -= limits[i]
+    return [{**m, "content": truncate_tokens(m["content"], limits[i])} for i, m in enumerate(turn)]
+
+
+def _select_window(history: list, budget: int) -> list:
+    """
+    Các message mới nhất vừa với ngân sách, bắt đầu từ 1 message user (không cắt giữa lượt).
+    Lượt cuối một mình đã vượt ngân sách → vẫn giữ, nội dung được cắt cho vừa.
+    """
+    window = []
+    used = 0
+    for message in reversed(history):
+        tokens = message_tokens(message)
+        if used + tokens > budget:
+            break
+        window.append(message)
+        used += tokens
+    window.reverse()
+    while window and window[0]["role"] != "user":
+        window.pop(0)
+    if not window and history:
+        window = _truncate_turn(history[_last_turn_start(history):], budget)
+    return window
+
+
+def build_messages(system_prompt: str, state: dict, user_input: str, budget: int = CONTEXT_HISTORY_TOKENS):
+    """
+    Dựng danh sách message gửi lên model: system + tóm tắt + các lượt gần nhất + câu hỏi hiện tại.
+    Trả về (messages, info) — info dùng để báo cáo số token gửi đi của lượt này.
+    """
+    summary = state.get("summary", "")
+    history = state["messages"]
+    window = _select_window(history, budget)
+
+    messages = [{"role": "system", "content": system_prompt}]
+    if summary:
+        messages.append({"role": "system", "content": f"Tóm tắt các phần trước của cuộc trò chuyện:\n{summary}"})
+    messages += window
+    messages.append({"role": "user", "content": user_input})
+
+    info = {
+        "prompt_tokens": count_message_tokens(messages),
+        "history_messages": len(window),
+        "omitted_messages": len(history) - len(window),
+        "truncated_messages": sum(1 for m in window if m not in history),
+        "folded_messages": state.get("folded_messages", 0),
+        "summary_tokens": count_tokens(summary),
+    }
+    return messages, info
+
+
+def plan_fold(history: list, budget: int = CONTEXT_HISTORY_TOKENS, target: int = CONTEXT_FOLD_TARGET_TOKENS,
+              chunk: int = CONTEXT_FOLD_CHUNK_TOKENS) -> int:
+    """
+    Số message đầu lịch sử cần gộp vào tóm tắt (0 nếu lịch sử còn vừa ngân sách).
+    Lượt cuối được giữ nguyên văn, trừ khi một mình nó đã vượt ngân sách (chỉ gửi được bản cắt bớt)
+    → gộp cả lượt đó để nội dung đầy đủ không bị mất.
+    """
+    tokens = [message_tokens(m) for m in history]
+    remaining = sum(tokens)
+    if remaining <= budget:
+        return 0
+
+    last_user = _last_turn_start(history)
+    limit = last_user if sum(tokens[last_user:]) <= budget else len(history)
+    count = 0
+    folded = 0
+    while count < limit and remaining > target:
+        if count and folded + tokens[count] > chunk:
+            break
+        folded += tokens[count]
+        remaining -= tokens[count]
+        count += 1
+    # Gộp trọn lượt: kéo thêm các message assistant phía sau
+    while count < len(history) and history[count]["role"] != "user":
+        count += 1
+    return count
+
+
+async def afold_history(session_id: str) -> int:
+    """Gộp các lượt cũ vượt ngân sách vào bản tóm tắt của session. Trả về số message đã gộp."""
+    if session_id in _folding:
+        return 0
+    _folding.add(session_id)
+    folded_total = 0
+    try:
+        for _ in range(MAX_FOLDS_PER_RUN):
+            state = await run_in_stage("db", session_store.get, session_id)
+            count = plan_fold(state["messages"])
+            if not count:
+                break
+
+            base = state.get("folded_messages", 0)
+            summary = await asummarize_history(state.get("summary", ""), state["messages"][:count])
+
+            def mutate(current):
+                # Worker khác đã gộp trước → bỏ kết quả này, lần sau tính lại từ trạng thái mới
+                if current.get("folded_messages", 0) != base:
+                    return None
+                return {
+                    **current,
+                    "summary": summary,
+                    "messages": current["messages"][count:],
+                    "folded_messages": base + count,
+                }
+
+            new_state = await run_in_stage("db", session_store.update, session_id, mutate)
+            if new_state.get("folded_messages") != base + count:
+                break
+            folded_total += count
+            with _stats_lock:
+                _stats["folds"] += 1
+                _stats["folded_messages"] += count
+    except Exception as e:
+        logger.exception(f"Lỗi khi gộp lịch sử session {session_id}: {e}")
+        with _stats_lock:
+            _stats["failures"] += 1
+    finally:
+        _folding.discard(session_id)
+        with _stats_lock:
+            _stats["fold_runs"] += 1
+    return folded_total
+
+
+def schedule_fold(session_id: str):
+    """Chạy afold_history ở nền (không chặn phản hồi của lượt hiện tại)."""
+    task = asyncio.create_task(afold_history(session_id))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+def context_stats() -> dict:
+    with _stats_lock:
+        return {
+            "history_budget_tokens": CONTEXT_HISTORY_TOKENS,
+            "fold_target_tokens": CONTEXT_FOLD_TARGET_TOKENS,
+            "pending_folds": len(_background),
+            **_stats,
+        }
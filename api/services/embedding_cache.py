@@ -0,0 +1,166 @@
+# ============================================================
+# 📁 api/services/embedding_cache.py
+# ============================================================
+"""
+Cache embedding 2 tầng đặt trước get_embedding:
+  - Tầng 1: LRU trong tiến trình (giới hạn số phần tử)
+  - Tầng 2: SQLite trên đĩa (vector float32), giữ lại qua các lần khởi động,
+    tối đa disk_max_items dòng (xoá dòng ghi cũ nhất trước, theo rowid)
+
+Khoá = sha256(tên model + văn bản đã chuẩn hoá) → embedding của model khác
+(OpenAI text-embedding-3-small vs MiniLM cục bộ) không bao giờ lẫn nhau.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from api.utils.text_normalize import normalize_text
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, max_items: int = 10000, db_path: str = None, disk_max_items: int = 0):
+        self.max_items = max_items
+        self.db_path = db_path
+        self.disk_max_items = disk_max_items
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()     # chỉ bảo vệ LRU + thống kê (hit trong RAM không chờ đĩa)
+        self._db_lock = threading.Lock()  # bảo vệ kết nối SQLite
+        self._conn = None
+        self.stats_counter = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "disk_pruned": 0}
+
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL
+            )
+            """)
+            self._conn.commit()
+            self._prune()
+
+    # ---------- Tầng 1: LRU ----------
+    def _lru_get(self, key: str):
+        vec = self._lru.get(key)
+        if vec is not None:
+            self._lru.move_to_end(key)
+        return vec
+
+    def _lru_put(self, key: str, vec: list):
+        self._lru[key] = vec
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_items:
+            self._lru.popitem(last=False)
+
+    # ---------- Tầng 2: SQLite (gọi khi đang giữ _db_lock, hoặc lúc khởi tạo) ----------
+    def _prune(self) -> int:
+        """
+        Giữ tối đa disk_max_items dòng mới nhất. INSERT OR REPLACE luôn cấp rowid mới (max + 1)
+        → rowid tăng theo thời điểm ghi, xoá theo khoảng rowid không phải quét bảng.
+        """
+        if self.disk_max_items <= 0:
+            return 0
+        (max_rowid,) = self._conn.execute("SELECT MAX(rowid) FROM embedding_cache").fetchone()
+        if max_rowid is None or max_rowid <= self.disk_max_items:
+            return 0
+        deleted = self._conn.execute(
+            "DELETE FROM embedding_cache WHERE rowid <= ?", (max_rowid - self.disk_max_items,)
+        ).rowcount
+        self._conn.commit()
+        return deleted
+
+    def _disk_get(self, keys: list) -> list:
+        with self._db_lock:
+            placeholders = ",".join("?" * len(keys))
+            return self._conn.execute(
+                f"SELECT key, vector FROM embedding_cache WHERE key IN ({placeholders})", keys
+            ).fetchall()
+
+    def _disk_put(self, model: str, items: list) -> int:
+        with self._db_lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache (key, model, vector) VALUES (?, ?, ?)",
+                [(key, model, np.asarray(vec, dtype=np.float32).tobytes()) for key, vec in items],
+            )
+            self._conn.commit()
+            return self._prune()
+
+    # ---------- API ----------
+    def get_many(self, model: str, texts: list) -> list:
+        """Trả về list cùng độ dài với texts, phần tử None nếu chưa có trong cache."""
+        keys = [cache_key(model, t) for t in texts]
+        results = [None] * len(texts)
+        disk_lookup = {}
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                vec = self._lru_get(key)
+                if vec is not None:
+                    results[i] = vec
+                    self.stats_counter["memory_hits"] += 1
+                else:
+                    disk_lookup.setdefault(key, []).append(i)
+
+        rows = []
+        if disk_lookup and self._conn is not None:
+            try:
+                rows = self._disk_get(list(disk_lookup))
+            except sqlite3.Error as e:
+                logger.warning(f"Không đọc được embedding cache trên đĩa: {e}")
+
+        with self._lock:
+            for key, blob in rows:
+                vec = np.frombuffer(blob, dtype=np.float32).tolist()
+                self._lru_put(key, vec)
+                for i in disk_lookup.pop(key):
+                    results[i] = vec
+                    self.stats_counter["disk_hits"] += 1
+            self.stats_counter["misses"] += sum(len(v) for v in disk_lookup.values())
+        return results
+
+    def get(self, model: str, text: str):
+        return self.get_many(model, [text])[0]
+
+    def put_many(self, model: str, texts: list, vectors: list):
+        items = [(cache_key(model, t), [float(x) for x in v]) for t, v in zip(texts, vectors)]
+        with self._lock:
+            for key, vec in items:
+                self._lru_put(key, vec)
+            self.stats_counter["writes"] += len(items)
+        if self._conn is not None:
+            try:
+                pruned = self._disk_put(model, items)
+            except sqlite3.Error as e:
+                logger.warning(f"Không ghi được embedding cache xuống đĩa: {e}")
+                return
+            if pruned:
+                with self._lock:
+                    self.stats_counter["disk_pruned"] += pruned
+
+    def put(self, model: str, text: str, vector: list):
+        self.put_many(model, [text], [vector])
+
+    def stats(self) -> dict:
+        with self._lock:
+            data = dict(self.stats_counter)
+            data["memory_items"] = len(self._lru)
+            data["max_items"] = self.max_items
+            data["disk_max_items"] = self.disk_max_items or None
+        lookups = data["memory_hits"] + data["disk_hits"] + data["misses"]
+        data["hit_ratio"] = (data["memory_hits"] + data["disk_hits"]) / lookups if lookups else 0.0
+        return data
@@ -0,0 +1,82 @@
+# ============================================================
+# 📁 api/services/hedging.py
+# ============================================================
+"""
+Chạy đua lời gọi LLM với bước tìm trí nhớ (hedged request).
+
+Chế độ thường: tìm trí nhớ xong mới gọi model → lượt không trùng trả cả 2 độ trễ nối tiếp.
+Chế độ hedged: gọi model ngay cùng lúc tìm trí nhớ; trí nhớ trùng → huỷ lời gọi model.
+Đổi lại, mỗi lượt trùng tốn 1 lời gọi model bị huỷ (wasted) → theo dõi qua hedge_stats() để tinh chỉnh.
+"""
+
+import asyncio
+import threading
+import time
+
+_lock = threading.Lock()
+_stats = {
+    "requests": 0,          # lượt chạy hedged
+    "memory_hits": 0,       # trí nhớ trùng → dùng lại câu trả lời
+    "wasted_calls": 0,      # lời gọi model đã bắt đầu nhưng bị huỷ
+    "saved_ms_total": 0.0,  # thời gian tiết kiệm được ở các lượt gọi model (phần chạy chồng lên nhau)
+    "baseline_requests": 0,  # lượt chạy tuần tự (để so sánh tỉ lệ trùng)
+    "baseline_memory_hits": 0,
+}
+
+
+def _record(**deltas):
+    with _lock:
+        for key, value in deltas.items():
+            _stats[key] += value
+
+
+def record_sequential(memory_hit: bool):
+    """Ghi nhận 1 lượt chạy tuần tự (không hedged)."""
+    _record(baseline_requests=1, baseline_memory_hits=int(memory_hit))
+
+
+async def hedged_reply(lookup, generate):
+    """
+    lookup(): coroutine → (memory_context, reply cũ hoặc None)
+    generate(): coroutine → reply mới từ model (gọi không kèm memory_context: khi trí nhớ không trùng,
+                search_memory trả về context rỗng nên prompt giống hệt chế độ tuần tự).
+    Trả về (memory_context, reply, used_model).
+    """
+    start = time.perf_counter()
+    llm_task = asyncio.create_task(generate())
+    try:
+        memory_context, reply = await lookup()
+    except BaseException:
+        llm_task.cancel()
+        raise
+    lookup_seconds = time.perf_counter() - start
+
+    if reply is not None:
+        llm_task.cancel()
+        # Lấy exception (nếu có) để asyncio không cảnh báo "exception was never retrieved"
+        llm_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        _record(requests=1, memory_hits=1, wasted_calls=1)
+        return memory_context, reply, False
+
+    reply = await llm_task
+    # Chế độ tuần tự sẽ mất lookup + llm; model đã chạy song song suốt thời gian lookup
+    _record(requests=1, saved_ms_total=lookup_seconds * 1000)
+    return memory_context, reply, True
+
+
+def hedge_stats() -> dict:
+    with _lock:
+        stats = dict(_stats)
+    requests = stats["requests"]
+    misses = requests - stats["memory_hits"]
+    return {
+        **stats,
+        "saved_ms_total": round(stats["saved_ms_total"], 1),
+        "hit_rate": round(stats["memory_hits"] / requests, 4) if requests else None,
+        "wasted_call_rate": round(stats["wasted_calls"] / requests, 4) if requests else None,
+        "avg_saved_ms_per_miss": round(stats["saved_ms_total"] / misses, 1) if misses else None,
+        "baseline_hit_rate": (
+            round(stats["baseline_memory_hits"] / stats["baseline_requests"], 4)
+            if stats["baseline_requests"] else None
+        ),
+    }
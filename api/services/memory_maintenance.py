@@ -0,0 +1,272 @@
+# ============================================================
+# 📁 api/services/memory_maintenance.py
+# ============================================================
+"""
+Bảo trì trí nhớ hội thoại trong Chroma (lưu trên đĩa, xem chroma_client.py).
+
+- warm_start(): mở collection và nạp sẵn index khi khởi động → request đầu không phải chờ đọc đĩa.
+- evict(): xoá lượt cũ hơn MEMORY_TTL_DAYS, giữ tối đa MEMORY_MAX_RECORDS lượt (cũ nhất bị xoá trước)
+  → kích thước index và độ trễ truy vấn không tăng mãi theo lịch sử.
+- purge_orphans(): xoá vector của session không còn trong SQLite (xoá session lỗi giữa chừng...).
+- export_memory() / import_memory(): sao lưu / nạp lại hàng loạt dạng JSON lines (kèm embedding).
+- rebuild(): chép bản ghi còn sống sang collection mới rồi thay thế → thu hồi chỗ của bản ghi đã xoá.
+  Chỉ chạy khi server đã dừng (_tools/Tool_chroma_memory.py); bị ngắt giữa chừng thì warm_start tự khôi phục.
+
+MemoryMaintenance chạy evict + purge_orphans định kỳ trong thread nền.
+"""
+
+import json
+import logging
+import threading
+import time
+
+from api.config.config import MEMORY_MAINTENANCE_INTERVAL_S, MEMORY_MAX_RECORDS, MEMORY_TTL_DAYS
+from api.services import chat_service
+from api.services.chroma_client import chroma_client
+from api.utils import metrics
+from api.utils.conversation_logger import get_all_sessions
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 1000
+ORPHAN_GRACE_S = 300  # lượt mới ghi Chroma có thể chưa kịp có trong SQLite → không dọn lượt quá mới
+REBUILD_SUFFIX = "__rebuild"
+
+evicted = metrics.counter(
+    "meeting_memory_evicted_total", "Số lượt bị xoá khỏi trí nhớ Chroma", ("reason",)
+)
+
+
+def iter_pages(collection, include: list, where: dict = None):
+    offset = 0
+    while True:
+        page = collection.get(include=include, where=where, limit=PAGE_SIZE, offset=offset)
+        if not page["ids"]:
+            return
+        yield page
+        offset += len(page["ids"])
+
+
+def _delete_ids(collection, ids: list, reason: str) -> int:
+    for start in range(0, len(ids), PAGE_SIZE):
+        collection.delete(ids=ids[start:start + PAGE_SIZE])
+    if ids:
+        evicted.inc(len(ids), reason=reason)
+        logger.info(f"Chroma: xoá {len(ids)} lượt ({reason})")
+    return len(ids)
+
+
+# ============================================================
+# 🔥 Warm start
+# ============================================================
+def _recover_rebuild():
+    """rebuild() bị ngắt giữa chừng: bản mới đã chép xong thì dùng bản mới, chưa xong thì bỏ."""
+    name = chat_service.collection.name
+    names = {c if isinstance(c, str) else c.name for c in chroma_client.list_collections()}
+    if name + REBUILD_SUFFIX not in names:
+        return
+    if chat_service.collection.count():
+        chroma_client.delete_collection(name + REBUILD_SUFFIX)
+        logger.warning(f"Chroma: bỏ bản rebuild dở dang của '{name}'")
+        return
+    chroma_client.delete_collection(name)
+    rebuilt = chroma_client.get_collection(name + REBUILD_SUFFIX)
+    rebuilt.modify(name=name)
+    chat_service.collection = rebuilt
+    logger.warning(f"Chroma: khôi phục '{name}' từ bản rebuild")
+
+
+def warm_start() -> int:
+    """Mở collection, chạy 1 truy vấn để nạp index vào RAM. Trả về số lượt đang lưu."""
+    start = time.perf_counter()
+    _recover_rebuild()
+    collection = chat_service.collection
+    count = collection.count()
+    if count:
+        sample = collection.get(include=["embeddings"], limit=1)["embeddings"]
+        collection.query(query_embeddings=[list(sample[0])], n_results=1, include=[])
+    logger.info(f"Chroma: {count} lượt trong '{collection.name}', warm start "
+                f"{(time.perf_counter() - start) * 1000:.0f} ms")
+    return count
+
+
+# ============================================================
+# 🧹 Eviction
+# ============================================================
+def evict(ttl_days: float = MEMORY_TTL_DAYS, max_records: int = MEMORY_MAX_RECORDS, now: float = None) -> dict:
+    """
+    Xoá lượt cũ hơn ttl_days (theo metadata created_at) rồi cắt bớt còn max_records lượt mới nhất.
+    Lượt không có created_at (ghi từ bản cũ) coi như cũ nhất khi cắt theo số lượng. 0 = không giới hạn.
+    """
+    collection = chat_service.collection
+    now = time.time() if now is None else now
+    result = {"ttl": 0, "size": 0}
+
+    if ttl_days > 0:
+        where = {"created_at": {"$lt": now - ttl_days * 86400}}
+        expired = [i for page in iter_pages(collection, [], where) for i in page["ids"]]
+        result["ttl"] = _delete_ids(collection, expired, "ttl")
+
+    if max_records > 0 and collection.count() > max_records:
+        dated = [((meta or {}).get("created_at", 0.0), doc_id)
+                 for page in iter_pages(collection, ["metadatas"])
+                 for doc_id, meta in zip(page["ids"], page["metadatas"])]
+        dated.sort()
+        result["size"] = _delete_ids(collection, [doc_id for _, doc_id in dated[:len(dated) - max_records]], "size")
+    return result
+
+
+def purge_orphans(grace_s: float = ORPHAN_GRACE_S) -> int:
+    """Xoá vector của các session không còn trong SQLite (bỏ qua lượt mới ghi trong grace_s giây)."""
+    collection = chat_service.collection
+    known = set(get_all_sessions())
+    cutoff = time.time() - grace_s
+    orphans, sessions = [], set()
+    for page in iter_pages(collection, ["metadatas"]):
+        for doc_id, meta in zip(page["ids"], page["metadatas"]):
+            meta = meta or {}
+            session_id = meta.get("session_id")
+            if session_id not in known and meta.get("created_at", 0.0) < cutoff:
+                orphans.append(doc_id)
+                sessions.add(session_id)
+    for session_id in sessions:
+        chat_service.discard_session(session_id)
+    return _delete_ids(collection, orphans, "orphan")
+
+
+# ============================================================
+# 📦 Import / export / rebuild
+# ============================================================
+def export_memory(path: str, session_id: str = None) -> int:
+    """Ghi trí nhớ (toàn bộ hoặc 1 session) ra file JSON lines: id, document, metadata, embedding."""
+    where = {"session_id": session_id} if session_id else None
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for page in iter_pages(chat_service.collection, ["documents", "metadatas", "embeddings"], where):
+            for doc_id, doc, meta, emb in zip(page["ids"], page["documents"], page["metadatas"], page["embeddings"]):
+                f.write(json.dumps({"id": doc_id, "document": doc, "metadata": meta,
+                                    "embedding": [float(x) for x in emb]}, ensure_ascii=False) + "\n")
+                count += 1
+    return count
+
+
+def _upsert(collection, rows: list):
+    missing = [r for r in rows if not r.get("embedding")]
+    if missing:  # file không kèm embedding → encode câu hỏi như lúc ghi
+        for row, emb in zip(missing, chat_service.get_embeddings([r["metadata"]["question"] for r in missing])):
+            row["embedding"] = emb
+    collection.upsert(
+        ids=[r["id"] for r in rows],
+        documents=[r["document"] for r in rows],
+        metadatas=[r["metadata"] for r in rows],
+        embeddings=[r["embedding"] for r in rows],
+    )
+
+
+def import_memory(path: str) -> int:
+    """Nạp file JSON lines (định dạng của export_memory) theo lô; ID đã có thì ghi đè."""
+    collection, rows, count = chat_service.collection, [], 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            rows.append(json.loads(line))
+            if len(rows) >= PAGE_SIZE:
+                _upsert(collection, rows)
+                count, rows = count + len(rows), []
+    if rows:
+        _upsert(collection, rows)
+        count += len(rows)
+    return count
+
+
+def rebuild() -> int:
+    """
+    Chép các bản ghi còn sống sang collection mới rồi thay cho collection cũ (thu hồi chỗ của bản ghi đã xoá).
+    Không an toàn khi server đang ghi vào collection → chỉ chạy lúc server dừng.
+    """
+    old = chat_service.collection
+    name, temp_name = old.name, old.name + REBUILD_SUFFIX
+    names = {c if isinstance(c, str) else c.name for c in chroma_client.list_collections()}
+    if temp_name in names:
+        chroma_client.delete_collection(temp_name)
+    new = chroma_client.create_collection(temp_name, metadata=old.metadata or None)
+    count = 0
+    for page in iter_pages(old, ["documents", "metadatas", "embeddings"]):
+        new.add(ids=page["ids"], documents=page["documents"], metadatas=page["metadatas"],
+                embeddings=page["embeddings"])
+        count += len(page["ids"])
+    chroma_client.delete_collection(name)
+    new.modify(name=name)
+    chat_service.collection = new
+    logger.info(f"Chroma: rebuild '{name}' xong ({count} lượt)")
+    return count
+
+
+# ============================================================
+# ⏱️ Bảo trì định kỳ
+# ============================================================
+class MemoryMaintenance:
+    def __init__(self, interval_s: float = MEMORY_MAINTENANCE_INTERVAL_S, ttl_days: float = MEMORY_TTL_DAYS,
+                 max_records: int = MEMORY_MAX_RECORDS):
+        self.interval_s, self.ttl_days, self.max_records = interval_s, ttl_days, max_records
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.last_run = None
+        self.stats_counter = {"runs": 0, "evicted_ttl": 0, "evicted_size": 0, "orphans": 0, "errors": 0,
+                              "warm_start_records": None}
+
+    def start(self):
+        """Warm start rồi chạy thread bảo trì (nếu interval_s > 0)."""
+        self.stats_counter["warm_start_records"] = warm_start()
+        if self.interval_s > 0 and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="memory-maintenance", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join(timeout=30)
+            self._thread = None
+
+    def run_once(self) -> dict:
+        with self._lock:
+            result = evict(self.ttl_days, self.max_records)
+            result["orphans"] = purge_orphans()
+            self.stats_counter["runs"] += 1
+            self.stats_counter["evicted_ttl"] += result["ttl"]
+            self.stats_counter["evicted_size"] += result["size"]
+            self.stats_counter["orphans"] += result["orphans"]
+            self.last_run = time.time()
+        return result
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.run_once()
+            except Exception as e:
+                self.stats_counter["errors"] += 1
+                logger.exception(f"Lỗi khi bảo trì trí nhớ Chroma: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "records": chat_service.collection.count(),
+            "interval_s": self.interval_s,
+            "ttl_days": self.ttl_days or None,
+            "max_records": self.max_records or None,
+            "last_run": self.last_run,
+            **self.stats_counter,
+        }
+
+
+memory_maintenance = MemoryMaintenance()
+
+
+def _collect_memory_records():
+    return [("meeting_memory_records", "gauge", "Số lượt đang lưu trong trí nhớ Chroma",
+             [({}, chat_service.collection.count())])]
+
+
+metrics.register_collector(_collect_memory_records)
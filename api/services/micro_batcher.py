@@ -0,0 +1,127 @@
+# ============================================================
+# 📁 api/services/micro_batcher.py
+# ============================================================
+"""
+Gom các lời gọi đồng thời thành 1 lô (micro-batching).
+
+Mỗi lời gọi đưa item vào hàng đợi; một thread nền chờ tối đa `max_wait_ms`
+hoặc tới khi đủ `max_batch_size` item rồi gọi `fn(items)` một lần duy nhất
+(ví dụ: local_embedder.encode(list) thay vì nhiều lần encode từng câu).
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    def __init__(self, fn, max_batch_size: int = 32, max_wait_ms: float = 5, name: str = "batcher"):
+        """
+        fn: hàm nhận list item, trả về list kết quả cùng thứ tự.
+        max_batch_size <= 1 → không gom lô, gọi fn trực tiếp.
+        """
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.name = name
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._largest_batch = 0
+        self._worker = None
+        if self.enabled:
+            self._worker = threading.Thread(target=self._run, name=f"{name}-worker", daemon=True)
+            self._worker.start()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_batch_size > 1
+
+    # ---------- API ----------
+    def submit(self, item) -> Future:
+        future = Future()
+        if not self.enabled:
+            try:
+                future.set_result(self._call([item])[0])
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        self._queue.put((item, future))
+        return future
+
+    def run(self, items: list) -> list:
+        """Gửi nhiều item và chờ kết quả (giữ nguyên thứ tự)."""
+        futures = [self.submit(item) for item in items]
+        return [f.result() for f in futures]
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "enabled": self.enabled,
+                "queue_depth": self._queue.qsize(),
+                "batches": self._batches,
+                "items": self._items,
+                "avg_batch_size": self._items / self._batches if self._batches else 0.0,
+                "largest_batch": self._largest_batch,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+            }
+
+    # ---------- Worker ----------
+    def _call(self, items: list) -> list:
+        results = list(self.fn(items))
+        if len(results) != len(items):
+            raise RuntimeError(f"{self.name}: fn trả về {len(results)} kết quả cho {len(items)} item")
+        with self._stats_lock:
+            self._batches += 1
+            self._items += len(items)
+            self._largest_batch = max(self._largest_batch, len(items))
+        return results
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        # Không exception nào được thoát khỏi vòng lặp: thread chết → mọi submit() về sau treo mãi
+        while True:
+            try:
+                self._process(self._collect())
+            except Exception as e:
+                logger.exception(f"{self.name}: lỗi ngoài dự kiến trong worker: {e}")
+
+    def _process(self, batch: list):
+        # Chuyển future sang RUNNING trước khi chạy: từ đây caller không cancel được nữa,
+        # future đã bị huỷ (vd: quá ngân sách thời gian) thì bỏ item khỏi lô
+        batch = [(item, f) for item, f in batch if f.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        futures = [f for _, f in batch]
+        try:
+            results = self._call([item for item, _ in batch])
+        except Exception as e:
+            logger.exception(f"{self.name}: lỗi khi xử lý lô {len(batch)} item: {e}")
+            for f in futures:
+                _settle(f.set_exception, e)
+            return
+        for f, result in zip(futures, results):
+            _settle(f.set_result, result)
+
+
+def _settle(setter, value):
+    try:
+        setter(value)
+    except InvalidStateError:  # future đã có kết quả → bỏ qua
+        pass
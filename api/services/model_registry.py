@@ -0,0 +1,112 @@
+# ============================================================
+# 📁 api/services/model_registry.py
+# ============================================================
+"""
+Registry tập trung cho các model nặng (embedder, reranker, TTS...).
+
+- Mỗi model chỉ được load 1 lần, khi dùng lần đầu hoặc khi warmup trong lifespan.
+- Có thể tắt model không cần (vd: worker không chạy TTS) qua DISABLED_MODELS.
+- Ghi lại thời gian load và lượng RAM (RSS) tăng thêm cho từng model.
+"""
+
+import logging
+import os
+import threading
+import time
+
+from api.config.config import DISABLED_MODELS
+from api.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ModelDisabledError(RuntimeError):
+    """Model đã bị tắt bằng cấu hình nên không thể dùng."""
+
+
+def _rss_bytes() -> int:
+    """RSS hiện tại của tiến trình (Linux: /proc/self/statm, nơi khác: peak RSS, Windows: 0)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        return 0
+
+
+class ModelRegistry:
+    def __init__(self, disabled=()):
+        self._loaders = {}
+        self._models = {}
+        self._locks = {}
+        self._stats = {}
+        self._disabled = set(disabled)
+
+    def register(self, name: str, loader):
+        """Đăng ký model: loader() -> model, chỉ được gọi khi cần."""
+        self._loaders[name] = loader
+        self._locks.setdefault(name, threading.Lock())
+        self._stats.setdefault(name, {"loaded": False, "load_seconds": None, "rss_delta_mb": None})
+
+    def is_enabled(self, name: str) -> bool:
+        return name in self._loaders and name not in self._disabled
+
+    def get(self, name: str):
+        """Lấy model (load lần đầu nếu chưa có). Thread-safe, không bao giờ load 2 lần."""
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        if name not in self._loaders:
+            raise KeyError(f"Model chưa được đăng ký: {name}")
+        if name in self._disabled:
+            raise ModelDisabledError(f"Model '{name}' đã bị tắt (DISABLED_MODELS)")
+
+        with self._locks[name]:
+            if name not in self._models:
+                logger.info(f"Đang load model '{name}'...")
+                rss_before = _rss_bytes()
+                start = time.perf_counter()
+                self._models[name] = self._loaders[name]()
+                elapsed = time.perf_counter() - start
+                self._stats[name] = {
+                    "loaded": True,
+                    "load_seconds": round(elapsed, 3),
+                    "rss_delta_mb": round((_rss_bytes() - rss_before) / 1024 / 1024, 1),
+                }
+                logger.info(f"Đã load model '{name}' trong {elapsed:.2f}s")
+        return self._models[name]
+
+    def warmup(self, names):
+        """Load trước các model (gọi trong lifespan). Bỏ qua model bị tắt hoặc chưa đăng ký."""
+        for name in names:
+            if self.is_enabled(name):
+                self.get(name)
+            else:
+                logger.info(f"Bỏ qua warmup model '{name}' (bị tắt hoặc chưa đăng ký)")
+
+    def stats(self) -> dict:
+        return {
+            name: {"enabled": name not in self._disabled, **self._stats[name]}
+            for name in self._loaders
+        }
+
+
+# Registry dùng chung cho toàn bộ ứng dụng
+registry = ModelRegistry(disabled=DISABLED_MODELS)
+
+
+def _collect_model_gauges():
+    loaded = {name: s for name, s in registry.stats().items() if s["loaded"]}
+    return [
+        ("meeting_model_load_seconds", "gauge", "Thời gian load model (giây)",
+         [({"model": name}, s["load_seconds"]) for name, s in loaded.items()]),
+        ("meeting_model_rss_delta_megabytes", "gauge", "RAM (RSS) tăng thêm khi load model (MB)",
+         [({"model": name}, s["rss_delta_mb"]) for name, s in loaded.items()]),
+    ]
+
+
+metrics.register_collector(_collect_model_gauges)
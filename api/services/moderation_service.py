@@ -1,22 +1,13 @@
 # ============================================================
 # 📘 api/services/moderation_service.py
 # ============================================================
-from openai import AzureOpenAI
-from api.config.config import (
-    AZURE_OPENAI_API_KEY,
-    AZURE_OPENAI_API_VERSION,
-    AZURE_OPENAI_ENDPOINT,
-)
+from api.services.azure_client import sync_client
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Tạo client kiểm duyệt riêng
-moderation_client = AzureOpenAI(
-    api_key=AZURE_OPENAI_API_KEY,
-    api_version=AZURE_OPENAI_API_VERSION,
-    azure_endpoint=AZURE_OPENAI_ENDPOINT,
-)
+# Dùng chung client (và pool kết nối) của azure_client thay vì tạo client kiểm duyệt riêng
+moderation_client = sync_client
 
 def moderate_input(text: str) -> bool:
     return ""
@@ -0,0 +1,69 @@
+# ============================================================
+# 📁 api/services/onnx_embedder.py
+# ============================================================
+"""
+Backend embedding chạy bằng ONNX Runtime (model MiniLM đã lượng tử hoá int8) cho máy chỉ có CPU.
+
+Cho ra vector cùng không gian với SentenceTransformer (mean pooling + chuẩn hoá L2 như
+multi-qa-MiniLM-L6-cos-v1) nên dùng chung được collection Chroma đã lưu bằng bản PyTorch fp32.
+Thư mục model do _tools/Tool_export_onnx_embedder.py tạo: model_int8.onnx + tokenizer.
+"""
+
+import os
+
+import numpy as np
+
+from api.config.config import ONNX_NUM_THREADS
+
+ONNX_MODEL_FILE = "model_int8.onnx"
+MAX_SEQ_LENGTH = 512
+
+
+class OnnxEmbedder:
+    def __init__(self, model_dir: str, num_threads: int = ONNX_NUM_THREADS):
+        try:
+            import onnxruntime as ort
+            from transformers import AutoTokenizer
+        except ImportError as e:
+            raise ImportError("EMBEDDER_BACKEND=onnx-int8 cần cài onnxruntime và transformers") from e
+
+        model_path = os.path.join(model_dir, ONNX_MODEL_FILE)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(
+                f"Không thấy {model_path} — chạy: python _tools/Tool_export_onnx_embedder.py --out {model_dir}"
+            )
+
+        options = ort.SessionOptions()
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return int(self.session.get_outputs()[0].shape[-1])
+
+    def _encode_batch(self, texts: list) -> np.ndarray:
+        tokens = self.tokenizer(texts, padding=True, truncation=True, max_length=MAX_SEQ_LENGTH, return_tensors="np")
+        feeds = {name: tokens[name].astype(np.int64) for name in self.input_names if name in tokens}
+        hidden = self.session.run(None, feeds)[0]
+
+        # Mean pooling theo attention mask rồi chuẩn hoá L2 (giống pipeline của SentenceTransformer)
+        mask = tokens["attention_mask"][..., None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+    def encode(self, texts, batch_size: int = 32, convert_to_numpy: bool = True, **_):
+        """Cùng giao diện với SentenceTransformer.encode (str → 1 vector, list → ma trận)."""
+        single = isinstance(texts, str)
+        texts = [texts] if single else list(texts)
+        if not texts:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        # Sắp theo độ dài để giảm padding trong mỗi lô, sau đó trả về đúng thứ tự ban đầu
+        order = np.argsort([-len(t) for t in texts])
+        out = np.empty((len(texts), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            idx = order[start:start + batch_size]
+            out[idx] = self._encode_batch([texts[i] for i in idx])
+        return out[0] if single else out
@@ -0,0 +1,257 @@
+# ============================================================
+# 📁 api/services/session_store.py
+# ============================================================
+"""
+Trạng thái hội thoại (ngữ cảnh gửi lên model) dùng chung giữa các worker uvicorn.
+
+- Mỗi worker giữ 1 LRU giới hạn số session (SESSION_CACHE_SIZE).
+- Nguồn sự thật là backend dùng chung (SESSION_BACKEND):
+    "sqlite" → bảng session_state trong file SQLite dùng chung (mặc định, chạy được --workers N)
+    "memory" → dict trong tiến trình (1 worker / test)
+  Backend khác (Redis...) chỉ cần cài load / version / compare_and_set / delete.
+- Session chưa có trong backend (vd: tạo trước khi có store) được dựng lại từ conversation_history.
+- Mỗi lần ghi tăng `version`; ghi theo kiểu compare-and-set nên 2 worker ghi cùng session
+  không làm mất lượt của nhau.
+"""
+
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+from api.config.config import SESSION_BACKEND, SESSION_CACHE_SIZE, SESSION_STORE_PATH
+from api.utils import metrics
+from api.utils.conversation_logger import ConnectionPool, get_session_messages
+
+logger = logging.getLogger(__name__)
+
+# Số lần thử lại khi ghi bị worker khác chen vào (version đã đổi)
+MAX_WRITE_RETRIES = 5
+
+
+class MemorySessionBackend:
+    """Backend trong tiến trình, giới hạn số session (session bị đẩy ra sẽ dựng lại từ lịch sử)."""
+
+    def __init__(self, max_items: int = SESSION_CACHE_SIZE):
+        self.max_items = max(max_items, 1)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, session_id: str):
+        """Trả về (state, version) hoặc None nếu chưa có."""
+        with self._lock:
+            entry = self._data.get(session_id)
+            if entry is None:
+                return None
+            self._data.move_to_end(session_id)
+            state, version = entry
+            return json.loads(state), version
+
+    def version(self, session_id: str):
+        with self._lock:
+            entry = self._data.get(session_id)
+            return entry[1] if entry else None
+
+    def compare_and_set(self, session_id: str, state: dict, expected_version, new_version: int) -> bool:
+        with self._lock:
+            entry = self._data.get(session_id)
+            if (entry[1] if entry else None) != expected_version:
+                return False
+            self._data[session_id] = (json.dumps(state, ensure_ascii=False), new_version)
+            self._data.move_to_end(session_id)
+            while len(self._data) > self.max_items:
+                self._data.popitem(last=False)
+            return True
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._data.pop(session_id, None)
+
+    def close(self):
+        pass
+
+
+class SQLiteSessionBackend:
+    """Backend dùng chung giữa các tiến trình trên cùng máy: bảng session_state (WAL)."""
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS session_state (
+            session_id TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+
+    def __init__(self, db_path: str = SESSION_STORE_PATH):
+        self.db_path = db_path
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ConnectionPool:
+        with self._lock:
+            if self._pool is None:
+                pool = ConnectionPool(self.db_path)
+                with pool.connection() as conn:
+                    conn.execute(self._SCHEMA)
+                    conn.commit()
+                self._pool = pool
+            return self._pool
+
+    def load(self, session_id: str):
+        with self._get_pool().connection() as conn:
+            row = conn.execute(
+                "SELECT state, version FROM session_state WHERE session_id=?", (session_id,)
+            ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def version(self, session_id: str):
+        with self._get_pool().connection() as conn:
+            row = conn.execute("SELECT version FROM session_state WHERE session_id=?", (session_id,)).fetchone()
+        return row[0] if row else None
+
+    def compare_and_set(self, session_id: str, state: dict, expected_version, new_version: int) -> bool:
+        payload = json.dumps(state, ensure_ascii=False)
+        with self._get_pool().connection() as conn:
+            if expected_version is None:
+                cur = conn.execute(
+                    "INSERT OR IGNORE INTO session_state (session_id, state, version) VALUES (?, ?, ?)",
+                    (session_id, payload, new_version),
+                )
+            else:
+                cur = conn.execute(
+                    """
+                    UPDATE session_state SET state=?, version=?, updated_at=CURRENT_TIMESTAMP
+                    WHERE session_id=? AND version=?
+                    """,
+                    (payload, new_version, session_id, expected_version),
+                )
+            conn.commit()
+        return cur.rowcount == 1
+
+    def delete(self, session_id: str):
+        with self._get_pool().connection() as conn:
+            conn.execute("DELETE FROM session_state WHERE session_id=?", (session_id,))
+            conn.commit()
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool = None
+
+
+SESSION_BACKENDS = {
+    "memory": MemorySessionBackend,
+    "sqlite": SQLiteSessionBackend,
+}
+
+
+def load_state_from_history(session_id: str) -> dict:
+    """Dựng lại ngữ cảnh từ conversation_history (khi backend chưa có session)."""
+    messages = [
+        {"role": m["role"], "content": m["content"]}
+        for m in get_session_messages(session_id)
+        if m["role"] in ("user", "assistant")
+    ]
+    return {
+        "messages": messages,
+        "turns": sum(1 for m in messages if m["role"] == "assistant"),
+        "summary": "",
+        "folded_messages": 0,
+    }
+
+
+class SessionStore:
+    def __init__(self, backend, max_items: int = SESSION_CACHE_SIZE, loader=load_state_from_history):
+        self.backend = backend
+        self.max_items = max(max_items, 1)
+        self.loader = loader
+        self._lru = OrderedDict()   # session_id -> (state, version)
+        self._lock = threading.Lock()
+        self.stats_counter = {"hits": 0, "backend_loads": 0, "rehydrations": 0, "writes": 0, "conflicts": 0}
+
+    def _remember(self, session_id: str, state: dict, version):
+        with self._lock:
+            self._lru[session_id] = (state, version)
+            self._lru.move_to_end(session_id)
+            while len(self._lru) > self.max_items:
+                self._lru.popitem(last=False)
+
+    def _load(self, session_id: str):
+        """(state, version) mới nhất: LRU nếu còn khớp version của backend, nếu không thì đọc lại."""
+        version = self.backend.version(session_id)
+        with self._lock:
+            cached = self._lru.get(session_id)
+            if cached is not None and cached[1] == version:
+                self._lru.move_to_end(session_id)
+                self.stats_counter["hits"] += 1
+                return cached
+
+        loaded = self.backend.load(session_id) if version is not None else None
+        if loaded is not None:
+            self.stats_counter["backend_loads"] += 1
+            state, version = loaded
+        else:
+            self.stats_counter["rehydrations"] += 1
+            state, version = self.loader(session_id), None
+        self._remember(session_id, state, version)
+        return state, version
+
+    def get(self, session_id: str) -> dict:
+        """
+        Trạng thái hiện tại của session (không sửa trực tiếp):
+        {"messages": [...lượt chưa gộp], "turns": n, "summary": "...", "folded_messages": k}
+        """
+        return self._load(session_id)[0]
+
+    def update(self, session_id: str, mutate) -> dict:
+        """
+        Ghi trạng thái mới = mutate(state hiện tại) theo kiểu compare-and-set.
+        mutate có thể được gọi lại nếu worker khác chen vào; trả về None để bỏ qua việc ghi.
+        Trả về trạng thái sau cùng.
+        """
+        for _ in range(MAX_WRITE_RETRIES):
+            state, version = self._load(session_id)
+            new_state = mutate(state)
+            if new_state is None:
+                return state
+            new_version = (version or 0) + 1
+            with metrics.timed("session_store_write"):
+                written = self.backend.compare_and_set(session_id, new_state, version, new_version)
+            if written:
+                self.stats_counter["writes"] += 1
+                self._remember(session_id, new_state, new_version)
+                return new_state
+            # Worker khác vừa ghi session này → đọc lại rồi thử tiếp
+            self.stats_counter["conflicts"] += 1
+        raise RuntimeError(f"Không ghi được trạng thái session {session_id} sau {MAX_WRITE_RETRIES} lần thử")
+
+    def append_turn(self, session_id: str, messages: list) -> dict:
+        """Thêm 1 lượt (các message user/assistant) vào session. Trả về trạng thái mới."""
+        return self.update(session_id, lambda state: {
+            **state, "messages": state["messages"] + messages, "turns": state["turns"] + 1,
+        })
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._lru.pop(session_id, None)
+        self.backend.delete(session_id)
+
+    def close(self):
+        self.backend.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._lru)
+        return {"backend": type(self.backend).__name__, "cached_sessions": size, **self.stats_counter}
+
+
+def _make_backend():
+    if SESSION_BACKEND not in SESSION_BACKENDS:
+        raise ValueError(f"SESSION_BACKEND không hợp lệ: {SESSION_BACKEND} (chọn: {', '.join(SESSION_BACKENDS)})")
+    return SESSION_BACKENDS[SESSION_BACKEND]()
+
+
+# Store dùng chung cho toàn bộ ứng dụng
+session_store = SessionStore(_make_backend())
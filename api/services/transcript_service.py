@@ -0,0 +1,310 @@
+# ============================================================
+# 📁 api/services/transcript_service.py
+# ============================================================
+"""
+Tóm tắt biên bản họp dài theo kiểu map-reduce → MeetingSummarySchema.
+
+1. Chia biên bản thành các đoạn ≤ TRANSCRIPT_CHUNK_TOKENS, cắt theo ranh giới lượt nói (người nói).
+2. Map: tóm tắt song song từng đoạn (tối đa TRANSCRIPT_CONCURRENCY đoạn cùng lúc).
+3. Reduce: gộp các bản tóm tắt theo từng nhóm TRANSCRIPT_REDUCE_FANOUT, lặp theo tầng tới khi còn 1.
+Câu trả lời bị cắt ở TRANSCRIPT_MAX_OUTPUT_TOKENS (finish_reason == "length") → không gửi lại y nguyên
+mà chia đôi đầu vào (đoạn biên bản / nhóm cần gộp) rồi xử lý từng nửa.
+
+Thời gian chạy ~ (số đoạn / concurrency) + số tầng reduce, thay vì tăng tuyến tính theo độ dài biên bản.
+"""
+
+import asyncio
+import datetime
+import json
+import logging
+import os
+import re
+import time
+
+from api.config.config import (
+    MEETING_SUMMARY_TEMPLATE_PATH,
+    TRANSCRIPT_CHUNK_TOKENS,
+    TRANSCRIPT_CONCURRENCY,
+    TRANSCRIPT_MAX_OUTPUT_TOKENS,
+    TRANSCRIPT_REDUCE_FANOUT,
+    TRANSCRIPT_TIMEOUT_S,
+)
+from api.services.chat_service import CompletionTruncatedError, acomplete
+from api.utils.schema import MeetingSummarySchema
+from api.utils.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# "Nam: ...", "[00:12:05] Lan: ...", "00:12 - Anh Minh (PM): ..."
+SPEAKER_RE = re.compile(
+    r"^\s*(?:\[?\d{1,2}:\d{2}(?::\d{2})?\]?\s*[-–]?\s*)?([^\W\d_][\w .'()-]{0,39}?)\s*:\s+\S"
+)
+
+# Số lần thử lại khi model trả về JSON sai schema
+MAX_PARSE_ATTEMPTS = 2
+
+_SCHEMA_JSON = json.dumps(MeetingSummarySchema.model_json_schema()["properties"], ensure_ascii=False)
+
+MAP_SYSTEM_PROMPT = (
+    "Bạn là trợ lý tóm tắt cuộc họp. Bạn nhận 1 phần của biên bản họp. "
+    "Chỉ dựa trên phần này, trả về 1 object JSON với đúng các trường sau:\n"
+    f"{_SCHEMA_JSON}\n"
+    "Trường không có thông tin thì để null (hoặc [] với danh sách). "
+    "Viết bằng ngôn ngữ của biên bản."
+)
+
+REDUCE_SYSTEM_PROMPT = (
+    "Bạn là trợ lý tóm tắt cuộc họp. Bạn nhận danh sách JSON các bản tóm tắt của những phần liên tiếp "
+    "trong cùng 1 cuộc họp (theo thứ tự thời gian). Gộp chúng thành 1 bản tóm tắt duy nhất, "
+    "trả về 1 object JSON với đúng các trường sau:\n"
+    f"{_SCHEMA_JSON}\n"
+    "Loại bỏ trùng lặp, giữ đủ quyết định, vướng mắc (blockers) và việc cần làm (next_action). "
+    "Viết bằng ngôn ngữ của các bản tóm tắt."
+)
+
+
+# ============================================================
+# ✂️ Chia đoạn
+# ============================================================
+def detect_speakers(transcript: str) -> list:
+    """Danh sách người nói (theo thứ tự xuất hiện) nhận diện từ tiền tố "Tên:" đầu dòng."""
+    speakers = []
+    for line in transcript.splitlines():
+        match = SPEAKER_RE.match(line)
+        if match and match.group(1).strip() not in speakers:
+            speakers.append(match.group(1).strip())
+    return speakers
+
+
+def _split_turns(transcript: str) -> list:
+    """Gom các dòng thành lượt nói: dòng có "Tên:" mở lượt mới, dòng khác nối vào lượt trước."""
+    turns = []
+    for line in transcript.splitlines():
+        if not line.strip():
+            continue
+        if SPEAKER_RE.match(line) or not turns:
+            turns.append(line.strip())
+        else:
+            turns[-1] += "\n" + line.strip()
+    return turns
+
+
+def _split_long_turn(turn: str, max_tokens: int) -> list:
+    """Lượt nói dài hơn 1 đoạn → cắt theo câu, câu vẫn quá dài thì cắt theo số ký tự."""
+    pieces = []
+    current = ""
+    for sentence in re.split(r"(?<=[.!?…])\s+", turn):
+        while count_tokens(sentence) > max_tokens:
+            cut = max_tokens * 4
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:]
+        if current and count_tokens(current) + count_tokens(sentence) > max_tokens:
+            pieces.append(current)
+            current = ""
+        current = f"{current} {sentence}".strip()
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def chunk_transcript(transcript: str, max_tokens: int = TRANSCRIPT_CHUNK_TOKENS) -> list:
+    """Chia biên bản thành các đoạn ≤ max_tokens, không cắt giữa lượt nói (trừ lượt quá dài)."""
+    chunks = []
+    current = []
+    current_tokens = 0
+    for turn in _split_turns(transcript):
+        tokens = count_tokens(turn)
+        parts = [turn] if tokens <= max_tokens else _split_long_turn(turn, max_tokens)
+        for part in parts:
+            part_tokens = tokens if len(parts) == 1 else count_tokens(part)
+            if current and current_tokens + part_tokens > max_tokens:
+                chunks.append("\n".join(current))
+                current, current_tokens = [], 0
+            current.append(part)
+            current_tokens += part_tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+# ============================================================
+# 🧠 Map / Reduce
+# ============================================================
+def _parse_summary(text: str) -> MeetingSummarySchema:
+    # Bỏ khối ```json ... ``` nếu model vẫn bọc kết quả
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text.strip())
+    return MeetingSummarySchema.model_validate_json(text)
+
+
+async def _complete_summary(prompt: list, semaphore: asyncio.Semaphore) -> MeetingSummarySchema:
+    """1 lần tóm tắt (thử lại khi JSON sai schema). Bị cắt ở max_tokens → CompletionTruncatedError, không thử lại."""
+    for attempt in range(1, MAX_PARSE_ATTEMPTS + 1):
+        async with semaphore:
+            text = await acomplete(prompt, usage_kind="transcript", fail_on_truncation=True, temperature=0,
+                                   max_tokens=TRANSCRIPT_MAX_OUTPUT_TOKENS, timeout=TRANSCRIPT_TIMEOUT_S,
+                                   response_format={"type": "json_object"})
+        try:
+            return _parse_summary(text)
+        except ValueError as e:  # pydantic ValidationError cũng là ValueError
+            if attempt == MAX_PARSE_ATTEMPTS:
+                raise
+            logger.warning(f"Model trả về JSON không hợp lệ, thử lại ({attempt}/{MAX_PARSE_ATTEMPTS}): {e}")
+
+
+def _map_prompt(chunk: str, index: int, total: int) -> list:
+    return [
+        {"role": "system", "content": MAP_SYSTEM_PROMPT},
+        {"role": "user", "content": f"Phần {index + 1}/{total} của biên bản:\n{chunk}"},
+    ]
+
+
+def _reduce_prompt(parts: list, meeting_title: str = None, speakers: list = None) -> list:
+    hints = []
+    if meeting_title:
+        hints.append(f"Tiêu đề cuộc họp: {meeting_title}")
+    if speakers:
+        hints.append(f"Người nói nhận diện từ biên bản: {', '.join(speakers)}")
+    payload = json.dumps([p.model_dump() for p in parts], ensure_ascii=False)
+    return [
+        {"role": "system", "content": REDUCE_SYSTEM_PROMPT},
+        {"role": "user", "content": "\n".join(hints + [f"Các bản tóm tắt từng phần:\n{payload}"])},
+    ]
+
+
+def _notify(on_progress, event: dict):
+    if on_progress is not None:
+        on_progress(event)
+
+
+async def _map_chunk(chunk: str, index: int, total: int, semaphore: asyncio.Semaphore,
+                     max_tokens: int = TRANSCRIPT_CHUNK_TOKENS) -> list:
+    """Tóm tắt 1 đoạn. Trả về list bản tóm tắt (nhiều bản nếu phải chia nhỏ đoạn vì bị cắt)."""
+    try:
+        return [await _complete_summary(_map_prompt(chunk, index, total), semaphore)]
+    except CompletionTruncatedError:
+        pieces = chunk_transcript(chunk, max(max_tokens // 2, 1))
+        if len(pieces) < 2:
+            raise
+        logger.warning(f"Tóm tắt phần {index + 1}/{total} bị cắt, chia thành {len(pieces)} đoạn nhỏ hơn")
+        results = await asyncio.gather(*(_map_chunk(p, index, total, semaphore, max_tokens // 2) for p in pieces))
+        return [summary for part in results for summary in part]
+
+
+async def _reduce_group(group: list, meeting_title: str, speakers: list, semaphore: asyncio.Semaphore) -> list:
+    """
+    Gộp 1 nhóm bản tóm tắt. Bị cắt → chia đôi nhóm, gộp từng nửa và trả về các bản đã gộp được
+    (tầng reduce sau gộp tiếp). Nhóm 1 phần tử trả về nguyên trạng.
+    """
+    if len(group) == 1:
+        return group
+    try:
+        return [await _complete_summary(_reduce_prompt(group, meeting_title, speakers), semaphore)]
+    except CompletionTruncatedError:
+        mid = len(group) // 2
+        logger.warning(f"Gộp {len(group)} bản tóm tắt bị cắt, chia đôi nhóm")
+        halves = await asyncio.gather(*(_reduce_group(half, meeting_title, speakers, semaphore)
+                                        for half in (group[:mid], group[mid:])))
+        return halves[0] + halves[1]
+
+
+async def _run_all(coros: list, on_done) -> list:
+    """Chạy song song các bước map/reduce, giữ nguyên thứ tự và nối các list kết quả. Lỗi → huỷ phần còn lại."""
+    async def run(coro):
+        result = await coro
+        on_done()
+        return result
+
+    tasks = [asyncio.create_task(run(c)) for c in coros]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    return [summary for part in results for summary in part]
+
+
+async def summarize_transcript(transcript: str, meeting_title: str = None, on_progress=None) -> dict:
+    """
+    Tóm tắt biên bản họp. on_progress(event) được gọi sau mỗi bước:
+      {"stage": "chunked", "chunks": n, "speakers": [...]}
+      {"stage": "map", "done": k, "total": n}
+      {"stage": "reduce", "level": l, "done": k, "total": m}
+    Trả về {"summary": MeetingSummarySchema, "chunks": n, "levels": l, "seconds": t}.
+    """
+    start = time.perf_counter()
+    chunks = chunk_transcript(transcript)
+    if not chunks:
+        raise ValueError("Biên bản trống")
+    speakers = detect_speakers(transcript)
+    _notify(on_progress, {"stage": "chunked", "chunks": len(chunks), "speakers": speakers})
+
+    semaphore = asyncio.Semaphore(max(TRANSCRIPT_CONCURRENCY, 1))
+    fanout = max(TRANSCRIPT_REDUCE_FANOUT, 2)
+
+    def progress(stage: str, total: int, **extra):
+        done = 0
+
+        def on_done():
+            nonlocal done
+            done += 1
+            _notify(on_progress, {"stage": stage, **extra, "done": done, "total": total})
+        return on_done
+
+    partials = await _run_all(
+        [_map_chunk(chunk, i, len(chunks), semaphore) for i, chunk in enumerate(chunks)],
+        progress("map", len(chunks)),
+    )
+
+    level = 0
+    while len(partials) > 1:
+        level += 1
+        groups = [partials[i:i + fanout] for i in range(0, len(partials), fanout)]
+        reduced = await _run_all(
+            [_reduce_group(group, meeting_title, speakers, semaphore) for group in groups],
+            progress("reduce", len(groups), level=level),
+        )
+        if len(reduced) >= len(partials):  # kể cả 2 bản cũng không gộp được trong max_tokens
+            raise CompletionTruncatedError(
+                f"Không gộp được {len(partials)} bản tóm tắt trong {TRANSCRIPT_MAX_OUTPUT_TOKENS} token, "
+                "hãy tăng TRANSCRIPT_MAX_OUTPUT_TOKENS"
+            )
+        partials = reduced
+
+    summary = partials[0]
+    if meeting_title:
+        summary.meeting_title = meeting_title
+    if not summary.participants:
+        summary.participants = speakers
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"Tóm tắt biên bản: {len(chunks)} đoạn, {level} tầng reduce, {elapsed:.1f}s")
+    return {"summary": summary, "chunks": len(chunks), "levels": level, "seconds": round(elapsed, 3)}
+
+
+# ============================================================
+# 📝 Xuất Markdown theo template
+# ============================================================
+def render_meeting_summary(summary: MeetingSummarySchema, template_path: str = MEETING_SUMMARY_TEMPLATE_PATH) -> str:
+    """Điền MeetingSummarySchema vào prompt/templates/meeting_summary_template.md."""
+    if not os.path.exists(template_path):
+        return ""
+    with open(template_path, "r", encoding="utf-8") as f:
+        text = f.read()
+
+    def bullets(items):
+        return "\n".join(f"- {item}" for item in items) if items else "- (không có)"
+
+    # Các dòng "- {{key_point_1}}", "- {{key_point_2}}"... → toàn bộ danh sách
+    for prefix, items in (("key_point", summary.key_points), ("blocker", summary.blockers),
+                          ("action_item", summary.next_action)):
+        placeholder_lines = re.compile(rf"(?:^- \{{\{{{prefix}_\d+\}}\}}[ \t]*\n?)+", re.MULTILINE)
+        text = placeholder_lines.sub(lambda _: bullets(items) + "\n", text, count=1)
+
+    values = {
+        "meeting_title": summary.meeting_title or "",
+        "date": datetime.date.today().isoformat(),
+        "participants": ", ".join(summary.participants),
+        "summary": summary.summary,
+    }
+    return re.sub(r"\{\{(\w+)\}\}", lambda m: values.get(m.group(1), ""), text)
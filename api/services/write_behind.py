@@ -0,0 +1,344 @@
+# ============================================================
+# 📁 api/services/write_behind.py
+# ============================================================
+"""
+Ghi lịch sử hội thoại (SQLite + Chroma) sau khi đã trả lời người dùng (write-behind).
+
+Luồng 1 lượt chat:
+  1. Ghi lượt vào journal append-only (JSON lines, fsync) → đã bền vững, trả lời ngay.
+  2. Worker nền gom lô: 1 transaction SQLite (kèm checkpoint seq của journal) + 1 lần encode/add Chroma.
+  3. Hết lượt chờ → cắt journal về rỗng.
+
+Khởi động lại: journal của tiến trình đã chết được replay — SQLite bỏ qua seq ≤ checkpoint (ghi cùng
+transaction), Chroma bỏ qua ID đã có → không ghi trùng.
+Đọc ngay sau khi ghi (search_memory, GET /api/chat/{id}): await_session chờ các lượt đang chờ của session
+được ghi xong (tối đa WRITE_BEHIND_READ_TIMEOUT_S).
+Mỗi tiến trình (worker uvicorn) có journal riêng, giữ khoá flock suốt đời tiến trình;
+journal không còn ai khoá = của tiến trình đã chết.
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows: không khoá được file → mọi journal cũ coi như mồ côi (chỉ nên chạy 1 worker)
+    fcntl = None
+
+from api.config.config import (
+    WRITE_BEHIND_BATCH_SIZE,
+    WRITE_BEHIND_ENABLED,
+    WRITE_BEHIND_FSYNC,
+    WRITE_BEHIND_JOURNAL_DIR,
+    WRITE_BEHIND_MAX_WAIT_MS,
+    WRITE_BEHIND_READ_TIMEOUT_S,
+)
+from api.services.chat_service import existing_chroma_ids, save_to_chroma, save_turns_to_chroma
+from api.utils import metrics
+from api.utils.concurrency import run_in_stage
+from api.utils.conversation_logger import delete_checkpoint, get_checkpoint, save_messages_to_db, save_turn_to_db
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_PREFIX = "journal-"
+RETRY_BACKOFF_MAX_S = 5.0
+
+_FLUSH = object()  # người đọc đang chờ → ghi ngay, không đợi gom lô
+_STOP = object()
+
+
+def _read_journal(path: str) -> list:
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                # Dòng cuối ghi dở (tiến trình chết giữa chừng): lượt đó chưa được trả lời cho ai
+                logger.warning(f"Bỏ qua dòng journal hỏng trong {path}")
+    return entries
+
+
+def _history_rows(entries: list) -> list:
+    rows = []
+    for e in entries:
+        rows += [(e["session_id"], "user", e["user"], ""), (e["session_id"], "assistant", e["reply"], e["audio_path"])]
+    return rows
+
+
+def _chroma_turns(entries: list, dedupe: bool = False) -> list:
+    turns = [(e["session_id"], e["user"], e["reply"], e["turn"]) for e in entries]
+    if dedupe:
+        existing = existing_chroma_ids([f"{sid}_{turn}" for sid, _, _, turn in turns if turn is not None])
+        turns = [t for t in turns if f"{t[0]}_{t[3]}" not in existing]
+    return turns
+
+
+class WriteBehindQueue:
+    def __init__(self, journal_dir: str, batch_size: int = 64, max_wait_ms: float = 50, fsync: bool = True,
+                 enabled: bool = True):
+        self.journal_dir = journal_dir
+        self.batch_size = max(batch_size, 1)
+        self.max_wait = max_wait_ms / 1000
+        self.fsync = fsync
+        self.enabled = enabled
+        self.name = None
+        self._file = None
+        self._worker = None
+        self._queue = queue.Queue()
+        self._journal_lock = threading.Lock()   # giữ thứ tự seq == thứ tự trong file == thứ tự trong hàng đợi
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._applied_seq = 0
+        self._pending = {}       # seq → entry chưa ghi xong (theo thứ tự seq)
+        self._session_seq = {}   # session_id → seq lớn nhất đang chờ
+        self.stats_counter = {"submitted": 0, "written": 0, "batches": 0, "replayed": 0, "errors": 0,
+                              "read_waits": 0, "read_timeouts": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None
+
+    def _journal_path(self, name: str) -> str:
+        return os.path.join(self.journal_dir, name)
+
+    # ---------- Vòng đời ----------
+    def start(self):
+        """Replay journal còn sót của tiến trình cũ, mở journal riêng và chạy worker (gọi trong lifespan)."""
+        if self.running:
+            return
+        # Replay cả khi đã tắt write-behind, để không bỏ sót lượt của lần chạy trước
+        if os.path.isdir(self.journal_dir):
+            self._replay_orphans()
+        if not self.enabled:
+            return
+        os.makedirs(self.journal_dir, exist_ok=True)
+
+        self.name = f"{JOURNAL_PREFIX}{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl"
+        self._file = open(self._journal_path(self.name), "a", encoding="utf-8")
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._seq = self._applied_seq = 0
+        self._worker = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._worker.start()
+        logger.info(f"Write-behind: journal {self.name}")
+
+    def stop(self, timeout: float = 30):
+        """Ghi nốt các lượt đang chờ rồi dừng worker (gọi khi tắt server)."""
+        if not self.running:
+            return
+        self._queue.put(_STOP)
+        self._worker.join(timeout)
+        drained = not self._worker.is_alive() and not self._pending
+        with self._journal_lock:
+            self._file.close()
+            self._file = None
+        self._worker = None
+        if drained:
+            os.remove(self._journal_path(self.name))
+            delete_checkpoint(self.name)
+        else:
+            logger.error(f"Write-behind: còn {len(self._pending)} lượt chưa ghi, giữ {self.name} để replay")
+
+    # ---------- Ghi ----------
+    def submit_turn(self, session_id: str, user_message: str, assistant_reply: str, audio_path: str = "",
+                    turn: int = None) -> int:
+        """Ghi 1 lượt vào journal rồi xếp hàng ghi nền. Trả về seq của lượt."""
+        entry = {"session_id": session_id, "user": user_message, "reply": assistant_reply,
+                 "audio_path": audio_path or "", "turn": turn, "ts": time.time()}
+        with self._journal_lock:
+            self._seq += 1
+            entry["seq"] = self._seq
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+            with self._cond:
+                self._pending[entry["seq"]] = entry
+                self._session_seq[session_id] = entry["seq"]
+                self.stats_counter["submitted"] += 1
+            self._queue.put(entry)
+            if self.fsync:
+                os.fsync(self._file.fileno())
+        return entry["seq"]
+
+    def persist_turn(self, session_id: str, user_message: str, assistant_reply: str, audio_path: str = "",
+                     turn: int = None):
+        """Lưu 1 lượt: qua journal nếu write-behind đang chạy, ngược lại ghi thẳng SQLite + Chroma như trước."""
+        if self.running:
+            return self.submit_turn(session_id, user_message, assistant_reply, audio_path, turn)
+        save_turn_to_db(session_id, user_message, assistant_reply, audio_path or "")
+        save_to_chroma(session_id, user_message, assistant_reply, turn=turn)
+        return None
+
+    # ---------- Đọc ngay sau khi ghi ----------
+    def has_pending(self, session_id: str) -> bool:
+        with self._cond:
+            return session_id in self._session_seq
+
+    def wait_for_session(self, session_id: str, timeout: float = WRITE_BEHIND_READ_TIMEOUT_S) -> bool:
+        """Chặn tới khi mọi lượt đang chờ của session đã ghi xong. False nếu hết thời gian chờ."""
+        with self._cond:
+            target = self._session_seq.get(session_id)
+            if target is None:
+                return True
+            self.stats_counter["read_waits"] += 1
+        self._queue.put(_FLUSH)
+        with self._cond:
+            done = self._cond.wait_for(lambda: self._applied_seq >= target, timeout)
+            if not done:
+                self.stats_counter["read_timeouts"] += 1
+        if not done:
+            logger.warning(f"Write-behind: quá {timeout}s chờ ghi session {session_id}, đọc dữ liệu hiện có")
+        return done
+
+    async def await_session(self, session_id: str) -> bool:
+        """Bản async của wait_for_session; không tốn thread khi session không có lượt đang chờ."""
+        if not self.has_pending(session_id):
+            return True
+        return await run_in_stage("default", self.wait_for_session, session_id)
+
+    # ---------- Worker ----------
+    def _collect(self):
+        """Lấy 1 lô (chờ tối đa max_wait để gom). Trả về (batch, có lệnh dừng)."""
+        batch, stop, flush = [], False, False
+        item = self._queue.get()
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            if item is _STOP:
+                stop = True
+            elif item is _FLUSH:
+                flush = True
+            else:
+                batch.append(item)
+            if len(batch) >= self.batch_size:
+                break
+            timeout = 0 if stop or flush else deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+        return batch, stop
+
+    def _run(self):
+        stopping = False
+        while True:
+            batch, stop = self._collect()
+            stopping = stopping or stop
+            if batch:
+                self._write_batch(batch)
+            if stopping and self._queue.empty():
+                return
+
+    def _write_batch(self, batch: list):
+        """Ghi 1 lô, thử lại tới khi được (journal vẫn giữ lượt nên không mất dữ liệu khi lỗi kéo dài)."""
+        sqlite_done, delay = False, 0.1
+        while True:
+            try:
+                with metrics.timed("write_behind_batch"):
+                    if not sqlite_done:
+                        save_messages_to_db(_history_rows(batch), checkpoint=(self.name, batch[-1]["seq"]))
+                        sqlite_done = True
+                    save_turns_to_chroma(_chroma_turns(batch))
+                break
+            except Exception as e:
+                self.stats_counter["errors"] += 1
+                logger.exception(f"Write-behind: lỗi khi ghi lô {len(batch)} lượt, thử lại sau {delay:.1f}s: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, RETRY_BACKOFF_MAX_S)
+
+        with self._cond:
+            for e in batch:
+                self._pending.pop(e["seq"], None)
+                if self._session_seq.get(e["session_id"]) == e["seq"]:
+                    del self._session_seq[e["session_id"]]
+            self._applied_seq = batch[-1]["seq"]
+            self.stats_counter["written"] += len(batch)
+            self.stats_counter["batches"] += 1
+            self._cond.notify_all()
+        self._truncate_if_drained()
+
+    def _truncate_if_drained(self):
+        """Mọi lượt trong journal đã ghi xong → cắt file về rỗng (seq vẫn tăng tiếp, checkpoint giữ nguyên)."""
+        with self._journal_lock:
+            with self._cond:
+                if self._pending or self._file is None:
+                    return
+            self._file.seek(0)
+            self._file.truncate()
+
+    # ---------- Replay ----------
+    def _replay_orphans(self):
+        for name in sorted(os.listdir(self.journal_dir)):
+            if not (name.startswith(JOURNAL_PREFIX) and name.endswith(".jsonl")):
+                continue
+            path = self._journal_path(name)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    if fcntl is not None:
+                        try:
+                            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        except BlockingIOError:
+                            continue  # journal của worker khác đang chạy
+                    self._replay_file(name, path)
+                    os.remove(path)
+                delete_checkpoint(name)
+            except FileNotFoundError:
+                continue  # worker khác vừa replay xong
+            except Exception as e:
+                logger.exception(f"Write-behind: không replay được {name}, giữ lại cho lần khởi động sau: {e}")
+
+    def _replay_file(self, name: str, path: str):
+        entries = _read_journal(path)
+        done = get_checkpoint(name)
+        for start in range(0, len(entries), self.batch_size):
+            batch = entries[start:start + self.batch_size]
+            missing = [e for e in batch if e["seq"] > done]
+            if missing:
+                save_messages_to_db(_history_rows(missing), checkpoint=(name, missing[-1]["seq"]))
+            save_turns_to_chroma(_chroma_turns(batch, dedupe=True))
+        self.stats_counter["replayed"] += len(entries)
+        if entries:
+            logger.info(f"Write-behind: đã replay {len(entries)} lượt từ {name} ({done} lượt đã có trong SQLite)")
+
+    # ---------- Thống kê ----------
+    def lag_seconds(self) -> float:
+        """Tuổi của lượt cũ nhất chưa ghi xong (0 nếu không có)."""
+        with self._cond:
+            oldest = next(iter(self._pending.values()), None)
+        return time.time() - oldest["ts"] if oldest else 0.0
+
+    def stats(self) -> dict:
+        with self._cond:
+            pending, applied = len(self._pending), self._applied_seq
+            counters = dict(self.stats_counter)
+        return {"enabled": self.enabled, "running": self.running, "journal": self.name, "pending": pending,
+                "lag_seconds": round(self.lag_seconds(), 3), "applied_seq": applied, **counters}
+
+
+write_behind = WriteBehindQueue(
+    WRITE_BEHIND_JOURNAL_DIR,
+    batch_size=WRITE_BEHIND_BATCH_SIZE,
+    max_wait_ms=WRITE_BEHIND_MAX_WAIT_MS,
+    fsync=WRITE_BEHIND_FSYNC,
+    enabled=WRITE_BEHIND_ENABLED,
+)
+
+
+def _collect_write_behind_gauges():
+    stats = write_behind.stats()
+    return [
+        ("meeting_write_behind_lag_seconds", "gauge", "Tuổi của lượt cũ nhất chưa được ghi (giây)",
+         [({}, stats["lag_seconds"])]),
+        ("meeting_write_behind_pending", "gauge", "Số lượt đang chờ ghi", [({}, stats["pending"])]),
+        ("meeting_write_behind_written_total", "counter", "Số lượt đã ghi xuống SQLite + Chroma",
+         [({}, stats["written"])]),
+        ("meeting_write_behind_errors_total", "counter", "Số lần ghi lô bị lỗi (sẽ thử lại)",
+         [({}, stats["errors"])]),
+    ]
+
+
+metrics.register_collector(_collect_write_behind_gauges)
@@ -0,0 +1,104 @@
+# ============================================================
+# 📁 api/utils/concurrency.py
+# ============================================================
+"""
+Chạy code blocking (SQLite, encode, Chroma, TTS...) ngoài event loop.
+
+Mỗi "stage" có một giới hạn đồng thời riêng (semaphore) và dùng chung một
+ThreadPoolExecutor có kích thước cố định → 1 job TTS chậm không chặn các request khác.
+"""
+
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from api.config.config import EXECUTOR_MAX_WORKERS, STAGE_CONCURRENCY
+from api.utils import metrics
+
+_executor = None
+_semaphores = {}
+_counters = {}
+_lock = threading.Lock()
+
+# Thời gian chờ slot của stage (hàng đợi) — tách riêng với thời gian chạy để chỉnh STAGE_CONCURRENCY
+_wait_seconds = metrics.histogram(
+    "meeting_stage_queue_wait_seconds", "Thời gian chờ slot của stage (semaphore)", ("stage",)
+)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=EXECUTOR_MAX_WORKERS, thread_name_prefix="stage")
+        return _executor
+
+
+def _stage_state(stage: str):
+    with _lock:
+        if stage not in _semaphores:
+            limit = STAGE_CONCURRENCY.get(stage, STAGE_CONCURRENCY["default"])
+            _semaphores[stage] = asyncio.Semaphore(limit)
+            _counters[stage] = {"limit": limit, "in_flight": 0, "waiting": 0, "completed": 0}
+        return _semaphores[stage], _counters[stage]
+
+
+@asynccontextmanager
+async def stage_slot(stage: str):
+    """Giữ 1 slot của stage trong suốt khối `async with`."""
+    semaphore, counter = _stage_state(stage)
+    counter["waiting"] += 1
+    start = time.perf_counter()
+    try:
+        await semaphore.acquire()
+    finally:
+        counter["waiting"] -= 1
+    _wait_seconds.observe(time.perf_counter() - start, stage=stage)
+    counter["in_flight"] += 1
+    try:
+        yield
+    finally:
+        counter["in_flight"] -= 1
+        counter["completed"] += 1
+        semaphore.release()
+
+
+async def run_in_stage(stage: str, fn, *args, **kwargs):
+    """
+    Chạy hàm blocking trong executor, tuân theo giới hạn đồng thời của stage.
+    Context của request (vd: số liệu Server-Timing) được chuyển sang thread chạy hàm.
+    """
+    async with stage_slot(stage):
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(_get_executor(), functools.partial(context.run, fn, *args, **kwargs))
+
+
+def stage_stats() -> dict:
+    with _lock:
+        return {stage: dict(counter) for stage, counter in _counters.items()}
+
+
+def shutdown_executor():
+    """Dừng executor (khi tắt server); lần dùng sau sẽ tạo executor mới."""
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+def _collect_stage_gauges():
+    stats = stage_stats()
+    return [
+        (f"meeting_stage_{field}", "gauge", f"Số job của stage đang ở trạng thái {field}",
+         [({"stage": stage}, counter[field]) for stage, counter in stats.items()])
+        for field in ("in_flight", "waiting")
+    ]
+
+
+metrics.register_collector(_collect_stage_gauges)
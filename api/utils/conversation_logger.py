@@ -1,15 +1,30 @@
+import base64
+import json
 import sqlite3
 import os
+import queue
+import threading
+from contextlib import contextmanager
+
+from api.config.config import CONVERSATION_DB_PATH, SQLITE_POOL_SIZE, SQLITE_POOL_TIMEOUT_S
+from api.utils import metrics
 from api.services.chroma_client import get_chroma_collection
 
-DB_PATH = "conversation.db"
+DB_PATH = CONVERSATION_DB_PATH
 
-def init_db(db_path=DB_PATH):
-    if not os.path.exists(db_path):
-        print(f"📂 Database not found, creating {db_path}...")
-    conn = sqlite3.connect(db_path)
-    cur = conn.cursor()
-    cur.execute("""
+# Pragma áp dụng cho mỗi connection:
+# WAL cho phép đọc song song với ghi, synchronous=NORMAL đủ an toàn với WAL và nhanh hơn FULL
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000",      # ~20 MB page cache
+    "PRAGMA mmap_size=268435456",    # 256 MB memory-mapped I/O
+)
+
+_SCHEMA = (
+    """
     CREATE TABLE IF NOT EXISTS conversation_history (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         session_id TEXT NOT NULL,
@@ -18,55 +33,344 @@ def init_db(db_path=DB_PATH):
         audio_path TEXT,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     )
-    """)
-    conn.commit()
-    conn.close()
+    """,
+    # Phục vụ WHERE session_id=? ORDER BY created_at, id và GROUP BY session_id, MIN(created_at)
+    "CREATE INDEX IF NOT EXISTS idx_history_session_created ON conversation_history (session_id, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS idx_history_created ON conversation_history (created_at)",
+    # Partial index cho get_referenced_audio_files (dọn audio): chỉ chứa dòng có audio → không quét cả bảng
+    "CREATE INDEX IF NOT EXISTS idx_history_audio ON conversation_history (audio_path) WHERE audio_path != ''",
+    # Bảng tổng hợp theo session, cập nhật dần trong cùng transaction với mỗi lần ghi message
+    """
+    CREATE TABLE IF NOT EXISTS sessions (
+        session_id TEXT PRIMARY KEY,
+        title TEXT,
+        message_count INTEGER NOT NULL DEFAULT 0,
+        first_at TIMESTAMP NOT NULL,
+        last_at TIMESTAMP NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_sessions_last ON sessions (last_at, session_id)",
+    # Vị trí đã ghi xong của từng journal write-behind, cập nhật cùng transaction với message → replay không ghi trùng
+    """
+    CREATE TABLE IF NOT EXISTS write_checkpoints (
+        name TEXT PRIMARY KEY,
+        seq INTEGER NOT NULL
+    )
+    """,
+)
+
+# Dựng lại bảng sessions từ lịch sử (chỉ chạy 1 lần khi bảng còn trống)
+_BACKFILL_SESSIONS_SQL = """
+    INSERT INTO sessions (session_id, title, message_count, first_at, last_at)
+    SELECT h.session_id,
+           (SELECT substr(u.content, 1, ?) FROM conversation_history u
+            WHERE u.session_id = h.session_id AND u.role = 'user'
+            ORDER BY u.created_at, u.id LIMIT 1),
+           COUNT(*), MIN(h.created_at), MAX(h.created_at)
+    FROM conversation_history h
+    GROUP BY h.session_id
+"""
+
+_UPSERT_SESSION_SQL = """
+    INSERT INTO sessions (session_id, title, message_count, first_at, last_at)
+    VALUES (?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+    ON CONFLICT(session_id) DO UPDATE SET
+        title = COALESCE(sessions.title, excluded.title),
+        message_count = sessions.message_count + excluded.message_count,
+        last_at = excluded.last_at
+"""
+
+_UPSERT_CHECKPOINT_SQL = """
+    INSERT INTO write_checkpoints (name, seq) VALUES (?, ?)
+    ON CONFLICT(name) DO UPDATE SET seq = MAX(write_checkpoints.seq, excluded.seq)
+"""
+
+TITLE_MAX_CHARS = 60
+
+INSERT_MESSAGE_SQL = "INSERT INTO conversation_history (session_id, role, content, audio_path) VALUES (?, ?, ?, ?)"
+
+
+class ConnectionPool:
+    """
+    Pool connection SQLite dùng lại giữa các request (thay vì connect/close mỗi câu lệnh).
+    Mỗi connection giữ cache prepared statement riêng của sqlite3.
+    """
+
+    def __init__(self, db_path: str, size: int = SQLITE_POOL_SIZE, timeout: float = SQLITE_POOL_TIMEOUT_S):
+        self.db_path = db_path
+        self.size = max(size, 1)
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0  # số connection đang tồn tại (rảnh + đang được mượn)
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=256)
+        try:
+            for pragma in _PRAGMAS:
+                conn.execute(pragma)
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+        if can_create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1  # trả lại chỗ, không thì pool "đầy" mà không có connection nào
+                raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(f"Hết connection SQLite rảnh sau {self.timeout}s (pool {self.size})")
+
+    def _release(self, conn):
+        with self._lock:
+            closed = self._closed
+            if closed:
+                self._created -= 1
+        if closed:  # pool đã đóng khi connection còn đang được mượn
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._release(conn)
+
+    def close(self):
+        """Đóng connection rảnh; connection đang được mượn sẽ đóng khi trả về."""
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Pool dùng chung, tự khởi tạo schema ở lần dùng đầu tiên."""
+    global _pool
+    if _pool is None:
+        init_db()
+    return _pool
+
+
+def init_db(db_path=DB_PATH):
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool.db_path == db_path:
+            return
+        if not os.path.exists(db_path):
+            print(f"📂 Database not found, creating {db_path}...")
+        pool = ConnectionPool(db_path)
+        with pool.connection() as conn:
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            if conn.execute("SELECT 1 FROM sessions LIMIT 1").fetchone() is None:
+                conn.execute(_BACKFILL_SESSIONS_SQL, (TITLE_MAX_CHARS,))
+            conn.commit()
+        if _pool is not None:
+            _pool.close()
+        _pool = pool
+
+
+def close_db():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+
+def _session_updates(rows: list) -> list:
+    """Gom các message theo session → (session_id, title, số message) để cập nhật bảng sessions."""
+    updates = {}
+    for session_id, role, content, _ in rows:
+        title, count = updates.get(session_id, (None, 0))
+        if title is None and role == "user" and content:
+            title = content[:TITLE_MAX_CHARS]
+        updates[session_id] = (title, count + 1)
+    return [(sid, title, count) for sid, (title, count) in updates.items()]
 
-# ✅ Kiểm tra ngay khi import module
-init_db()
 
 def save_message_to_db(session_id: str, role: str, content: str, audio_path: str = None):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO conversation_history (session_id, role, content, audio_path) VALUES (?, ?, ?, ?)",
-        (session_id, role, content, audio_path)
-    )
-    conn.commit()
-    conn.close()
+    save_messages_to_db([(session_id, role, content, audio_path)])
+
+
+def save_messages_to_db(rows: list, checkpoint: tuple = None):
+    """
+    Ghi nhiều message (session_id, role, content, audio_path) và cập nhật bảng sessions trong 1 transaction.
+    checkpoint=(name, seq): ghi kèm vị trí journal đã xử lý trong cùng transaction (write-behind).
+    """
+    if not rows and checkpoint is None:
+        return
+    with metrics.timed("sqlite_write"), get_pool().connection() as conn:
+        conn.executemany(INSERT_MESSAGE_SQL, rows)
+        conn.executemany(_UPSERT_SESSION_SQL, _session_updates(rows))
+        if checkpoint is not None:
+            conn.execute(_UPSERT_CHECKPOINT_SQL, checkpoint)
+        conn.commit()
+
+
+def get_checkpoint(name: str) -> int:
+    """Seq lớn nhất đã ghi của journal `name` (0 nếu chưa có)."""
+    with get_pool().connection() as conn:
+        row = conn.execute("SELECT seq FROM write_checkpoints WHERE name=?", (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def delete_checkpoint(name: str):
+    with get_pool().connection() as conn:
+        conn.execute("DELETE FROM write_checkpoints WHERE name=?", (name,))
+        conn.commit()
+
+
+def save_turn_to_db(session_id: str, user_message: str, assistant_reply: str, audio_path: str = None):
+    """Ghi 1 lượt chat (user + assistant) trong cùng 1 transaction."""
+    save_messages_to_db([
+        (session_id, "user", user_message, ""),
+        (session_id, "assistant", assistant_reply, audio_path),
+    ])
+
+
+def encode_cursor(*values) -> str:
+    """Cursor phân trang dạng chuỗi mờ (base64 của các giá trị khoá)."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> list:
+    """Giải mã cursor; ném ValueError nếu cursor không hợp lệ."""
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception as e:
+        raise ValueError(f"Cursor không hợp lệ: {cursor}") from e
+
+
+def get_sessions_page(limit: int = 50, cursor: str = None):
+    """
+    Lấy 1 trang session, mới hoạt động nhất trước (keyset pagination trên bảng sessions).
+    Trả về (sessions, next_cursor) — next_cursor là None nếu đã hết.
+    """
+    params = []
+    where = ""
+    if cursor:
+        last_at, session_id = decode_cursor(cursor)
+        where = "WHERE (last_at, session_id) < (?, ?)"
+        params = [last_at, session_id]
+
+    with get_pool().connection() as conn:
+        rows = conn.execute(f"""
+            SELECT session_id, title, message_count, first_at, last_at
+            FROM sessions
+            {where}
+            ORDER BY last_at DESC, session_id DESC
+            LIMIT ?
+        """, (*params, limit + 1)).fetchall()
+
+    next_cursor = encode_cursor(rows[limit - 1][4], rows[limit - 1][0]) if len(rows) > limit else None
+    sessions = [
+        {"session_id": r[0], "title": r[1], "message_count": r[2], "first_at": r[3], "last_at": r[4]}
+        for r in rows[:limit]
+    ]
+    return sessions, next_cursor
+
+
+def get_referenced_audio_files() -> set:
+    """Tên file audio (không kèm thư mục) đang được lịch sử hội thoại tham chiếu — dùng cho dọn audio."""
+    with get_pool().connection() as conn:
+        rows = conn.execute(
+            "SELECT DISTINCT audio_path FROM conversation_history WHERE audio_path IS NOT NULL AND audio_path != ''"
+        ).fetchall()
+    return {os.path.basename(row[0]) for row in rows}
+
 
 def get_all_sessions():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT session_id, MIN(created_at) as created_at
-        FROM conversation_history
-        GROUP BY session_id
-        ORDER BY created_at DESC
-    """)
-    rows = cur.fetchall()
-    conn.close()
+    with get_pool().connection() as conn:
+        rows = conn.execute("""
+            SELECT session_id, first_at
+            FROM sessions
+            ORDER BY first_at DESC
+        """).fetchall()
     return {row[0]: row[1] for row in rows}
 
-def get_session_messages(session_id):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT role, content, audio_path, created_at
-        FROM conversation_history
-        WHERE session_id=?
-        ORDER BY created_at ASC
-    """, (session_id,))
-    rows = cur.fetchall()
-    conn.close()
-    return [{"role": r[0], "content": r[1], "audio_path": r[2], "created_at": r[3]} for r in rows]
+
+def get_session_messages(session_id, limit: int = None, cursor: str = None):
+    """
+    Lấy message của 1 session theo thứ tự thời gian.
+    - Không truyền limit → toàn bộ lịch sử.
+    - Có limit → trả về `limit` message ngay trước cursor (mặc định: mới nhất),
+      dùng get_session_messages_page để lấy kèm cursor trang trước.
+    """
+    return get_session_messages_page(session_id, limit, cursor)[0]
+
+
+def get_session_messages_page(session_id, limit: int = None, cursor: str = None):
+    """Trả về (messages, next_cursor); next_cursor trỏ tới các message cũ hơn (None nếu hết)."""
+    if limit is None:
+        with get_pool().connection() as conn:
+            rows = conn.execute("""
+                SELECT id, role, content, audio_path, created_at
+                FROM conversation_history
+                WHERE session_id=?
+                ORDER BY created_at ASC, id ASC
+            """, (session_id,)).fetchall()
+        next_cursor = None
+    else:
+        params = [session_id]
+        where = ""
+        if cursor:
+            created_at, row_id = decode_cursor(cursor)
+            where = "AND (created_at, id) < (?, ?)"
+            params += [created_at, row_id]
+        with get_pool().connection() as conn:
+            rows = conn.execute(f"""
+                SELECT id, role, content, audio_path, created_at
+                FROM conversation_history
+                WHERE session_id=? {where}
+                ORDER BY created_at DESC, id DESC
+                LIMIT ?
+            """, (*params, limit + 1)).fetchall()
+        next_cursor = encode_cursor(rows[limit - 1][4], rows[limit - 1][0]) if len(rows) > limit else None
+        rows = rows[:limit][::-1]
+
+    messages = [{"id": r[0], "role": r[1], "content": r[2], "audio_path": r[3], "created_at": r[4]} for r in rows]
+    return messages, next_cursor
+
 
 def delete_session_messages(session_id: str):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM conversation_history WHERE session_id=?", (session_id,))
-    conn.commit()
-    conn.close()
+    with get_pool().connection() as conn:
+        conn.execute("DELETE FROM conversation_history WHERE session_id=?", (session_id,))
+        conn.execute("DELETE FROM sessions WHERE session_id=?", (session_id,))
+        conn.commit()
+
 
 def delete_chroma_messages(session_id: str):
     """
@@ -74,4 +378,4 @@ def delete_chroma_messages(session_id: str):
     """
     collection = get_chroma_collection()
     # Xóa tất cả vector liên quan đến session_id
-    collection.delete(where={"session_id": session_id})
\ No newline at end of file
+    collection.delete(where={"session_id": session_id})
@@ -0,0 +1,195 @@
+# ============================================================
+# 📁 api/utils/metrics.py
+# ============================================================
+"""
+Đo thời gian từng stage của pipeline chat và xuất ra 2 dạng:
+
+- /metrics: histogram/counter theo định dạng text của Prometheus (không cần thư viện prometheus_client).
+- Header Server-Timing: tổng thời gian từng stage trong request hiện tại (xem được ngay trong DevTools).
+
+Dùng: `with timed("chroma_query"): ...` — hoạt động cả trong thread của executor
+(run_in_stage chuyển context của request sang thread).
+"""
+
+import contextvars
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Bucket (giây) đủ rộng cho cả cache hit (~ms) lẫn lời gọi Azure có retry (hàng chục giây)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_metrics = {}
+_collectors = []
+
+# Danh sách (stage, giây) của request hiện tại; None khi không nằm trong request HTTP
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names=()):
+        self.name, self.help, self.label_names = name, help_text, tuple(label_names)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(n, "") for n in self.label_names)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(labels.get(n, "") for n in self.label_names)
+        with _lock:
+            return self._values.get(key, 0)
+
+    def render(self) -> list:
+        with _lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(dict(zip(self.label_names, key)))} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.label_names = name, help_text, tuple(label_names)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series = {}  # labels → [số đếm theo bucket (không cộng dồn), tổng, số lần]
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.label_names)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with _lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self) -> dict:
+        """{labels: {"count", "sum"}} — dùng cho /api/stats và benchmark."""
+        with _lock:
+            return {key: {"count": s[2], "sum": s[1]} for key, s in self._series.items()}
+
+    def render(self) -> list:
+        with _lock:
+            series = {key: ([*s[0]], s[1], s[2]) for key, s in self._series.items()}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted(series.items()):
+            labels = dict(zip(self.label_names, key))
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                bucket_labels = _format_labels({**labels, "le": _format_value(bound)})
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total!r}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+def _register(metric):
+    with _lock:
+        return _metrics.setdefault(metric.name, metric)
+
+
+def counter(name: str, help_text: str, label_names=()) -> Counter:
+    return _register(Counter(name, help_text, label_names))
+
+
+def histogram(name: str, help_text: str, label_names=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return _register(Histogram(name, help_text, label_names, buckets))
+
+
+def register_collector(fn):
+    """
+    Thêm nguồn số liệu tính lúc scrape: fn() → [(tên, kiểu, help, [(labels, giá trị)])].
+    Dùng cho gauge lấy từ trạng thái sẵn có (thời gian load model, hàng đợi stage...).
+    """
+    with _lock:
+        _collectors.append(fn)
+
+
+# ============================================================
+# ⏱️ Đo thời gian theo stage
+# ============================================================
+stage_seconds = histogram(
+    "meeting_stage_duration_seconds", "Thời gian từng stage của pipeline", ("stage",)
+)
+
+
+def record_stage(stage: str, seconds: float):
+    stage_seconds.observe(seconds, stage=stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+@contextmanager
+def timed(stage: str):
+    """Đo thời gian khối lệnh (kể cả khi có lỗi) và ghi vào histogram + Server-Timing của request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def start_request_timing() -> contextvars.Token:
+    return _request_timings.set([])
+
+
+def finish_request_timing(token: contextvars.Token) -> list:
+    timings = _request_timings.get() or []
+    _request_timings.reset(token)
+    return timings
+
+
+def server_timing_header(timings: list, total_seconds: float = None) -> str:
+    """Gộp thời gian theo stage (cộng dồn nếu 1 stage chạy nhiều lần) → giá trị header Server-Timing."""
+    totals, counts = {}, {}
+    for stage, seconds in timings:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+        counts[stage] = counts.get(stage, 0) + 1
+    parts = [
+        f'{stage};dur={seconds * 1000:.1f}' + (f';desc="x{counts[stage]}"' if counts[stage] > 1 else "")
+        for stage, seconds in totals.items()
+    ]
+    if total_seconds is not None:
+        parts.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ", ".join(parts)
+
+
+# ============================================================
+# 📤 Xuất định dạng Prometheus
+# ============================================================
+def render_prometheus() -> str:
+    with _lock:
+        metrics = list(_metrics.values())
+        collectors = list(_collectors)
+    lines = []
+    for metric in metrics:
+        lines += metric.render()
+    for collect in collectors:
+        for name, kind, help_text, samples in collect():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            lines += [f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in samples]
+    return "\n".join(lines) + "\n"
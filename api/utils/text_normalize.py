@@ -0,0 +1,18 @@
+import re
+import unicodedata
+
+
+def normalize_text(text: str) -> str:
+    """Chuẩn hoá Unicode (NFC) và gộp khoảng trắng — không đổi chữ hoa/thường."""
+    text = unicodedata.normalize("NFC", text or "")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def normalize_question(text: str) -> str:
+    """
+    Chuẩn hoá mạnh hơn cho so khớp câu hỏi lặp lại: như normalize_text + không phân biệt hoa/thường,
+    bỏ dấu câu/ký hiệu ("Tóm tắt cuộc họp?" ≡ "tóm tắt  cuộc họp"). Giữ dấu tiếng Việt.
+    """
+    text = unicodedata.normalize("NFC", text or "").casefold()
+    text = "".join(" " if unicodedata.category(ch)[0] in "PS" else ch for ch in text)
+    return re.sub(r"\s+", " ", text).strip()
@@ -0,0 +1,67 @@
+# ============================================================
+# 📁 api/utils/tokens.py
+# ============================================================
+"""
+Đếm token cho prompt gửi lên Azure OpenAI.
+Dùng tiktoken nếu đã cài (và tải được bảng mã), nếu không thì ước lượng ~4 ký tự/token.
+"""
+
+import functools
+import logging
+
+from api.config.config import TOKENIZER_ENCODING
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Chi phí cố định mỗi message (role + phân tách) và phần mồi câu trả lời, theo cách OpenAI tính
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMING_TOKENS = 3
+
+
+@functools.lru_cache(maxsize=1)
+def _encoding():
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception as e:
+        logger.warning(f"Không dùng được tiktoken ({e}), chuyển sang ước lượng theo số ký tự")
+        return None
+
+
+@functools.lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int, marker: str = "\n[...]\n") -> str:
+    """Cắt văn bản còn khoảng max_tokens token, giữ phần đầu và phần cuối (bỏ phần giữa)."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    keep = max(max_tokens - count_tokens(marker), 2)
+    encoding = _encoding()
+    if encoding is None:
+        head, tail = (keep // 2) * 4, (keep - keep // 2) * 4
+        return text[:head] + marker + text[-tail:]
+    ids = encoding.encode(text, disallowed_special=())
+    head, tail = keep // 2, keep - keep // 2
+    return encoding.decode(ids[:head]) + marker + encoding.decode(ids[-tail:])
+
+
+def message_tokens(message: dict) -> int:
+    return MESSAGE_OVERHEAD_TOKENS + count_tokens(message["content"])
+
+
+def count_message_tokens(messages: list) -> int:
+    """Số token (ước lượng) của cả danh sách message gửi lên chat completion."""
+    return sum(message_tokens(m) for m in messages) + REPLY_PRIMING_TOKENS
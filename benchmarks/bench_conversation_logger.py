@@ -0,0 +1,93 @@
+"""
+Benchmark: thông lượng ghi và độ trễ đọc lịch sử của conversation_logger.
+
+Ở mỗi kích thước bảng (số dòng conversation_history), đo:
+  - turns/s và p50/p95/p99 khi ghi từng lượt (save_turn_to_db: user + assistant trong 1 transaction)
+  - p50/p95/p99 của get_session_messages cho session ngẫu nhiên
+  - thời gian get_all_sessions
+
+Chạy (dùng file DB tạm, không đụng conversation.db):
+    python -m benchmarks.bench_conversation_logger --sizes 100000 1000000 3000000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import latency_summary, offline_env, time_calls, write_results
+
+for _name, _value in offline_env().items():
+    os.environ.setdefault(_name, _value)
+
+from api.utils import conversation_logger as logger_db  # noqa: E402
+
+MESSAGES_PER_SESSION = 20
+
+
+def fill(target: int, current: int, batch: int = 20_000) -> int:
+    while current < target:
+        n = min(batch, target - current)
+        rows = [
+            (f"bench-{i // MESSAGES_PER_SESSION}", "user" if i % 2 == 0 else "assistant", f"message {i} " * 8, "")
+            for i in range(current, current + n)
+        ]
+        logger_db.save_messages_to_db(rows)
+        current += n
+    return current
+
+
+def timed_save_turn(session_id: str) -> float:
+    t0 = time.perf_counter()
+    logger_db.save_turn_to_db(session_id, "q", "a", "")
+    return (time.perf_counter() - t0) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000, 3_000_000])
+    parser.add_argument("--turns", type=int, default=2000, help="số lượt ghi đo ở mỗi kích thước")
+    parser.add_argument("--threads", type=int, default=8, help="số thread ghi đồng thời")
+    parser.add_argument("--reads", type=int, default=200, help="số lần đọc lịch sử đo ở mỗi kích thước")
+    parser.add_argument("--db", help="đường dẫn file DB (mặc định: file tạm)")
+    parser.add_argument("--json", help="ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="bench_db_"), "bench.db")
+    logger_db.init_db(db_path)
+    print(f"DB: {db_path}")
+
+    results = []
+    rows = 0
+    print(f"{'rows':>10} | {'turns/s':>9} | {'history p50 ms':>14} | {'history p95 ms':>14} | {'sessions ms':>11}")
+    for size in sorted(args.sizes):
+        rows = fill(size, rows)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            write_latencies = list(pool.map(timed_save_turn, (f"write-{size}-{i % 50}" for i in range(args.turns))))
+        write = latency_summary(write_latencies, seconds=time.perf_counter() - start)
+        rows += args.turns * 2
+
+        sessions = size // MESSAGES_PER_SESSION
+        latencies, _ = time_calls(logger_db.get_session_messages,
+                                  [(f"bench-{random.randrange(sessions)}",) for _ in range(args.reads)])
+        history = latency_summary(latencies)
+
+        t0 = time.perf_counter()
+        logger_db.get_all_sessions()
+        sessions_ms = (time.perf_counter() - t0) * 1000
+
+        results.append({"rows": size, "write": write, "history": history, "all_sessions_ms": sessions_ms})
+        print(f"{size:>10} | {write['throughput_per_s']:>9.0f} | {history['p50_ms']:>14.3f} | "
+              f"{history['p95_ms']:>14.3f} | {sessions_ms:>11.1f}")
+
+    logger_db.close_db()
+    if args.json:
+        write_results(args.json, "bench_conversation_logger", results,
+                      {k: v for k, v in vars(args).items() if k != "json"})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+So sánh backend embedding: PyTorch fp32 (SentenceTransformer) vs ONNX Runtime int8.
+
+1. Độ khớp (parity): encode lại các câu hỏi bằng backend int8 rồi so với vector fp32 đã lưu trong Chroma
+   (cosine từng cặp + tỉ lệ top-1 tìm lại đúng chính nó). Collection trống → dùng câu hỏi trong
+   benchmarks/data/memory_eval.json, vector fp32 encode bằng PyTorch.
+   Không đạt --min-cosine → exit code 1 (dùng trước khi bật EMBEDDER_BACKEND=onnx-int8).
+2. Thông lượng: số câu/giây của từng backend theo batch size.
+
+Chạy:
+    python -m benchmarks.bench_embedder_backends --batch-sizes 1 8 32 --texts 512
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.common import latency_summary, offline_env, write_results
+
+for _name, _value in offline_env().items():
+    os.environ.setdefault(_name, _value)
+
+DEFAULT_DATA = os.path.join(os.path.dirname(__file__), "data", "memory_eval.json")
+
+
+def reference_vectors(torch_model, data_path: str, limit: int):
+    """Vector fp32 tham chiếu: ưu tiên vector đang lưu trong Chroma, không có thì encode bằng PyTorch."""
+    from api.services.chroma_client import get_chroma_collection
+
+    collection = get_chroma_collection()
+    if collection.count():
+        page = collection.get(include=["metadatas", "embeddings"], limit=limit)
+        texts = [(m or {}).get("question", "") for m in page["metadatas"]]
+        return texts, np.asarray(page["embeddings"], dtype=np.float32), "chroma"
+
+    with open(data_path, encoding="utf-8") as f:
+        data = json.load(f)
+    texts = [m["question"] for m in data["memory"]] + [q["query"] for q in data["queries"]]
+    return texts[:limit], torch_model.encode(texts[:limit], convert_to_numpy=True), "eval-set"
+
+
+def parity(reference: np.ndarray, candidate: np.ndarray) -> dict:
+    ref = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    cand = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    cosine = (ref * cand).sum(axis=1)
+    # Tìm kiếm bằng vector int8 trên tập vector fp32: top-1 có phải chính câu đó không
+    top1 = (cand @ ref.T).argmax(axis=1) == np.arange(len(ref))
+    return {
+        "count": int(len(ref)),
+        "cosine_mean": float(cosine.mean()),
+        "cosine_min": float(cosine.min()),
+        "cosine_p1": float(np.percentile(cosine, 1)),
+        "top1_agreement": float(top1.mean()),
+    }
+
+
+def throughput(model, texts: list, batch_size: int) -> dict:
+    """Độ trễ mỗi lô (p50/p95/p99) + số câu/giây khi encode theo lô batch_size."""
+    model.encode(texts[:batch_size], batch_size=batch_size)  # làm nóng
+    latencies = []
+    start = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        t0 = time.perf_counter()
+        model.encode(texts[i:i + batch_size], batch_size=batch_size)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    summary = latency_summary(latencies)
+    summary["throughput_per_s"] = len(texts) / (time.perf_counter() - start)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default=DEFAULT_DATA)
+    parser.add_argument("--parity-limit", type=int, default=5000, help="số vector tối đa lấy từ Chroma")
+    parser.add_argument("--min-cosine", type=float, default=0.95, help="ngưỡng cosine trung bình tối thiểu")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--texts", type=int, default=512)
+    parser.add_argument("--json", help="ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    from api.services.chat_service import load_embedder
+
+    backends = {"torch": load_embedder("torch"), "onnx-int8": load_embedder("onnx-int8")}
+
+    texts, reference, source = reference_vectors(backends["torch"], args.data, args.parity_limit)
+    results = {"parity": {"source": source, **parity(reference, backends["onnx-int8"].encode(texts))}}
+    p = results["parity"]
+    passed = p["cosine_mean"] >= args.min_cosine
+    results["parity"]["passed"] = passed
+    print(f"parity ({source}, {p['count']} vector): cosine mean={p['cosine_mean']:.4f} min={p['cosine_min']:.4f} "
+          f"p1={p['cosine_p1']:.4f} | top-1={p['top1_agreement']:.3f} → {'OK' if passed else 'KHÔNG ĐẠT'}")
+
+    bench_texts = [f"Ai phụ trách việc số {i} trong cuộc họp tuần này và hạn chót là khi nào?"
+                   for i in range(args.texts)]
+    results["throughput"] = {}
+    print(f"{'backend':<10} | {'batch':>5} | {'texts/s':>9} | {'batch p95 ms':>12}")
+    for name, model in backends.items():
+        results["throughput"][name] = []
+        for batch_size in args.batch_sizes:
+            row = {"size": batch_size, **throughput(model, bench_texts, batch_size)}
+            results["throughput"][name].append(row)
+            print(f"{name:<10} | {batch_size:>5} | {row['throughput_per_s']:>9.1f} | {row['p95_ms']:>12.2f}")
+
+    if args.json:
+        write_results(args.json, "bench_embedder_backends", results, {k: v for k, v in vars(args).items() if k != "json"})
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark: thông lượng encode khi nhiều request đồng thời.
+
+So sánh:
+  - direct : mỗi thread gọi local_embedder.encode(1 câu) như trước
+  - batched: mỗi thread gửi câu vào MicroBatcher, worker encode theo lô
+
+Chạy:
+    python -m benchmarks.bench_micro_batching --threads 1 8 32 --requests 512
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sentence_transformers import SentenceTransformer
+
+from api.services.micro_batcher import MicroBatcher
+from benchmarks.common import latency_summary, write_results
+
+MODEL_NAME = "sentence-transformers/multi-qa-MiniLM-L6-cos-v1"
+
+
+def run(fn, threads: int, texts: list) -> dict:
+    """Độ trễ từng request (p50/p95/p99) + số request/giây khi `threads` thread gọi fn đồng thời."""
+    def timed(text):
+        t0 = time.perf_counter()
+        fn(text)
+        return (time.perf_counter() - t0) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = list(pool.map(timed, texts))
+    return latency_summary(latencies, seconds=time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=512)
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--max-wait-ms", type=float, default=5)
+    parser.add_argument("--json", help="ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    model = SentenceTransformer(MODEL_NAME)
+    texts = [f"Ai phụ trách việc số {i} trong cuộc họp tuần này?" for i in range(args.requests)]
+    model.encode(texts[:8])  # warmup
+
+    results = []
+    print(f"{'threads':>7} | {'direct req/s':>12} | {'batched req/s':>13} | {'batched p95 ms':>14} | {'avg batch':>9}")
+    for threads in args.threads:
+        batcher = MicroBatcher(
+            lambda items: model.encode(items, convert_to_numpy=True).tolist(),
+            max_batch_size=args.max_batch,
+            max_wait_ms=args.max_wait_ms,
+            name="bench",
+        )
+        direct = run(lambda t: model.encode(t, convert_to_numpy=True), threads, texts)
+        batched = run(lambda t: batcher.submit(t).result(), threads, texts)
+        stats = batcher.stats()
+        results.append({"threads": threads, "direct": direct, "batched": batched,
+                        "avg_batch_size": stats["avg_batch_size"]})
+        print(f"{threads:>7} | {direct['throughput_per_s']:>12.1f} | {batched['throughput_per_s']:>13.1f} | "
+              f"{batched['p95_ms']:>14.2f} | {stats['avg_batch_size']:>9.1f}")
+
+    if args.json:
+        write_results(args.json, "bench_micro_batching", results, {k: v for k, v in vars(args).items() if k != "json"})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Benchmark: chi phí mỗi lượt của save_to_chroma theo kích thước collection.
+
+So sánh:
+  - legacy : cách cũ, collection.get() toàn bộ ID rồi lấy len() làm ID mới
+  - counter: bộ đếm lượt theo session (save_to_chroma hiện tại)
+  - buffered: bộ đếm + gom lô, flush bằng 1 lần collection.add
+
+Embedding được thay bằng vector ngẫu nhiên để chỉ đo phần ghi/cấp ID.
+
+Chạy:
+    python -m benchmarks.bench_save_to_chroma --sizes 1000 10000 100000 1000000
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from benchmarks.common import latency_summary, offline_env, time_calls, write_results
+
+# Config yêu cầu biến môi trường Azure khi import — benchmark chạy offline
+for _name, _value in offline_env().items():
+    os.environ.setdefault(_name, _value)
+
+from api.services import chat_service  # noqa: E402
+from api.services.chroma_client import chroma_client  # noqa: E402
+
+DIM = 384  # kích thước vector của multi-qa-MiniLM-L6-cos-v1
+rng = np.random.default_rng(0)
+
+
+def random_vectors(n: int):
+    vecs = rng.standard_normal((n, DIM)).astype(np.float32)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    return vecs.tolist()
+
+
+def random_vectors_for(texts: list):
+    return random_vectors(len(texts))
+
+
+def fill_collection(collection, target: int, batch: int = 5000):
+    """Nạp collection tới đúng `target` bản ghi (các session giả lập)."""
+    current = collection.count()
+    while current < target:
+        n = min(batch, target - current)
+        ids = [f"seed-{i % 1000}_{i}" for i in range(current, current + n)]
+        collection.add(
+            ids=ids,
+            embeddings=random_vectors(n),
+            documents=[f"User: q{i}\nAssistant: a{i}" for i in range(current, current + n)],
+            metadatas=[{"session_id": f"seed-{i % 1000}", "turn": i} for i in range(current, current + n)],
+        )
+        current += n
+
+
+def legacy_save(collection, session_id: str, text: str, embedding):
+    all_ids = collection.get()["ids"]
+    collection.add(
+        documents=[text],
+        embeddings=[embedding],
+        metadatas=[{"session_id": session_id}],
+        ids=[f"{session_id}_{len(all_ids)}"],
+    )
+
+
+def measure(fn, turns: int) -> dict:
+    latencies, seconds = time_calls(fn, [(i,) for i in range(turns)])
+    return latency_summary(latencies, seconds=seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--turns", type=int, default=200, help="số lượt đo ở mỗi kích thước")
+    parser.add_argument("--buffer", type=int, default=64, help="kích thước lô cho chế độ buffered")
+    parser.add_argument("--legacy-max", type=int, default=100_000,
+                        help="bỏ qua cách cũ khi collection lớn hơn ngưỡng này (rất chậm)")
+    parser.add_argument("--json", help="ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    name = "bench_save_to_chroma"
+    if name in [c if isinstance(c, str) else c.name for c in chroma_client.list_collections()]:
+        chroma_client.delete_collection(name)
+    collection = chroma_client.create_collection(name)
+    chat_service.collection = collection
+    chat_service.get_embeddings = random_vectors_for
+    chat_service.CHROMA_WRITE_BUFFER_SIZE = args.buffer
+
+    results = []
+    print(f"{'stored':>10} | {'legacy p50 ms':>13} | {'counter p50 ms':>14} | {'buffered ms/turn':>16}")
+    for size in sorted(args.sizes):
+        fill_collection(collection, size)
+        row = {"stored": size}
+
+        if size <= args.legacy_max:
+            emb = random_vectors(1)[0]
+            row["legacy"] = measure(lambda i: legacy_save(collection, f"legacy-{size}", f"t{i}", emb), args.turns)
+        else:
+            row["legacy"] = None
+
+        row["counter"] = measure(
+            lambda i: chat_service.save_to_chroma(f"bench-{size}", f"q{i}", f"a{i}", buffered=False), args.turns)
+
+        # Lượt buffered gần như không tốn gì, chi phí nằm ở lần flush → throughput tính cả thời gian flush
+        start = time.perf_counter()
+        latencies, _ = time_calls(
+            lambda i: chat_service.save_to_chroma(f"bench-buf-{size}", f"q{i}", f"a{i}", buffered=True),
+            [(i,) for i in range(args.turns)])
+        chat_service.flush_chroma_buffer()
+        seconds = time.perf_counter() - start
+        row["buffered"] = {**latency_summary(latencies, seconds=seconds), "ms_per_turn": seconds / args.turns * 1000}
+
+        results.append(row)
+        legacy = f"{row['legacy']['p50_ms']:.3f}" if row["legacy"] is not None else "skipped"
+        print(f"{size:>10} | {legacy:>13} | {row['counter']['p50_ms']:>14.3f} | "
+              f"{row['buffered']['ms_per_turn']:>16.3f}")
+
+    if args.json:
+        write_results(args.json, "bench_save_to_chroma", results, {k: v for k, v in vars(args).items() if k != "json"})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark: thời gian khởi động và RAM của 1 worker.
+
+Mỗi kịch bản chạy trong 1 tiến trình Python mới:
+  - import   : chỉ import api.main (model load lười, chưa load gì)
+  - warmup   : import + warmup các model chỉ định (giống lifespan)
+
+Chạy:
+    python -m benchmarks.bench_startup --repeat 3 --warmup embedder embedder,reranker,tts
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from benchmarks.common import latency_summary, offline_env, write_results
+
+CHILD = r"""
+import json, os, time
+t0 = time.perf_counter()
+import api.main
+t1 = time.perf_counter()
+from api.services.model_registry import registry, _rss_bytes
+rss_import = _rss_bytes()
+registry.warmup([m for m in os.environ["BENCH_WARMUP"].split(",") if m])
+t2 = time.perf_counter()
+print(json.dumps({
+    "import_seconds": t1 - t0,
+    "warmup_seconds": t2 - t1,
+    "rss_import_mb": rss_import / 1024 / 1024,
+    "rss_total_mb": _rss_bytes() / 1024 / 1024,
+    "models": registry.stats(),
+}))
+"""
+
+
+def run_once(warmup: str, disabled: str) -> dict:
+    env = dict(offline_env(), **os.environ, BENCH_WARMUP=warmup, DISABLED_MODELS=disabled)
+    out = subprocess.run([sys.executable, "-c", CHILD], env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--warmup", nargs="+", default=["", "embedder", "embedder,reranker,tts"],
+                        help='danh sách model warmup cho mỗi kịch bản ("" = không warmup)')
+    parser.add_argument("--disabled", default="", help="giá trị DISABLED_MODELS cho tiến trình con")
+    parser.add_argument("--json", help="ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'warmup':<24} | {'import s':>8} | {'warmup s':>8} | {'RSS import MB':>13} | {'RSS total MB':>12}")
+    for warmup in args.warmup:
+        runs = [run_once(warmup, args.disabled) for _ in range(args.repeat)]
+        row = {
+            "models_warmup": warmup,
+            "import": latency_summary([r["import_seconds"] * 1000 for r in runs]),
+            "warmup": latency_summary([r["warmup_seconds"] * 1000 for r in runs]),
+            "rss_import_mb": statistics.median(r["rss_import_mb"] for r in runs),
+            "rss_total_mb": statistics.median(r["rss_total_mb"] for r in runs),
+            "models": runs[-1]["models"],
+        }
+        results.append(row)
+        print(f"{warmup or '(none)':<24} | {row['import']['p50_ms'] / 1000:>8.2f} | "
+              f"{row['warmup']['p50_ms'] / 1000:>8.2f} | "
+              f"{row['rss_import_mb']:>13.0f} | {row['rss_total_mb']:>12.0f}")
+
+    if args.json:
+        write_results(args.json, "bench_startup", results, {k: v for k, v in vars(args).items() if k != "json"})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Microbenchmark đường lưu trữ theo kích thước dữ liệu tăng dần:
+  - search_memory       : 1 câu truy vấn trên session ngẫu nhiên (ANN + chấm lại)
+  - save_to_chroma      : ghi 1 lượt (không buffer)
+  - sqlite_save_turn    : save_turn_to_db (user + assistant trong 1 transaction)
+  - sqlite_history_page : get_session_messages_page(limit=50)
+  - sqlite_sessions_page: get_sessions_page(limit=50)
+
+Mỗi thao tác báo cáo p50/p95/p99 + throughput. Mặc định embedding là vector ngẫu nhiên tất định
+(chỉ đo phần lưu trữ, chạy được không cần model); --embedder local dùng model thật (đo cả encode + rerank).
+Dữ liệu nằm trong collection Chroma và file SQLite tạm.
+
+Chạy:
+    python -m benchmarks.bench_storage --sizes 1000 10000 100000 --ops 300 --json results/storage.json
+"""
+import argparse
+import hashlib
+import os
+import random
+import tempfile
+
+import numpy as np
+
+from benchmarks.common import latency_summary, offline_env, time_calls, write_results
+
+for _name, _value in offline_env().items():
+    os.environ.setdefault(_name, _value)
+
+from api.services import chat_service  # noqa: E402
+from api.services.chroma_client import chroma_client  # noqa: E402
+from api.utils import conversation_logger as logger_db  # noqa: E402
+
+DIM = 384  # kích thước vector của multi-qa-MiniLM-L6-cos-v1
+TURNS_PER_SESSION = 50
+
+
+def hash_vector(text: str) -> list:
+    """Vector tất định theo nội dung (cùng câu → cùng vector) để search_memory có kết quả trùng thật."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vec = np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+    return (vec / np.linalg.norm(vec)).tolist()
+
+
+def question(i: int) -> str:
+    return f"Câu hỏi số {i} về cuộc họp"
+
+
+def fill_memory(collection, current: int, target: int, batch: int = 5000) -> int:
+    while current < target:
+        n = min(batch, target - current)
+        rows = range(current, current + n)
+        collection.add(
+            ids=[f"seed-{i // TURNS_PER_SESSION}_{i % TURNS_PER_SESSION}" for i in rows],
+            embeddings=chat_service.get_embeddings([question(i) for i in rows]),
+            documents=[f"User: {question(i)}\nAssistant: trả lời {i}" for i in rows],
+            metadatas=[{"session_id": f"seed-{i // TURNS_PER_SESSION}", "turn": i % TURNS_PER_SESSION,
+                        "question": question(i), "answer": f"trả lời {i}"} for i in rows],
+        )
+        current += n
+    return current
+
+
+def fill_history(current: int, target: int, batch: int = 20_000) -> int:
+    while current < target:
+        n = min(batch, target - current)
+        logger_db.save_messages_to_db([
+            (f"seed-{i // (TURNS_PER_SESSION * 2)}", "user" if i % 2 == 0 else "assistant", f"message {i} " * 8, "")
+            for i in range(current, current + n)
+        ])
+        current += n
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--ops", type=int, default=300, help="số lần đo mỗi thao tác ở mỗi kích thước")
+    parser.add_argument("--embedder", choices=("random", "local"), default="random")
+    parser.add_argument("--json", help="ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    rerank = args.embedder == "local" and chat_service.RERANK_ENABLED
+    if args.embedder == "random":
+        chat_service.get_embeddings = lambda texts: [hash_vector(t) for t in texts]
+        chat_service.get_embedding = lambda text, use_openai=False: hash_vector(text)
+
+    name = f"bench_storage_{os.getpid()}"
+    collection = chat_service.collection = chroma_client.create_collection(name)
+    db_path = os.path.join(tempfile.mkdtemp(prefix="bench_storage_"), "bench.db")
+    logger_db.init_db(db_path)
+    print(f"Chroma: {name} | DB: {db_path} | embedder: {args.embedder}")
+
+    results, stored, rows = [], 0, 0
+    print(f"{'size':>8} | {'operation':<20} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8} | {'ops/s':>8}")
+    try:
+        for size in sorted(args.sizes):
+            stored = fill_memory(collection, stored, size)
+            rows = fill_history(rows, size)
+            sessions = max(size // TURNS_PER_SESSION, 1)
+            ops = {}
+
+            # Nửa số truy vấn lặp lại câu đã lưu (trùng), nửa là câu mới
+            queries = []
+            for _ in range(args.ops):
+                sid = rng.randrange(sessions)
+                i = sid * TURNS_PER_SESSION + rng.randrange(TURNS_PER_SESSION)
+                text = question(i) if rng.random() < 0.5 else f"Câu mới {rng.random()}"
+                queries.append((f"seed-{sid}", text))
+            ops["search_memory"] = time_calls(
+                lambda sid, text: chat_service.search_memory(sid, text, return_score=True, rerank=rerank), queries)
+
+            ops["save_to_chroma"] = time_calls(
+                lambda i: chat_service.save_to_chroma(f"bench-{size}-{i % 20}", f"q{size}-{i}", f"a{i}",
+                                                      buffered=False),
+                [(i,) for i in range(args.ops)])
+            stored += args.ops
+
+            ops["sqlite_save_turn"] = time_calls(
+                lambda i: logger_db.save_turn_to_db(f"write-{size}-{i % 20}", "q", "a", ""),
+                [(i,) for i in range(args.ops)])
+            rows += args.ops * 2
+
+            history_sessions = max(size // (TURNS_PER_SESSION * 2), 1)
+            ops["sqlite_history_page"] = time_calls(
+                lambda sid: logger_db.get_session_messages_page(sid, 50),
+                [(f"seed-{rng.randrange(history_sessions)}",) for _ in range(args.ops)])
+            ops["sqlite_sessions_page"] = time_calls(
+                lambda: logger_db.get_sessions_page(limit=50), [()] * args.ops)
+
+            row = {"size": size, "operations": {op: latency_summary(lat, secs) for op, (lat, secs) in ops.items()}}
+            results.append(row)
+            for op, s in row["operations"].items():
+                print(f"{size:>8} | {op:<20} | {s['p50_ms']:>8.3f} | {s['p95_ms']:>8.3f} | {s['p99_ms']:>8.3f} | "
+                      f"{s['throughput_per_s']:>8.0f}")
+    finally:
+        chroma_client.delete_collection(name)
+        logger_db.close_db()
+
+    if args.json:
+        write_results(args.json, "bench_storage", results, {k: v for k, v in vars(args).items() if k != "json"})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Hàm dùng chung cho các benchmark: thống kê độ trễ (p50/p95/p99), ghi kết quả JSON có kèm thông tin phiên bản
+để so sánh giữa các lần chạy (benchmarks/compare.py).
+"""
+import json
+import os
+import platform
+import subprocess
+import time
+
+AZURE_ENV = ("AZURE_OPENAI_ENDPOINT", "AZURE_OPENAI_API_KEY", "AZURE_OPENAI_API_VERSION", "AZURE_OPENAI_DEPLOYMENT")
+
+
+def offline_env(endpoint: str = "offline-benchmark") -> dict:
+    """Biến môi trường tối thiểu để import api.config khi không có Azure thật."""
+    return {
+        "AZURE_OPENAI_ENDPOINT": endpoint,
+        "AZURE_OPENAI_API_KEY": "offline-benchmark",
+        "AZURE_OPENAI_API_VERSION": "2024-06-01",
+        "AZURE_OPENAI_DEPLOYMENT": "gpt-4o-mini",
+    }
+
+
+def percentile(values: list, p: float) -> float:
+    """Percentile kiểu nearest-rank (p trong [0, 1])."""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def latency_summary(latencies_ms: list, seconds: float = None) -> dict:
+    """{count, mean_ms, p50_ms, p95_ms, p99_ms, max_ms[, throughput_per_s]} cho 1 dãy độ trễ (ms)."""
+    if not latencies_ms:
+        return {"count": 0}
+    summary = {
+        "count": len(latencies_ms),
+        "mean_ms": sum(latencies_ms) / len(latencies_ms),
+        "p50_ms": percentile(latencies_ms, 0.50),
+        "p95_ms": percentile(latencies_ms, 0.95),
+        "p99_ms": percentile(latencies_ms, 0.99),
+        "max_ms": max(latencies_ms),
+    }
+    if seconds:
+        summary["throughput_per_s"] = len(latencies_ms) / seconds
+    return summary
+
+
+def time_calls(fn, args_list: list) -> tuple:
+    """Gọi fn(*args) lần lượt, trả về (độ trễ từng lần (ms), tổng thời gian (s))."""
+    latencies = []
+    start = time.perf_counter()
+    for args in args_list:
+        t0 = time.perf_counter()
+        fn(*args)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return latencies, time.perf_counter() - start
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def write_results(path: str, benchmark: str, results, params: dict = None):
+    """Ghi kết quả kèm metadata (benchmark, commit, thời điểm, máy) để so sánh giữa các phiên bản."""
+    payload = {
+        "benchmark": benchmark,
+        "revision": _git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()} ({os.cpu_count()} CPU)",
+        "params": params or {},
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2, ensure_ascii=False)
@@ -0,0 +1,81 @@
+"""
+So sánh 2 file kết quả benchmark (ghi bằng benchmarks.common.write_results) để bắt hồi quy giữa các phiên bản.
+
+Chỉ so các chỉ số p50/p95/p99 (càng thấp càng tốt) và throughput (càng cao càng tốt).
+Chỉ số nào tệ hơn quá --tolerance (mặc định 10%) bị đánh dấu REGRESSION → exit code 1 (dùng trong CI).
+
+Chạy:
+    python -m benchmarks.compare results/baseline.json results/candidate.json --tolerance 0.15
+"""
+import argparse
+import json
+import sys
+
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms")
+HIGHER_IS_BETTER = ("throughput_per_s",)
+ROW_KEYS = ("size", "stored", "rows", "threshold", "threads", "models_warmup")
+
+
+def flatten(node, prefix: str = "") -> dict:
+    """Dàn phẳng kết quả thành {đường dẫn: giá trị}; phần tử list được gọi theo size/rows... nếu có."""
+    flat = {}
+    if isinstance(node, dict):
+        for key, value in node.items():
+            flat.update(flatten(value, f"{prefix}.{key}" if prefix else str(key)))
+    elif isinstance(node, list):
+        for index, value in enumerate(node):
+            key = next((f"{k}={value[k]}" for k in ROW_KEYS if isinstance(value, dict) and k in value), str(index))
+            flat.update(flatten(value, f"{prefix}[{key}]"))
+    elif isinstance(node, (int, float)) and not isinstance(node, bool):
+        flat[prefix] = float(node)
+    return flat
+
+
+def compare(baseline: dict, candidate: dict, tolerance: float) -> list:
+    base, cand = flatten(baseline["results"]), flatten(candidate["results"])
+    rows = []
+    for path in sorted(set(base) & set(cand)):
+        metric = path.rsplit(".", 1)[-1]
+        if metric in LOWER_IS_BETTER:
+            worse = cand[path] > base[path] * (1 + tolerance)
+        elif metric in HIGHER_IS_BETTER:
+            worse = cand[path] < base[path] * (1 - tolerance)
+        else:
+            continue
+        change = (cand[path] - base[path]) / base[path] if base[path] else 0.0
+        rows.append({"metric": path, "baseline": base[path], "candidate": cand[path], "change": change,
+                     "regression": worse})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="mức tệ hơn cho phép (0.1 = 10%%)")
+    parser.add_argument("--only-regressions", action="store_true")
+    args = parser.parse_args()
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.candidate, encoding="utf-8") as f:
+        candidate = json.load(f)
+    if baseline.get("benchmark") != candidate.get("benchmark"):
+        sys.exit(f"Khác loại benchmark: {baseline.get('benchmark')} vs {candidate.get('benchmark')}")
+
+    rows = compare(baseline, candidate, args.tolerance)
+    print(f"{baseline.get('revision')} → {candidate.get('revision')} ({baseline['benchmark']}, "
+          f"tolerance {args.tolerance:.0%})")
+    for row in rows:
+        if args.only_regressions and not row["regression"]:
+            continue
+        flag = "REGRESSION" if row["regression"] else ""
+        print(f"{row['metric']:<70} {row['baseline']:>12.3f} → {row['candidate']:>12.3f} "
+              f"({row['change']:+.1%}) {flag}")
+    regressions = sum(row["regression"] for row in rows)
+    print(f"{regressions} hồi quy / {len(rows)} chỉ số")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
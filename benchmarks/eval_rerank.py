@@ -0,0 +1,134 @@
+"""
+Đánh giá search_memory: chỉ cosine (bi-encoder) vs cosine + rerank CrossEncoder.
+
+Nạp các lượt trong benchmarks/data/memory_eval.json vào 1 collection Chroma tạm, chạy từng câu truy vấn
+ở cả 2 chế độ rồi quét ngưỡng, báo cáo:
+  - precision : trong các lượt được coi là "trùng", tỉ lệ trả đúng câu trả lời
+  - recall    : trong các câu có lượt trùng thật, tỉ lệ được trả đúng (= số lần tránh được gọi Azure)
+  - false_hits: số lần trả câu trả lời SAI (người dùng nhận câu trả lời cũ không liên quan)
+  - p50/p95/p99 độ trễ search_memory (ms)
+  - suggested: ngưỡng thấp nhất (recall cao nhất) không có false hit của từng chế độ
+    → cosine giữ 0.7, rerank dùng làm RERANK_HIT_THRESHOLD (2 thang điểm khác nhau)
+Ở chế độ rerank, câu nào bị bỏ qua rerank (quá ngân sách) được chấm bằng cosine → không tính khi quét ngưỡng.
+
+Chạy:
+    python -m benchmarks.eval_rerank --thresholds 0.5 0.7 0.9 --budget-ms 150
+"""
+import argparse
+import json
+import os
+import time
+
+from benchmarks.common import latency_summary, offline_env, write_results
+
+for _name, _value in offline_env().items():
+    os.environ.setdefault(_name, _value)
+
+DEFAULT_DATA = os.path.join(os.path.dirname(__file__), "data", "memory_eval.json")
+SESSION_ID = "memory-eval"
+
+
+def run_mode(chat_service, queries: list, memory: list, rerank: bool) -> list:
+    """Chạy search_memory (threshold=0) cho từng câu, trả về [(dự đoán, score, ms, bộ chấm)]."""
+    rows = []
+    for q in queries:
+        start = time.perf_counter()
+        doc, score, scorer = chat_service.search_memory(SESSION_ID, q["query"], threshold=0.0, rerank=rerank,
+                                                         return_scorer=True)
+        elapsed = (time.perf_counter() - start) * 1000
+        predicted = next((i for i, m in enumerate(memory) if m["answer"] in doc), None)
+        rows.append((predicted, score, elapsed, scorer))
+    return rows
+
+
+def score_threshold(queries: list, rows: list, threshold: float) -> dict:
+    hits = correct = false_hits = 0
+    positives = sum(1 for q in queries if q["match"] is not None)
+    for q, (predicted, score, _, _) in zip(queries, rows):
+        if score < threshold:
+            continue
+        hits += 1
+        if predicted is not None and predicted == q["match"]:
+            correct += 1
+        else:
+            false_hits += 1
+    return {
+        "threshold": threshold,
+        "hits": hits,
+        "precision": correct / hits if hits else None,
+        "recall": correct / positives if positives else None,
+        "false_hits": false_hits,
+    }
+
+
+def suggest_threshold(rows: list) -> float:
+    """Ngưỡng thấp nhất trong các ngưỡng đã quét mà không có false hit (None nếu không có)."""
+    safe = [row["threshold"] for row in rows if row["false_hits"] == 0 and row["hits"]]
+    return min(safe) if safe else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default=DEFAULT_DATA)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.6, 0.7, 0.8, 0.9])
+    parser.add_argument("--budget-ms", type=float, default=None, help="ghi đè RERANK_BUDGET_MS")
+    parser.add_argument("--candidates", type=int, default=None, help="ghi đè RERANK_CANDIDATES")
+    parser.add_argument("--json", help="ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    if args.budget_ms is not None:
+        os.environ["RERANK_BUDGET_MS"] = str(args.budget_ms)
+    if args.candidates is not None:
+        os.environ["RERANK_CANDIDATES"] = str(args.candidates)
+
+    from api.services import chat_service
+    from api.services.chroma_client import chroma_client
+    from api.services.model_registry import registry
+
+    with open(args.data, encoding="utf-8") as f:
+        data = json.load(f)
+    memory, queries = data["memory"], data["queries"]
+
+    # Collection tạm để không đụng dữ liệu thật
+    name = f"memory_eval_{os.getpid()}"
+    chat_service.collection = chroma_client.get_or_create_collection(name)
+    try:
+        chat_service.save_turns_to_chroma([(SESSION_ID, m["question"], m["answer"], i) for i, m in enumerate(memory)])
+        registry.warmup(["embedder", "reranker"])
+        run_mode(chat_service, queries[:3], memory, rerank=True)  # làm nóng batcher + EWMA
+
+        results = {}
+        print(f"{'mode':<8} | {'thr':>4} | {'hits':>4} | {'precision':>9} | {'recall':>6} | {'false':>5} | "
+              f"{'p50 ms':>7} | {'p95 ms':>7}")
+        for mode, rerank in (("cosine", False), ("rerank", True)):
+            rows = run_mode(chat_service, queries, memory, rerank)
+            latencies = [r[2] for r in rows]
+            scored = [(q, r) for q, r in zip(queries, rows) if r[3] == mode]
+            mode_queries, mode_rows = [q for q, _ in scored], [r for _, r in scored]
+            thresholds = [score_threshold(mode_queries, mode_rows, t) for t in args.thresholds]
+            results[mode] = {
+                "latency": latency_summary(latencies),
+                "scored": len(mode_rows),
+                "fallback_cosine": len(rows) - len(mode_rows),
+                "thresholds": thresholds,
+                "suggested": suggest_threshold(thresholds),
+            }
+            for row in results[mode]["thresholds"]:
+                precision = "-" if row["precision"] is None else f"{row['precision']:.3f}"
+                recall = "-" if row["recall"] is None else f"{row['recall']:.3f}"
+                print(f"{mode:<8} | {row['threshold']:>4.2f} | {row['hits']:>4} | {precision:>9} | {recall:>6} | "
+                      f"{row['false_hits']:>5} | {results[mode]['latency']['p50_ms']:>7.1f} | "
+                      f"{results[mode]['latency']['p95_ms']:>7.1f}")
+            print(f"{mode:<8} | suggested threshold: {results[mode]['suggested']} "
+                  f"(chấm bằng {mode}: {results[mode]['scored']}, fallback cosine: {results[mode]['fallback_cosine']})")
+        results["rerank_stats"] = chat_service.get_service_stats()["rerank"]
+        print(f"rerank: {results['rerank_stats']}")
+    finally:
+        chroma_client.delete_collection(name)
+
+    if args.json:
+        write_results(args.json, "eval_rerank", results, {k: v for k, v in vars(args).items() if k != "json"})
+
+
+if __name__ == "__main__":
+    main()
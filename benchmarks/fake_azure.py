@@ -0,0 +1,260 @@
+"""
+Server giả lập Azure OpenAI / OpenAI để benchmark và load test hoàn toàn offline.
+
+Hỗ trợ:
+  - POST /openai/deployments/{deployment}/chat/completions  (Azure, có stream=true)
+  - POST /openai/deployments/{deployment}/embeddings
+  - POST /v1/chat/completions, /v1/embeddings                (OpenAI, dùng với OPENAI_BASE_URL)
+  - GET/POST /_fake/config : xem/đổi cấu hình khi đang chạy; GET /_fake/stats; POST /_fake/reset
+
+Cấu hình: độ trễ (latency-ms ± jitter-ms), tỉ lệ lỗi 500 (error-rate), tỉ lệ 429 kèm retry-after
+(rate-limit-rate), tốc độ stream (stream-token-ms) và độ dài câu trả lời (completion-tokens).
+Câu trả lời và embedding được sinh tất định từ nội dung request (cùng câu hỏi → cùng kết quả).
+
+Chạy riêng:
+    python -m benchmarks.fake_azure --port 8081 --latency-ms 400 --jitter-ms 150 --error-rate 0.01
+rồi trỏ API vào:
+    AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8081 OPENAI_BASE_URL=http://127.0.0.1:8081/v1 uvicorn api.main:app
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import threading
+import time
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DEFAULT_CONFIG = {
+    "latency_ms": 300.0,        # thời gian tới token đầu / tới khi trả response
+    "jitter_ms": 100.0,         # ± ngẫu nhiên (phân bố đều)
+    "error_rate": 0.0,          # tỉ lệ trả 500
+    "rate_limit_rate": 0.0,     # tỉ lệ trả 429 (kèm header retry-after)
+    "retry_after_s": 1,
+    "stream_token_ms": 15.0,    # khoảng cách giữa các chunk khi stream
+    "completion_tokens": 60,    # số "token" (từ) của câu trả lời
+    "embedding_latency_ms": 20.0,
+    "embedding_dim": 1536,
+}
+
+WORDS = ("cuộc họp", "nhóm", "quyết định", "tiến độ", "hạn chót", "phụ trách", "sprint", "báo cáo",
+         "khách hàng", "rủi ro", "ngân sách", "kế hoạch", "tuần sau", "hoàn thành", "cần", "đã")
+
+
+def create_app(config: dict = None) -> FastAPI:
+    app = FastAPI(title="Fake Azure OpenAI")
+    cfg = {**DEFAULT_CONFIG, **(config or {})}
+    stats = {"chat": 0, "stream": 0, "embeddings": 0, "errors": 0, "rate_limited": 0, "cancelled": 0}
+    rng = random.Random(0)
+    app.state.config, app.state.stats = cfg, stats
+
+    async def delay(ms: float):
+        await asyncio.sleep(max(ms + rng.uniform(-cfg["jitter_ms"], cfg["jitter_ms"]), 0) / 1000)
+
+    def injected_error():
+        """Trả về response lỗi theo tỉ lệ cấu hình, hoặc None."""
+        roll = rng.random()
+        if roll < cfg["rate_limit_rate"]:
+            stats["rate_limited"] += 1
+            return JSONResponse(
+                {"error": {"code": "429", "message": "Rate limit is exceeded (fake)."}},
+                status_code=429,
+                headers={"retry-after": str(cfg["retry_after_s"]), "x-ratelimit-remaining-requests": "0"},
+            )
+        if roll < cfg["rate_limit_rate"] + cfg["error_rate"]:
+            stats["errors"] += 1
+            return JSONResponse({"error": {"code": "500", "message": "Internal error (fake)."}}, status_code=500)
+        return None
+
+    def reply_text(body: dict) -> str:
+        messages = body.get("messages") or [{}]
+        seed = hashlib.sha256(json.dumps(messages[-1], ensure_ascii=False).encode("utf-8")).digest()
+        if (body.get("response_format") or {}).get("type") == "json_object":
+            # Đủ trường cho MeetingSummarySchema (tóm tắt biên bản)
+            return json.dumps({
+                "meeting_title": None, "participants": [], "summary": "Tóm tắt giả lập.",
+                "key_points": [f"Ý chính {seed[0] % 10}"], "blockers": [], "next_action": [],
+            }, ensure_ascii=False)
+        n = min(int(cfg["completion_tokens"]), body.get("max_tokens") or 10_000)
+        return " ".join(WORDS[seed[i % len(seed)] % len(WORDS)] for i in range(max(n, 1)))
+
+    def usage(body: dict, text: str) -> dict:
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages") or []) // 4
+        completion_tokens = len(text.split())
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+    def ratelimit_headers() -> dict:
+        return {"x-ratelimit-remaining-requests": "1000", "x-ratelimit-remaining-tokens": "1000000",
+                "x-ratelimit-limit-requests": "1000", "x-ratelimit-limit-tokens": "1000000"}
+
+    async def chat_completions(request: Request, model: str):
+        body = await request.json()
+        if body.get("stream"):
+            return await stream_completions(body, model)
+        stats["chat"] += 1
+        await delay(cfg["latency_ms"])
+        error = injected_error()
+        if error is not None:
+            return error
+        text = reply_text(body)
+        return JSONResponse({
+            "id": f"chatcmpl-fake-{stats['chat']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": text}}],
+            "usage": usage(body, text),
+        }, headers=ratelimit_headers())
+
+    async def stream_completions(body: dict, model: str):
+        stats["stream"] += 1
+        await delay(cfg["latency_ms"])
+        error = injected_error()
+        if error is not None:
+            return error
+        words = reply_text(body).split(" ")
+
+        def chunk(delta: dict, finish=None) -> str:
+            return "data: " + json.dumps({
+                "id": "chatcmpl-fake-stream", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+            }, ensure_ascii=False) + "\n\n"
+
+        async def events():
+            try:
+                yield chunk({"role": "assistant", "content": ""})
+                for i, word in enumerate(words):
+                    yield chunk({"content": word if i == 0 else " " + word})
+                    await asyncio.sleep(cfg["stream_token_ms"] / 1000)
+                yield chunk({}, "stop")
+                yield "data: [DONE]\n\n"
+            except asyncio.CancelledError:
+                stats["cancelled"] += 1
+                raise
+
+        return StreamingResponse(events(), media_type="text/event-stream", headers=ratelimit_headers())
+
+    async def embeddings(request: Request, model: str):
+        body = await request.json()
+        stats["embeddings"] += 1
+        await delay(cfg["embedding_latency_ms"])
+        error = injected_error()
+        if error is not None:
+            return error
+        inputs = body.get("input")
+        inputs = [inputs] if isinstance(inputs, str) else list(inputs or [])
+        data = []
+        for i, text in enumerate(inputs):
+            seed = int.from_bytes(hashlib.sha256(str(text).encode("utf-8")).digest()[:8], "little")
+            vec = np.random.default_rng(seed).standard_normal(int(cfg["embedding_dim"])).astype(np.float32)
+            data.append({"object": "embedding", "index": i, "embedding": (vec / np.linalg.norm(vec)).tolist()})
+        return JSONResponse({"object": "list", "data": data, "model": model,
+                             "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+
+    @app.post("/openai/deployments/{deployment}/chat/completions")
+    async def azure_chat(deployment: str, request: Request):
+        return await chat_completions(request, deployment)
+
+    @app.post("/openai/deployments/{deployment}/embeddings")
+    async def azure_embeddings(deployment: str, request: Request):
+        return await embeddings(request, deployment)
+
+    @app.post("/v1/chat/completions")
+    async def openai_chat(request: Request):
+        return await chat_completions(request, "gpt-4o-mini")
+
+    @app.post("/v1/embeddings")
+    async def openai_embeddings(request: Request):
+        return await embeddings(request, "text-embedding-3-small")
+
+    @app.get("/_fake/config")
+    def get_config():
+        return cfg
+
+    @app.post("/_fake/config")
+    async def set_config(request: Request):
+        updates = await request.json()
+        unknown = set(updates) - set(DEFAULT_CONFIG)
+        if unknown:
+            return JSONResponse({"error": f"Không có tham số: {sorted(unknown)}"}, status_code=400)
+        cfg.update({k: type(DEFAULT_CONFIG[k])(v) for k, v in updates.items()})
+        return cfg
+
+    @app.get("/_fake/stats")
+    def get_stats():
+        return stats
+
+    @app.post("/_fake/reset")
+    def reset_stats():
+        for key in stats:
+            stats[key] = 0
+        return stats
+
+    return app
+
+
+class FakeAzureServer:
+    """Chạy fake server trong 1 thread nền (dùng trong load test / microbenchmark)."""
+
+    def __init__(self, port: int = 0, config: dict = None, host: str = "127.0.0.1"):
+        import uvicorn
+
+        self.app = create_app(config)
+        self.server = uvicorn.Server(uvicorn.Config(self.app, host=host, port=port, log_level="warning",
+                                                    access_log=False))
+        self.host = host
+        self._thread = threading.Thread(target=self.server.run, name="fake-azure", daemon=True)
+
+    @property
+    def url(self) -> str:
+        port = self.server.servers[0].sockets[0].getsockname()[1]
+        return f"http://{self.host}:{port}"
+
+    def start(self) -> "FakeAzureServer":
+        self._thread.start()
+        deadline = time.time() + 10
+        while not self.server.started:
+            if time.time() > deadline or not self._thread.is_alive():
+                raise RuntimeError("Không khởi động được fake Azure server")
+            time.sleep(0.02)
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+        self._thread.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def config_from_args(args) -> dict:
+    return {key: getattr(args, key) for key in DEFAULT_CONFIG if getattr(args, key, None) is not None}
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    for key, default in DEFAULT_CONFIG.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(default), default=None,
+                            help=f"mặc định {default}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run(create_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
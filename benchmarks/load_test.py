@@ -0,0 +1,210 @@
+"""
+Load test offline cho API: /api/chat, /api/sessions, /api/chat/{id}.
+
+Mặc định tự dựng mọi thứ:
+  1. fake Azure OpenAI (benchmarks/fake_azure.py) trong thread nền, độ trễ/lỗi cấu hình được
+  2. API thật (uvicorn api.main:app) trong tiến trình con, trỏ vào fake server, DB SQLite tạm
+  3. N người dùng ảo chạy song song trong `--duration` giây, mỗi người có session riêng,
+     một phần câu hỏi lặp lại (--repeat-rate) để đi qua nhánh dùng lại trí nhớ
+
+Kết quả: p50/p95/p99 + throughput theo endpoint, tỉ lệ lỗi, thống kê của fake server và /api/stats.
+
+Chạy:
+    python -m benchmarks.load_test --users 16 --duration 30 --latency-ms 400 --json results/load.json
+    python -m benchmarks.load_test --target http://127.0.0.1:8000   # server đang chạy sẵn (không dựng gì)
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.common import latency_summary, offline_env, write_results
+from benchmarks.fake_azure import FakeAzureServer, add_config_arguments, config_from_args
+
+QUESTIONS = [
+    "Tóm tắt giúp tôi nội dung cuộc họp hôm nay",
+    "Ai phụ trách phần tích hợp thanh toán?",
+    "Hạn chót của sprint này là khi nào?",
+    "Liệt kê các rủi ro đã được nêu",
+    "Viết lại phần kết luận ngắn gọn hơn",
+    "Những việc cần làm trong tuần sau là gì?",
+    "Khách hàng đã phản hồi gì về bản demo?",
+    "Ngân sách quý này còn bao nhiêu?",
+]
+ACTIONS = ("chat", "sessions", "history")
+
+
+def start_api(fake_url: str, port: int, workers: int, extra_env: dict) -> subprocess.Popen:
+    """Chạy API thật trong tiến trình con, dữ liệu ghi vào thư mục tạm."""
+    data_dir = tempfile.mkdtemp(prefix="load_test_")
+    env = {
+        **os.environ,
+        **offline_env(fake_url),
+        "OPENAI_BASE_URL": f"{fake_url}/v1",
+        "CONVERSATION_DB_PATH": os.path.join(data_dir, "conversation.db"),
+        # Chroma trên đĩa chỉ dùng được từ 1 tiến trình → nhiều worker thì mỗi worker giữ trí nhớ trong RAM
+        "CHROMA_PERSIST_DIR": os.path.join(data_dir, "chroma") if workers == 1 else "",
+        "EMBEDDING_CACHE_PATH": "",
+        "DISABLED_MODELS": "tts",
+        **extra_env,
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api.main:app", "--port", str(port), "--workers", str(workers),
+         "--log-level", "warning", "--no-access-log"],
+        env=env,
+    )
+
+
+async def wait_ready(client: httpx.AsyncClient, process: subprocess.Popen = None, timeout: float = 300):
+    """Chờ API trả lời GET / (lifespan load model có thể mất vài chục giây)."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"API thoát sớm (exit code {process.returncode})")
+        try:
+            if (await client.get("/")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise TimeoutError("API không sẵn sàng")
+
+
+class VirtualUser:
+    def __init__(self, index: int, client: httpx.AsyncClient, args, record):
+        self.client, self.args, self.record = client, args, record
+        self.rng = random.Random(index)
+        self.session_id = f"load-{os.getpid()}-{index}"
+        self.asked = []
+
+    def next_question(self) -> str:
+        if self.asked and self.rng.random() < self.args.repeat_rate:
+            return self.rng.choice(self.asked)
+        question = f"{self.rng.choice(QUESTIONS)} (#{self.rng.randrange(10_000)})"
+        self.asked.append(question)
+        return question
+
+    async def step(self):
+        action = self.rng.choices(ACTIONS, weights=self.args.weights)[0]
+        if action == "chat":
+            label, call = "POST /api/chat", self.client.post(
+                "/api/chat", json={"message": self.next_question(), "session_id": self.session_id})
+        elif action == "sessions":
+            label, call = "GET /api/sessions", self.client.get("/api/sessions", params={"limit": 50})
+        else:
+            label, call = "GET /api/chat/{id}", self.client.get(f"/api/chat/{self.session_id}",
+                                                               params={"limit": 50})
+        start = time.perf_counter()
+        try:
+            status = (await call).status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        self.record(label, (time.perf_counter() - start) * 1000, status)
+
+    async def run(self, until: float):
+        while time.perf_counter() < until:
+            await self.step()
+            if self.args.think_ms:
+                await asyncio.sleep(self.rng.expovariate(1000 / self.args.think_ms))
+
+
+async def run_load(args, base_url: str, process: subprocess.Popen = None) -> dict:
+    samples, errors = {}, {}
+    recording = {"on": False}
+
+    def record(label, ms, status):
+        if not recording["on"]:
+            return
+        samples.setdefault(label, []).append(ms)
+        if status != 200:
+            errors.setdefault(label, {}).setdefault(str(status), 0)
+            errors[label][str(status)] += 1
+
+    limits = httpx.Limits(max_connections=args.users * 2, max_keepalive_connections=args.users)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        await wait_ready(client, process)
+        users = [VirtualUser(i, client, args, record) for i in range(args.users)]
+
+        # Làm nóng (không ghi nhận): model, cache, connection pool
+        await asyncio.gather(*(u.run(time.perf_counter() + args.warmup) for u in users))
+        recording["on"] = True
+        start = time.perf_counter()
+        await asyncio.gather(*(u.run(start + args.duration) for u in users))
+        elapsed = time.perf_counter() - start
+        recording["on"] = False
+
+        try:
+            service_stats = (await client.get("/api/stats")).json()
+        except (httpx.HTTPError, ValueError):
+            service_stats = None
+
+    endpoints = {}
+    for label, latencies in sorted(samples.items()):
+        endpoints[label] = {**latency_summary(latencies, elapsed), "errors": errors.get(label, {})}
+        endpoints[label]["error_rate"] = sum(errors.get(label, {}).values()) / len(latencies)
+    total = sum(len(v) for v in samples.values())
+    return {
+        "seconds": elapsed,
+        "requests": total,
+        "throughput_per_s": total / elapsed if elapsed else None,
+        "endpoints": endpoints,
+        "service_stats": service_stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", help="URL của API đang chạy (bỏ qua việc dựng fake Azure + API)")
+    parser.add_argument("--port", type=int, default=8765, help="cổng cho API tự dựng")
+    parser.add_argument("--workers", type=int, default=1, help="số worker uvicorn của API tự dựng")
+    parser.add_argument("--users", type=int, default=16, help="số người dùng ảo chạy song song")
+    parser.add_argument("--duration", type=float, default=30, help="thời gian đo (giây)")
+    parser.add_argument("--warmup", type=float, default=5, help="thời gian làm nóng, không tính (giây)")
+    parser.add_argument("--think-ms", type=float, default=0, help="thời gian nghỉ trung bình giữa 2 request")
+    parser.add_argument("--repeat-rate", type=float, default=0.3, help="tỉ lệ hỏi lại câu đã hỏi")
+    parser.add_argument("--weights", type=float, nargs=3, default=[0.7, 0.15, 0.15],
+                        metavar=("CHAT", "SESSIONS", "HISTORY"), help="tỉ trọng các loại request")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--api-env", nargs="*", default=[], metavar="KEY=VALUE",
+                        help="biến môi trường thêm cho API tự dựng (vd: HEDGED_LLM=true)")
+    parser.add_argument("--json", help="ghi kết quả ra file JSON")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    fake, process = None, None
+    base_url = args.target
+    try:
+        if base_url is None:
+            fake = FakeAzureServer(config=config_from_args(args)).start()
+            process = start_api(fake.url, args.port, args.workers,
+                                dict(item.split("=", 1) for item in args.api_env))
+            base_url = f"http://127.0.0.1:{args.port}"
+        results = asyncio.run(run_load(args, base_url, process))
+        if fake is not None:
+            results["fake_azure"] = {"config": dict(fake.app.state.config), "stats": dict(fake.app.state.stats)}
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        if fake is not None:
+            fake.stop()
+
+    print(f"{results['requests']} request trong {results['seconds']:.1f}s → {results['throughput_per_s']:.1f} req/s")
+    print(f"{'endpoint':<20} | {'count':>6} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8} | {'req/s':>7} | {'err':>6}")
+    for label, row in results["endpoints"].items():
+        print(f"{label:<20} | {row['count']:>6} | {row['p50_ms']:>8.1f} | {row['p95_ms']:>8.1f} | "
+              f"{row['p99_ms']:>8.1f} | {row['throughput_per_s']:>7.1f} | {row['error_rate']:>6.2%}")
+
+    if args.json:
+        params = {k: v for k, v in vars(args).items() if k != "json"}
+        write_results(args.json, "load_test", results, params)
+
+
+if __name__ == "__main__":
+    main()
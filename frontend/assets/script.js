@@ -3,13 +3,15 @@ let currentSession = null;
 // ===============================
 // Lấy danh sách session từ backend
 // ===============================
-async function renderSessionList() {
+async function renderSessionList(cursor = null) {
   const ul = document.getElementById("sessionList");
-  ul.innerHTML = "";
+  if (!cursor) ul.innerHTML = "";
 
   try {
-    const res = await fetch("http://127.0.0.1:8000/api/sessions");
-    const sessions = await res.json(); // [{id, name}, ...]
+    const url = "http://127.0.0.1:8000/api/sessions?limit=50" + (cursor ? `&cursor=${encodeURIComponent(cursor)}` : "");
+    const res = await fetch(url);
+    const sessions = await res.json(); // [{id, name, message_count, first_at, last_at}, ...]
+    const nextCursor = res.headers.get("X-Next-Cursor");
     sessions.forEach(session => {
       const li = document.createElement("li");
       li.style.display = "flex";
@@ -49,6 +51,18 @@ async function renderSessionList() {
 
       ul.appendChild(li);
     });
+
+    // Còn trang sau → nút tải thêm
+    if (nextCursor) {
+      const more = document.createElement("li");
+      more.textContent = "Xem thêm...";
+      more.style.cursor = "pointer";
+      more.onclick = () => {
+        more.remove();
+        renderSessionList(nextCursor);
+      };
+      ul.appendChild(more);
+    }
   } catch (error) {
     console.error("⚠️ Lỗi khi lấy danh sách session:", error);
   }
@@ -106,8 +120,8 @@ async function renderChat() {
           audioEl.style.maxWidth = "400px";
 
           const source = document.createElement("source");
-          source.src = msg.audio_path;
-          source.type = "audio/wav";
+          source.src = audioUrl(msg.audio_path);
+          source.type = audioType(msg.audio_path);
           audioEl.appendChild(source);
 
           audioDiv.appendChild(audioEl);
@@ -178,33 +192,108 @@ async function sendMessage() {
   userInput.value = "";
   userInput.style.height = "auto";
 
+  // Khung tin nhắn AI, token sẽ được nối dần vào khi stream về
+  const aiDiv = document.createElement("div");
+  aiDiv.className = "msg ai";
+  const preAi = document.createElement("pre");
+  aiDiv.appendChild(preAi);
+  chatDiv.appendChild(aiDiv);
+
   try {
-    const response = await fetch("http://127.0.0.1:8000/api/chat", {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ message: msg, session_id: currentSession, tts: tts })
+    // Bật TTS → server lưu file audio cùng lượt chat (mở lại session vẫn nghe được)
+    await streamChat({ message: msg, session_id: currentSession, tts: tts }, (event, data) => {
+      if (event === "token") {
+        preAi.textContent += data.token;
+        chatDiv.scrollTop = chatDiv.scrollHeight;
+      } else if (event === "done") {
+        preAi.textContent = data.reply;
+        if (data.audio_path) appendAudio(aiDiv, data.audio_path).play().catch(() => {});
+        currentSession = data.session_id;
+      } else if (event === "error") {
+        preAi.style.color = "red";
+        preAi.textContent = "⚠️ " + data.message;
+      }
     });
-    const data = await response.json();
-    const reply = data.reply;
-    const audio_path = data.audio_path || null;
-
-    // Append AI message chuẩn
-    appendAiMessage(reply, audio_path);
-
-    currentSession = data.session_id;
     renderSessionList(); // refresh danh sách session
   } catch (error) {
-    const errorDiv = document.createElement("div");
-    errorDiv.className = "msg ai";
-    errorDiv.style.color = "red";
-    const preError = document.createElement("pre");
-    preError.textContent = "⚠️ Lỗi: Không kết nối được server";
-    errorDiv.appendChild(preError);
-    chatDiv.appendChild(errorDiv);
+    aiDiv.style.color = "red";
+    preAi.textContent = "⚠️ Lỗi: Không kết nối được server";
     chatDiv.scrollTop = chatDiv.scrollHeight;
   }
 }
 
+// ===============================
+// Gọi /api/chat/stream và đọc Server-Sent Events
+// ===============================
+async function streamChat(body, onEvent) {
+  const response = await fetch("http://127.0.0.1:8000/api/chat/stream", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(body)
+  });
+  await readSse(response, onEvent);
+}
+
+// Đọc body dạng Server-Sent Events, gọi onEvent(event, data) cho từng event
+async function readSse(response, onEvent) {
+  if (!response.ok || !response.body) throw new Error(`HTTP ${response.status}`);
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // Mỗi event kết thúc bằng một dòng trống
+    let sep;
+    while ((sep = buffer.indexOf("\n\n")) !== -1) {
+      const raw = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+
+      let event = "message";
+      let data = "";
+      for (const line of raw.split("\n")) {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) data += line.slice(5).trim();
+      }
+      if (data) onEvent(event, JSON.parse(data));
+    }
+  }
+}
+
+// audio_path từ backend dạng /audio/<file> (phục vụ bởi API)
+function audioUrl(audio_path) {
+  return audio_path.startsWith("/audio/") ? "http://127.0.0.1:8000" + audio_path : audio_path;
+}
+
+function audioType(audio_path) {
+  const types = { ogg: "audio/ogg", mp3: "audio/mpeg", wav: "audio/wav" };
+  return types[audio_path.split(".").pop().toLowerCase()] || "audio/wav";
+}
+
+// Thêm audio control vào dưới tin nhắn AI, trả về thẻ <audio>
+function appendAudio(aiDiv, audio_path) {
+  const audioDiv = document.createElement("div");
+  audioDiv.style.marginTop = "10px";
+
+  const audioEl = document.createElement("audio");
+  audioEl.controls = true;
+  audioEl.style.width = "100%";
+  audioEl.style.maxWidth = "400px";
+
+  const source = document.createElement("source");
+  source.src = audioUrl(audio_path);
+  source.type = audioType(audio_path);
+  audioEl.appendChild(source);
+
+  audioDiv.appendChild(audioEl);
+  aiDiv.appendChild(audioDiv);
+  return audioEl;
+}
+
 // Hàm append AI message chuẩn
 function appendAiMessage(reply, audio_path=null) {
   const chatDiv = document.getElementById("chat");
@@ -226,8 +315,8 @@ function appendAiMessage(reply, audio_path=null) {
     audioEl.style.maxWidth = "400px";
 
     const source = document.createElement("source");
-    source.src = audio_path;
-    source.type = "audio/wav";
+    source.src = audioUrl(audio_path);
+    source.type = audioType(audio_path);
     audioEl.appendChild(source);
 
     audioDiv.appendChild(audioEl);
@@ -303,8 +392,8 @@ function appendAiMessage(reply, audio_path=null) {
     audioEl.style.maxWidth = "400px";
 
     const source = document.createElement("source");
-    source.src = audio_path;
-    source.type = "audio/wav";
+    source.src = audioUrl(audio_path);
+    source.type = audioType(audio_path);
     audioEl.appendChild(source);
 
     audioDiv.appendChild(audioEl);